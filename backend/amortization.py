@@ -0,0 +1,215 @@
+from collections import namedtuple
+from itertools import repeat
+
+import numpy as np
+
+from db import get_db_connection, add_payments_bulk
+
+PERIODS_PER_YEAR = {'weekly': 52, 'bi-weekly': 26, 'monthly': 12}
+DAYS_PER_PERIOD = {'weekly': 7, 'bi-weekly': 14}
+DECIMALS = 9  # loan amounts are SOL, so keep lamport precision
+SQL_IN_CHUNK = 500
+
+# One entry per installment, flattened across loans; loan_index points back
+# into the arrays passed to amortize()
+Schedule = namedtuple('Schedule', [
+    'loan_index', 'installment', 'due_date', 'amount_due', 'principal', 'interest', 'balance',
+])
+
+
+def _lookup(frequency, table):
+    frequency = np.asarray(frequency)
+    out = np.zeros(frequency.shape, dtype=np.int64)
+    for name, value in table.items():
+        out[frequency == name] = value
+    return out
+
+def periods_per_year(frequency):
+    ppy = _lookup(frequency, PERIODS_PER_YEAR)
+    if (ppy == 0).any():
+        bad = sorted(set(np.asarray(frequency)[ppy == 0].tolist()))
+        raise ValueError(f"Unknown payment frequency: {bad}")
+    return ppy
+
+def installment_counts(frequency, duration_in_months):
+    """Number of installments for a PaymentSchedules row (vectorized)."""
+    ppy = periods_per_year(frequency)
+    n = np.rint(np.asarray(duration_in_months, dtype=float) * ppy / 12)
+    return np.maximum(n, 1).astype(np.int64)
+
+def due_dates(frequency, start_date, installment):
+    """Due date of the k-th (1-based) installment after start_date.
+
+    Weekly and bi-weekly schedules step a fixed number of days; monthly ones
+    keep the start day of month, clamped to the length of shorter months.
+    """
+    frequency = np.asarray(frequency)
+    start = np.asarray(start_date, dtype='datetime64[D]')
+    k = np.asarray(installment, dtype=np.int64)
+
+    step = _lookup(frequency, DAYS_PER_PERIOD)
+    fixed = start + (k * step).astype('timedelta64[D]')
+
+    month0 = start.astype('datetime64[M]')
+    day = (start - month0.astype('datetime64[D]')).astype(np.int64)
+    month = month0 + k.astype('timedelta64[M]')
+    month_len = ((month + 1).astype('datetime64[D]') - month.astype('datetime64[D]')).astype(np.int64)
+    monthly = month.astype('datetime64[D]') + np.minimum(day, month_len - 1).astype('timedelta64[D]')
+
+    return np.where(frequency == 'monthly', monthly, fixed)
+
+def amortize(principal, annual_rate, frequency, n_installments, start_date):
+    """Level-payment amortization for one or many loans at once.
+
+    annual_rate is a percentage (5.2 means 5.2% a year), compounded once per
+    payment period. All arguments broadcast against each other. Amounts are
+    rounded to DECIMALS and the last installment absorbs the rounding so the
+    principal parts add up exactly to the loan amount.
+    """
+    principal, annual_rate, frequency, n, start = np.broadcast_arrays(
+        np.asarray(principal, dtype=float),
+        np.asarray(annual_rate, dtype=float),
+        np.asarray(frequency),
+        np.asarray(n_installments, dtype=np.int64),
+        np.asarray(start_date, dtype='datetime64[D]'),
+    )
+    principal, annual_rate, frequency, n, start = (a.ravel() for a in (principal, annual_rate, frequency, n, start))
+    if principal.size == 0:
+        empty = np.array([], dtype=float)
+        return Schedule(np.array([], dtype=np.int64), np.array([], dtype=np.int64),
+                        np.array([], dtype='datetime64[D]'), empty, empty, empty, empty)
+    if (n < 1).any():
+        raise ValueError("Every loan needs at least one installment")
+
+    rate = annual_rate / 100.0 / periods_per_year(frequency)
+    k = np.arange(1, n.max() + 1)
+    mask = k[None, :] <= n[:, None]
+    last = k[None, :] == n[:, None]
+
+    r = rate[:, None]
+    P = principal[:, None]
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        payment = np.where(rate > 0, principal * rate / (1 - (1 + rate) ** -n), principal / n)
+        A = payment[:, None]
+        growth = (1 + r) ** (k[None, :] - 1)
+        opening = np.where(r > 0, P * growth - A * (growth - 1) / r, P - A * (k[None, :] - 1))
+
+    interest = np.round(opening * r, DECIMALS)
+    amount = np.broadcast_to(np.round(A, DECIMALS), mask.shape)
+    principal_part = np.where(mask & ~last, amount - interest, 0.0)
+    principal_part = np.where(last, P - principal_part.sum(axis=1, keepdims=True), principal_part)
+    principal_part = np.round(principal_part, DECIMALS)
+    amount = np.where(last, principal_part + interest, amount)
+    balance = np.round(P - np.cumsum(principal_part, axis=1), DECIMALS)
+
+    loan_index, col = np.nonzero(mask)
+    installment = k[col]
+    return Schedule(
+        loan_index=loan_index,
+        installment=installment,
+        due_date=due_dates(frequency[loan_index], start[loan_index], installment),
+        amount_due=np.round(amount[mask], DECIMALS),
+        principal=principal_part[mask],
+        interest=interest[mask],
+        balance=balance[mask],
+    )
+
+
+def _execute_by_ids(conn, sql, ids):
+    """Run sql (with an `{ids}` placeholder for the IN list) over ids in chunks."""
+    ids = list(ids)
+    rows = []
+    for i in range(0, len(ids), SQL_IN_CHUNK):
+        chunk = ids[i:i + SQL_IN_CHUNK]
+        placeholders = ', '.join('?' * len(chunk))
+        rows.extend(conn.execute(sql.format(ids=placeholders), chunk).fetchall())
+    return rows
+
+def _payment_rows(transaction_ids, schedule):
+    return zip(
+        np.asarray(transaction_ids)[schedule.loan_index].tolist(),
+        schedule.due_date.astype(str).tolist(),
+        schedule.amount_due.tolist(),
+        repeat(0),
+        repeat('due'),
+        repeat(None),
+        schedule.principal.tolist(),
+        schedule.interest.tolist(),
+    )
+
+def generate_payment_schedules(transaction_ids, conn=None):
+    """Create the Payments rows for newly accepted Transactions.
+
+    Each loan is amortized from its Transactions row and PaymentSchedules
+    frequency/duration, with the first installment one period after the
+    transaction's created_at date. Returns the new payment ids. Pass conn to
+    write inside the caller's transaction.
+    """
+    if conn is None:
+        with get_db_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            return generate_payment_schedules(transaction_ids, conn)
+
+    rows = _execute_by_ids(conn, '''
+        SELECT t.transaction_id, t.loan_amount, t.interest_rate, s.frequency, s.duration_in_months, DATE(t.created_at)
+        FROM Transactions t
+        JOIN PaymentSchedules s ON s.schedule_id = t.payment_schedule_id
+        WHERE t.transaction_id IN ({ids})
+    ''', transaction_ids)
+    if not rows:
+        return []
+
+    tx_ids, amounts, rates, frequencies, durations, starts = (np.array(col) for col in zip(*rows))
+    schedule = amortize(amounts, rates, frequencies, installment_counts(frequencies, durations), starts)
+    return add_payments_bulk(_payment_rows(tx_ids, schedule), conn=conn)
+
+def reamortize_transactions(transaction_ids, interest_rate=None, conn=None):
+    """Rebuild the untouched outstanding installments of existing loans.
+
+    Paid and late installments are kept, and so are 'due' ones that already
+    carry a partial payment: their principal counts as covered and the rest
+    of them is still settled by pay_loan. The remaining principal is spread
+    over the same number of untouched 'due' installments at the loan's
+    current rate (or interest_rate, which is written to Transactions first),
+    starting one period after the last kept installment. Returns the new
+    payment ids.
+    """
+    if conn is None:
+        with get_db_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            return reamortize_transactions(transaction_ids, interest_rate, conn)
+
+    transaction_ids = list(transaction_ids)
+    if interest_rate is not None:
+        conn.executemany(
+            'UPDATE Transactions SET interest_rate = ? WHERE transaction_id = ?',
+            ((interest_rate, transaction_id) for transaction_id in transaction_ids),
+        )
+
+    # Installments that are rebuilt: 'due' with nothing paid toward them yet
+    replaced = "(p.payment_status = 'due' AND COALESCE(p.amount_paid, 0) = 0)"
+    rows = _execute_by_ids(conn, f'''
+        SELECT t.transaction_id,
+               t.loan_amount - COALESCE(SUM(CASE WHEN NOT {replaced} THEN p.principal_due END), 0),
+               t.interest_rate,
+               s.frequency,
+               SUM({replaced}),
+               COALESCE(MAX(CASE WHEN NOT {replaced} THEN p.due_date END), DATE(t.created_at))
+        FROM Transactions t
+        JOIN PaymentSchedules s ON s.schedule_id = t.payment_schedule_id
+        JOIN Payments p ON p.transaction_id = t.transaction_id
+        WHERE t.transaction_id IN ({{ids}})
+        GROUP BY t.transaction_id
+        HAVING SUM({replaced}) > 0
+    ''', transaction_ids)
+    if not rows:
+        return []
+
+    tx_ids, remaining, rates, frequencies, counts, anchors = (np.array(col) for col in zip(*rows))
+    _execute_by_ids(conn, '''
+        DELETE FROM Payments
+        WHERE payment_status = 'due' AND COALESCE(amount_paid, 0) = 0 AND transaction_id IN ({ids})
+    ''', tx_ids.tolist())
+
+    schedule = amortize(np.maximum(remaining.astype(float), 0), rates, frequencies, counts, anchors)
+    return add_payments_bulk(_payment_rows(tx_ids, schedule), conn=conn)
@@ -1,6 +1,8 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from db import get_post, get_user, get_payment_schedule, get_transaction, get_payment
+from db import get_post, get_user, get_payment_schedule, get_transaction, get_payment, get_db_connection, setup_database
+from db import get_posts_page, iter_posts, get_platform_stats, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX
+from db import run_write_transaction, is_busy_error
 from db import create_post, create_user, create_transaction, create_payment, update_user_solana_address, update_user_solana_private_key, add_payment_schedule
 import sqlite3
 from solders.keypair import Keypair
@@ -28,8 +30,15 @@ import requests
 import time
 import time
 from dotenv import load_dotenv
-from anchorpy_core.idl import Idl
-from idl import idl
+from solana_client import get_registry, get_balance_cache, get_blockhash_cache, get_loan_account_cache, LOAN_CONSISTENCY_LEVELS
+from solana_client import find_loan_accounts
+from async_runtime import get_background_loop, add_shutdown_hook
+from amortization import generate_payment_schedules
+from deploy import start_deployment, get_deployment
+from transfer_batcher import get_transfer_batcher
+from confirmation_tracker import get_confirmation_tracker
+from matching_engine import EPSILON, get_order_book
+from portfolio import run_portfolio_summary, run_lender_summaries
 from base58 import b58decode
 from functools import wraps
 from solders.sysvar import RENT as SYSVAR_RENT_PUBKEY
@@ -40,24 +49,60 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-CORS(app, resources={r"/api/*": {"origins": "*"}})
-
-# BPF Loader program ID (this is the standard BPF loader on Solana)
-BPF_LOADER_ID = Pubkey.from_string("BPFLoader2111111111111111111111111111111111")
-CHUNK_SIZE = 800
+CORS(app, resources={r"/api/*": {"origins": "*"}}, expose_headers=["X-Next-Cursor"])
 
 load_dotenv()  # Load .env file
 
+MAX_BALANCE_ADDRESSES = int(os.getenv('MAX_BALANCE_ADDRESSES', '500'))
+MAX_BATCH_TRANSFERS = int(os.getenv('MAX_BATCH_TRANSFERS', '1000'))
+PROGRAM_SO_PATH = os.getenv('PROGRAM_SO_PATH', '../anchor/target/deploy/sol_backend.so')
+# LoanAccount read consistency per endpoint ('cached' or 'fresh', see solana_client.py)
+LOAN_DETAILS_CONSISTENCY = os.getenv('LOAN_DETAILS_CONSISTENCY', 'cached')
+LOAN_PAYMENT_CONSISTENCY = os.getenv('LOAN_PAYMENT_CONSISTENCY', 'fresh')
+MAX_LOAN_LOOKUP = int(os.getenv('MAX_LOAN_LOOKUP', '500'))
+
+def start_services():
+    """Prepare the database and start the serving process's background services.
+
+    Importing app has no side effects; whatever serves requests (python
+    app.py, benchmark.py, load_testing.py's in-process client) calls this
+    once first.
+    """
+    # Build the Solana registry once at startup; routes that need it raise the
+    # same configuration error later if WALLET_PRIVATE_KEY/PROGRAM_ID are missing
+    try:
+        add_shutdown_hook(get_registry().close)
+        add_shutdown_hook(get_blockhash_cache().close)
+        add_shutdown_hook(get_loan_account_cache().close)
+    except Exception as e:
+        logger.warning(f"Solana client not initialised at startup: {str(e)}")
+
+    # Create tables, columns and indexes added since the database was created,
+    # resume tracking signatures a previous process left pending and load the
+    # open posts into the order book
+    try:
+        setup_database()
+        get_confirmation_tracker().ensure_running()
+        add_shutdown_hook(get_confirmation_tracker().close)
+        get_order_book().rebuild()
+    except Exception as e:
+        logger.warning(f"Database setup at startup failed: {str(e)}")
+
+# Async views run on one persistent background loop instead of a fresh
+# asyncio.run() loop per request, so the shared Solana client survives
+# between requests and concurrent requests' RPC calls overlap
+ASYNC_ROUTE_TIMEOUT = float(os.getenv('ASYNC_ROUTE_TIMEOUT', '120'))
+
 def async_route(f):
     @wraps(f)
     def wrapped(*args, **kwargs):
-        return asyncio.run(f(*args, **kwargs))
+        return get_background_loop().run(f(*args, **kwargs), timeout=ASYNC_ROUTE_TIMEOUT)
     return wrapped
 
 # check if there already exist a wallet for the User
 def check_existing_wallet(user_id):
     try:
-        conn = sqlite3.connect('loan_platform.db')
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
@@ -81,39 +126,13 @@ def check_existing_wallet(user_id):
 
 # Solana setup
 async def get_solana_client():
-    client = AsyncClient("https://api.devnet.solana.com")
-    
-    # Load wallet from .env
-    private_key_str = os.getenv('WALLET_PRIVATE_KEY')
-    private_key = json.loads(private_key_str)
-    wallet_keypair = Keypair.from_bytes(bytes(private_key))
-    
-    # Create Wallet wrapper that has the correct public_key property
-    from anchorpy.provider import Wallet, Provider
-    wallet = Wallet(wallet_keypair)
-    
-    # Load program ID from .env
-    program_id = Pubkey.from_string(os.getenv('PROGRAM_ID'))
-    
-    # Create provider
-    provider = Provider(client, wallet)
-    
-    # Update IDL with correct program ID
-    idl_copy = idl.copy()
-    idl_copy['metadata'] = {'address': str(program_id)}
-    
-    # Convert dictionary to proper Idl object
-    idl_obj = Idl.from_json(json.dumps(idl_copy))
-    
-    # Create program with proper Idl object
-    program = Program(idl_obj, program_id, provider)
-    
-    return client, program, wallet
+    # Shared client/program/wallet from the process registry (see solana_client.py)
+    return get_registry().get()
 
 # ✅ Existing API - Get a Single Loan
 @app.route('/api/loans/<int:loan_id>', methods=['GET'])
 def get_loan(loan_id):
-    conn = sqlite3.connect('loan_platform.db')
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM Loans WHERE loan_id = ?", (loan_id,))
     loan = cursor.fetchone()
@@ -131,50 +150,131 @@ def get_loan(loan_id):
     return jsonify({"error": "Loan not found"}), 404
 
 
+# Paged Posts listings. The body stays a plain JSON list (what the frontend
+# reads); the cursor for the next page comes back in X-Next-Cursor. With
+# ?stream=1 the whole result is streamed as one JSON array for exports.
+def _paged_posts_response(columns, serialize, join_users=False, **filters):
+    filters = {k: v for k, v in filters.items() if v is not None}
+    stream = request.args.get('stream', '').lower() in ('1', 'true')
+    try:
+        rows, next_cursor = get_posts_page(
+            columns,
+            cursor=request.args.get('cursor'),
+            limit=PAGE_SIZE_MAX if stream else request.args.get('limit', PAGE_SIZE_DEFAULT),
+            join_users=join_users,
+            **filters
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    if stream:
+        def generate():
+            yield '['
+            for i, row in enumerate(rows):
+                yield (',' if i else '') + json.dumps(serialize(row))
+            if next_cursor is not None:
+                for row in iter_posts(columns, cursor=next_cursor, join_users=join_users, **filters):
+                    yield ',' + json.dumps(serialize(row))
+            yield ']'
+        return Response(generate(), mimetype='application/json')
+
+    response = jsonify([serialize(row) for row in rows])
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
 # ✅ New API - Get All Loans
 @app.route('/api/loans', methods=['GET'])
 def get_loans():
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-
-    # Simplified Query (No Joins)
-    cursor.execute("SELECT loan_id, loan_amount, interest_rate, status FROM Loans WHERE status = 'open'")
-    loans = cursor.fetchall()
-    conn.close()
-
-    return jsonify([
-        {
-            "id": loan[0],
-            "loan_amount": loan[1],
-            "interest_rate": loan[2],
-            "status": loan[3]
-        }
-        for loan in loans
-    ])
+    return _paged_posts_response(
+        "p.post_id, p.loan_amount, p.interest_rate, p.status",
+        lambda post: {
+            "id": post[0],
+            "loan_amount": post[1],
+            "interest_rate": post[2],
+            "status": post[3]
+        },
+        status=request.args.get('status', 'open'),
+        post_type=request.args.get('post_type'),
+        user_id=request.args.get('user_id', type=int)
+    )
 
 
 @app.route('/api/activity', methods=['GET'])
 def get_activity():
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
+    return _paged_posts_response(
+        "p.post_type, p.loan_amount, p.status, u.email",
+        lambda post: {
+            "type": post[0],                # borrow/lend
+            "details": f"Loan of ${post[1]} ({post[2]}) by {post[3]}"
+        },
+        join_users=True,
+        status=request.args.get('status'),
+        post_type=request.args.get('post_type'),
+        user_id=request.args.get('user_id', type=int)
+    )
+
+
+# Headline platform numbers, read from the trigger-maintained PlatformStats
+# table instead of scanning the tables
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    try:
+        stats = get_platform_stats()
+        transactions = stats['Transactions']
+        payments = stats['Payments']
+        return jsonify({
+            'success': True,
+            'users': stats['Users']['count'],
+            'posts': {
+                'count': stats['Posts']['count'],
+                'volume': stats['Posts']['amount'],
+                'by_status': stats['Posts']['by_status']
+            },
+            'transactions': {
+                'count': transactions['count'],
+                'volume': transactions['amount'],
+                'average_loan': transactions['amount'] / transactions['count'] if transactions['count'] else 0,
+                'by_status': transactions['by_status']
+            },
+            'payments': {
+                'count': payments['count'],
+                'amount_due': payments['amount'],
+                'amount_paid': payments['paid'],
+                'by_status': payments['by_status']
+            }
+        })
+    except Exception as e:
+        logger.error(f"Error reading platform stats: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-    # Example: Fetch user's loans as activity
-    cursor.execute("""
-        SELECT l.loan_type, l.loan_amount, l.status
-        FROM Loans l
-        JOIN Users u ON l.user_id = u.user_id
-        ORDER BY l.created_at DESC
-    """)
-    activities = cursor.fetchall()
-    conn.close()
+# Outstanding principal, accrued interest, expected cash flows and yields,
+# computed with NumPy; large portfolios run in portfolio.py's process pool
+def _portfolio_response(fn, *args):
+    try:
+        return jsonify({'success': True, **fn(*args)})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except TimeoutError:
+        return jsonify({'success': False, 'error': 'Portfolio analytics timed out, try again.'}), 504
+    except Exception as e:
+        logger.error(f"Error computing portfolio analytics: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-    return jsonify([
-        {
-            "type": loan[0],                # borrow/lend
-            "details": f"Loan of ${loan[1]} ({loan[2]}) by {loan[3]}"
-        }
-        for loan in activities
-    ])
+@app.route('/api/portfolio', methods=['GET'])
+def get_platform_portfolio():
+    return _portfolio_response(run_portfolio_summary, None, request.args.get('as_of'))
+
+@app.route('/api/portfolio/lenders', methods=['GET'])
+def get_lender_portfolios():
+    limit = min(max(request.args.get('limit', PAGE_SIZE_DEFAULT, type=int), 1), PAGE_SIZE_MAX)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    return _portfolio_response(run_lender_summaries, request.args.get('as_of'), limit, offset)
+
+@app.route('/api/portfolio/<int:lender_id>', methods=['GET'])
+def get_lender_portfolio(lender_id):
+    return _portfolio_response(run_portfolio_summary, lender_id, request.args.get('as_of'))
 
 
 # ✅ Generate a test solana wallet given userID and Store it in the DB
@@ -211,7 +311,7 @@ def generate_wallet(user_id):
             print(wallet_data)
             
             # Update user record with wallet information
-            conn = sqlite3.connect('loan_platform.db')
+            conn = get_db_connection()
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -273,7 +373,7 @@ def create_account():
 
 def get_user_id_by_email(email):
     try:
-        conn = sqlite3.connect('loan_platform.db')
+        conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT user_id FROM Users WHERE email = ?", (email,))
         user_id = cursor.fetchone()[0]
@@ -335,8 +435,9 @@ async def make_payment(loan_pda):
         program = Program(program.idl, program.program_id, provider)
         
         # Fetch and validate loan account
+        loan_cache = get_loan_account_cache()
         try:
-            loan_account = await program.account["LoanAccount"].fetch(loan_pda_pubkey)
+            loan_account = await loan_cache.get(program, loan_pda_pubkey, LOAN_PAYMENT_CONSISTENCY)
             
             if not loan_account.is_active:
                 return jsonify({
@@ -357,7 +458,7 @@ async def make_payment(loan_pda):
         
         ctx = Context(
             accounts={
-                'loanAccount': loan_pda_pubkey,
+                'loan_account': loan_pda_pubkey,
                 'lender': lender,
                 'borrower': borrower_keypair.pubkey(),
                 'system_program': SYS_PROGRAM_ID,
@@ -376,16 +477,24 @@ async def make_payment(loan_pda):
         )
         
         logger.info(f"Payment transaction sent: {tx}")
+        # Drop the cached loan now and again once the payment lands, so
+        # readers don't keep seeing the pre-payment state
+        loan_cache.invalidate(loan_pda_pubkey)
+        get_confirmation_tracker().track(
+            tx, 'payment', on_resolved=lambda _: loan_cache.invalidate(loan_pda_pubkey))
         
-        # Fetch updated loan info
-        updated_loan = await program.account["LoanAccount"].fetch(loan_pda_pubkey)
+        # Loan state as it will be once the payment lands (the program
+        # closes the loan when it is fully paid); re-fetching now would
+        # only return the unconfirmed, pre-payment account
+        paid_amount = loan_account.paid_amount + payment_amount
         
         return jsonify({
             'success': True,
             'transaction': str(tx),
+            'status': 'pending',
             'loanStatus': {
-                'paidAmount': str(updated_loan.paid_amount),
-                'isActive': updated_loan.is_active
+                'paidAmount': str(paid_amount),
+                'isActive': paid_amount < loan_account.amount
             }
         })
         
@@ -395,31 +504,118 @@ async def make_payment(loan_pda):
 
 # Get loan details endpoint
 @app.route('/api/loans/<loan_pda>', methods=['GET'])
+@async_route
 async def get_loan_details(loan_pda):
     try:
         client, program, wallet = await get_solana_client()
         
-        loan_account = await program.account["LoanAccount"].fetch(
-            Pubkey.from_string(loan_pda)
+        # ?consistency=fresh skips the cache for callers that need the
+        # node's current state
+        consistency = request.args.get('consistency', LOAN_DETAILS_CONSISTENCY)
+        if consistency not in LOAN_CONSISTENCY_LEVELS:
+            return jsonify({'success': False, 'error': f"consistency must be one of {', '.join(LOAN_CONSISTENCY_LEVELS)}"}), 400
+        loan_account = await get_loan_account_cache().get(
+            program, Pubkey.from_string(loan_pda), consistency
         )
 
         return jsonify({
             'success': True,
-            'loan': {
-                'lender': str(loan_account.lender),
-                'borrower': str(loan_account.borrower),
-                'amount': str(loan_account.amount),
-                'apy': loan_account.apy,
-                'paidAmount': str(loan_account.paid_amount),
-                'startTime': loan_account.start_time,
-                'duration': loan_account.duration,
-                'isActive': loan_account.is_active
-            }
+            'loan': _loan_account_json(loan_account)
         })
     except Exception as e:
         logger.error(f"Error fetching loan: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _loan_account_json(loan_account):
+    return {
+        'lender': str(loan_account.lender),
+        'borrower': str(loan_account.borrower),
+        'amount': str(loan_account.amount),
+        'apy': loan_account.apy,
+        'paidAmount': str(loan_account.paid_amount),
+        'startTime': loan_account.start_time,
+        'duration': loan_account.duration,
+        'isActive': loan_account.is_active
+    }
+
+# All on-chain loans of a lender and/or borrower, in one getProgramAccounts call
+@app.route('/api/solana/loans', methods=['GET'])
+@async_route
+async def list_onchain_loans():
+    try:
+        lender = request.args.get('lender')
+        borrower = request.args.get('borrower')
+        if not lender and not borrower:
+            return jsonify({
+                'success': False,
+                'error': 'lender or borrower is required'
+            }), 400
+        try:
+            lender = Pubkey.from_string(lender) if lender else None
+            borrower = Pubkey.from_string(borrower) if borrower else None
+        except Exception:
+            return jsonify({'success': False, 'error': 'Invalid wallet address'}), 400
+        active_only = request.args.get('active', '').lower() in ('1', 'true', 'yes')
+
+        client, program, _ = await get_solana_client()
+        loans = await find_loan_accounts(program, lender=lender, borrower=borrower, active_only=active_only)
+        loans.sort(key=lambda item: item[1].start_time, reverse=True)
+
+        return jsonify({
+            'success': True,
+            'loans': [{'pda': pda, **_loan_account_json(account)} for pda, account in loans]
+        })
+    except Exception as e:
+        logger.error(f"Error listing loans: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Loan details for a list of PDAs, resolved with batched getMultipleAccounts
+@app.route('/api/solana/loans/lookup', methods=['POST'])
+@async_route
+async def lookup_onchain_loans():
+    try:
+        data = request.json
+        pdas = data.get('pdas') if data else None
+        if not isinstance(pdas, list) or not pdas:
+            return jsonify({
+                'success': False,
+                'error': 'pdas must be a non-empty list'
+            }), 400
+        if len(pdas) > MAX_LOAN_LOOKUP:
+            return jsonify({
+                'success': False,
+                'error': f'At most {MAX_LOAN_LOOKUP} pdas per request'
+            }), 400
+
+        invalid = []
+        for pda in pdas:
+            try:
+                Pubkey.from_string(pda)
+            except Exception:
+                invalid.append(pda)
+        if invalid:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid loan address',
+                'invalid': invalid
+            }), 400
+
+        consistency = data.get('consistency', LOAN_DETAILS_CONSISTENCY)
+        if consistency not in LOAN_CONSISTENCY_LEVELS:
+            return jsonify({'success': False, 'error': f"consistency must be one of {', '.join(LOAN_CONSISTENCY_LEVELS)}"}), 400
+
+        client, program, _ = await get_solana_client()
+        accounts = await get_loan_account_cache().get_many(program, pdas, consistency)
+
+        return jsonify({
+            'success': True,
+            'loans': [{'pda': pda, **_loan_account_json(account)} for pda, account in accounts.items() if account is not None],
+            'missing': [pda for pda, account in accounts.items() if account is None]
+        })
+    except Exception as e:
+        logger.error(f"Error looking up loans: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 # Modify the deploy endpoint with the decorator
 @app.route('/api/deploy', methods=['POST'])
 @async_route
@@ -448,146 +644,56 @@ async def deploy_contract():
             'success': False,
             'error': str(e)
         }), 500
-        
-        # Get client and wallet
-        client, _, wallet = await get_solana_client()
-        
-        # Check program file and read it
-        program_path = '../anchor/target/deploy/sol_backend.so'
-        if not os.path.exists(program_path):
-            logger.error(f"Program file not found at {program_path}")
+
+# Deploy the program binary through the BPF loader. The upload runs in the
+# background on the shared loop; poll the returned deploymentId for progress.
+@app.route('/api/deploy/program', methods=['POST'])
+@async_route
+async def deploy_program():
+    try:
+        if not os.path.exists(PROGRAM_SO_PATH):
+            logger.error(f"Program file not found at {PROGRAM_SO_PATH}")
             return jsonify({
                 'success': False,
-                'error': f"Program file not found at {program_path}"
+                'error': f"Program file not found at {PROGRAM_SO_PATH}"
             }), 404
-            
-        client, _, wallet = await get_solana_client()
-        logger.info(f"Got client and wallet. Wallet pubkey: {wallet.public_key}")
-        
-        # Read program
-        with open(program_path, 'rb') as f:
+
+        with open(PROGRAM_SO_PATH, 'rb') as f:
             program_data = f.read()
-        logger.info(f"Program data size: {len(program_data)} bytes")
-        logger.info(f"Read program binary, size: {len(program_data)} bytes")
-        
-        # Create program keypair
-        program_keypair = Keypair()
-        logger.info(f"New program ID: {program_keypair.pubkey()}")
-        
-        # Get minimum rent
-        program_len = len(program_data)
-        rent = await client.get_minimum_balance_for_rent_exemption(program_len)
-        logger.info(f"Required rent: {rent.value} lamports")
-        
-        # Create account
-        create_account_ix = Instruction(
-            program_id=SYS_PROGRAM_ID,
-            accounts=[
-                AccountMeta(pubkey=wallet.public_key, is_signer=True, is_writable=True),
-                AccountMeta(pubkey=program_keypair.pubkey(), is_signer=False, is_writable=True),
-            ],
-            data=bytes([0, 0, 0, 0])  # create account instruction index
-        )
-        
-        # Send create transaction
-        recent_blockhash = await client.get_latest_blockhash()
-        create_tx = Transaction()
-        create_tx.add(create_account_ix)
-        create_tx.recent_blockhash = recent_blockhash.value.blockhash
-        
-        create_response = await client.send_transaction(
-            create_tx,
-            wallet.payer,
-            program_keypair,
-            opts=TxOpts(skip_preflight=True)
-        )
-        logger.info(f"Account created: {str(create_response.value)}")
-        
-        # Wait for confirmation
-        await client.confirm_transaction(create_response.value)
-        logger.info("Account creation confirmed")
-        
-        # Write program in smaller chunks
-        CHUNK_SIZE = 500  # Reduced from 800
-        chunks = [program_data[i:i + CHUNK_SIZE] for i in range(0, len(program_data), CHUNK_SIZE)]
-        write_responses = []
-        
-        for i, chunk in enumerate(chunks):
-            logger.info(f"Writing chunk {i+1}/{len(chunks)} (size: {len(chunk)} bytes)")
-            write_ix = Instruction(
-                program_id=BPF_LOADER_ID,
-                accounts=[
-                    AccountMeta(pubkey=wallet.public_key, is_signer=True, is_writable=True),
-                    AccountMeta(pubkey=program_keypair.pubkey(), is_signer=False, is_writable=True),
-                ],
-                data=bytes([1]) + i.to_bytes(4, 'little') + chunk
-            )
-            
-            write_tx = Transaction()
-            write_tx.add(write_ix)
-            write_tx.recent_blockhash = (await client.get_latest_blockhash()).value.blockhash
-            
-            write_response = await client.send_transaction(
-                write_tx,
-                wallet.payer,
-                opts=TxOpts(skip_preflight=True)
-            )
-            write_responses.append(str(write_response.value))
-            
-            # Wait for confirmation of each chunk
-            await client.confirm_transaction(write_response.value)
-            logger.info(f"Chunk {i+1} confirmed")
-            await asyncio.sleep(1)
-            
-        logger.info("All chunks written successfully")
-        
-        # Finalize program
-        finalize_ix = Instruction(
-            program_id=BPF_LOADER_ID,
-            accounts=[
-                AccountMeta(pubkey=wallet.public_key, is_signer=True, is_writable=True),
-                AccountMeta(pubkey=program_keypair.pubkey(), is_signer=False, is_writable=True),
-            ],
-            data=bytes([2])
-        )
-        
-        finalize_tx = Transaction()
-        finalize_tx.add(finalize_ix)
-        finalize_tx.recent_blockhash = (await client.get_latest_blockhash()).value.blockhash
-        
-        finalize_response = await client.send_transaction(
-            finalize_tx,
-            wallet.payer,
-            opts=TxOpts(skip_preflight=True)
-        )
-        
-        # Wait for finalization
-        await client.confirm_transaction(finalize_response.value)
-        logger.info("Program finalized")
-        
-        return jsonify({
-            'success': True,
-            'programId': str(program_keypair.pubkey()),
-            'createTx': str(create_response.value),
-            'writeTxs': write_responses,
-            'finalizeTx': str(finalize_response.value)
-        })
-        
+
+        client, _, wallet = await get_solana_client()
+        progress = start_deployment(client, wallet.payer, program_data)
+        logger.info(f"Started deployment {progress.deployment_id} of {len(program_data)} bytes")
+
+        return jsonify({'success': True, **progress.to_dict()}), 202
+
     except Exception as e:
-        logger.error(f"=== UNHANDLED ERROR IN DEPLOYMENT ===")
-        logger.error(f"Error type: {type(e)}")
-        logger.error(f"Error message: {str(e)}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        logger.error(f"Error starting deployment: {str(e)}")
         return jsonify({
             'success': False,
-            'error': str(e),
-            'error_type': str(type(e)),
-            'traceback': traceback.format_exc()
+            'error': str(e)
         }), 500
 
+@app.route('/api/deploy/program/<deployment_id>', methods=['GET'])
+def get_program_deployment(deployment_id):
+    progress = get_deployment(deployment_id)
+    if progress is None:
+        return jsonify({'success': False, 'error': 'Deployment not found'}), 404
+    return jsonify({'success': progress.status != 'failed', **progress.to_dict()})
+
+# Confirmation status of a signature sent by one of the endpoints above
+@app.route('/api/signatures/<signature>', methods=['GET'])
+def get_signature_status(signature):
+    tracker = get_confirmation_tracker()
+    tracker.ensure_running()
+    status = tracker.get_status(signature)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Signature not tracked'}), 404
+    return jsonify({'success': True, **status})
+
 # Get deployment status
 @app.route('/api/deploy/<signature>', methods=['GET'])
+@async_route
 async def get_deploy_status(signature):
     try:
         client, program_id, _ = await get_solana_client()
@@ -610,14 +716,12 @@ async def get_deploy_status(signature):
 async def get_wallet_balance():
     try:
         client, program_id, wallet = await get_solana_client()
-        balance_response = await client.get_balance(wallet.public_key)
+        balance = await get_balance_cache().get_balance(client, str(wallet.public_key))
 
-        
-        
         return jsonify({
             'success': True,
-            'balance': balance_response.value / 1e9,  # Convert lamports to SOL
-            'balance_lamports': balance_response.value
+            'balance': balance / 1e9,  # Convert lamports to SOL
+            'balance_lamports': balance
         })
         
     except Exception as e:
@@ -665,6 +769,21 @@ async def transfer_sol():
         # Create destination pubkey
         destination = Pubkey.from_string(data['destination'])
         logger.info(f"Transferring {amount_sol} SOL to {destination}")
+
+        # Batching mode: the transfer shares a transaction with the others
+        # queued from the admin wallet in the same short window
+        if data.get('batch'):
+            signature, last_valid = await get_transfer_batcher().submit(client, wallet.payer, destination, amount_lamports)
+            get_confirmation_tracker().track(signature, 'transfer_batch', last_valid_block_height=last_valid)
+            logger.info(f"Batched transfer sent. Signature: {signature}")
+            return jsonify({
+                'success': True,
+                'signature': signature,
+                'amount': amount_sol,
+                'destination': str(destination),
+                'batched': True,
+                'status': 'pending'
+            })
         
         # Create transfer instruction
         transfer_ix = transfer(
@@ -675,28 +794,27 @@ async def transfer_sol():
             )
         )
         
-        # Get recent blockhash
-        recent_blockhash = await client.get_latest_blockhash()
-        
-        # Create transaction
-        tx = Transaction()
-        tx.add(transfer_ix)
-        tx.recent_blockhash = recent_blockhash.value.blockhash
-        tx.fee_payer = wallet.public_key
-        
-        # Sign transaction
-        tx.sign(wallet.payer)
+        # Create and sign the transaction against the shared cached blockhash
+        def build_transaction(blockhash):
+            tx = Transaction()
+            tx.add(transfer_ix)
+            tx.recent_blockhash = blockhash
+            tx.fee_payer = wallet.public_key
+            tx.sign(wallet.payer)
+            return tx.serialize()
         
         # Send transaction with signer
         logger.info("Sending transaction with signer...")
-        signature = await client.send_raw_transaction(tx.serialize())
-        logger.info(f"Transfer complete. Signature: {signature}")
+        signature, last_valid_block_height = await get_blockhash_cache().send(client, build_transaction)
+        get_confirmation_tracker().track(signature.value, 'transfer', last_valid_block_height=last_valid_block_height)
+        logger.info(f"Transfer sent. Signature: {signature}")
         
         return jsonify({
             'success': True,
             'signature': str(signature.value),
             'amount': amount_sol,
-            'destination': str(destination)
+            'destination': str(destination),
+            'status': 'pending'
         })
         
     except Exception as e:
@@ -709,13 +827,72 @@ async def transfer_sol():
             'traceback': traceback.format_exc()
         }), 500
     
+@app.route('/api/wallet/transfers', methods=['POST'])
+@async_route
+async def transfer_sol_batch():
+    try:
+        data = request.json
+        transfers = data.get('transfers') if data else None
+        if not isinstance(transfers, list) or not transfers:
+            return jsonify({
+                'success': False,
+                'error': 'transfers must be a non-empty list'
+            }), 400
+        if len(transfers) > MAX_BATCH_TRANSFERS:
+            return jsonify({
+                'success': False,
+                'error': f'At most {MAX_BATCH_TRANSFERS} transfers per request'
+            }), 400
+
+        parsed = []
+        for item in transfers:
+            try:
+                parsed.append((Pubkey.from_string(item['destination']), int(float(item['amount']) * 1e9)))
+            except Exception:
+                return jsonify({
+                    'success': False,
+                    'error': 'Each transfer needs a valid destination and amount',
+                    'transfer': item
+                }), 400
+
+        client, _, wallet = await get_solana_client()
+        batcher = get_transfer_batcher()
+        results = await asyncio.gather(
+            *(batcher.submit(client, wallet.payer, destination, lamports) for destination, lamports in parsed),
+            return_exceptions=True
+        )
+        signatures = dict(r for r in results if not isinstance(r, Exception))
+        tracker = get_confirmation_tracker()
+        for signature, last_valid in signatures.items():
+            tracker.track(signature, 'transfer_batch', last_valid_block_height=last_valid)
+        logger.info(f"Sent {len(parsed)} transfers in {len(signatures)} transaction(s)")
+
+        return jsonify({
+            'success': not any(isinstance(r, Exception) for r in results),
+            'transfers': [
+                {
+                    'destination': item['destination'],
+                    'amount': item['amount'],
+                    **({'error': str(result)} if isinstance(result, Exception) else {'signature': result[0]})
+                }
+                for item, result in zip(transfers, results)
+            ]
+        })
+
+    except Exception as e:
+        logger.error(f"Error sending batch transfers: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
     email = data.get('email')
     password = data.get('password')
     
-    conn = sqlite3.connect('loan_platform.db')
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM Users WHERE email = ? AND password_hash = ?", (email, password))
     user = cursor.fetchone()
@@ -749,7 +926,7 @@ async def get_program_info(program_id):
 
 @app.route('/api/user/<int:user_id>/loans', methods=['GET'])
 def get_user_loans(user_id):
-    conn = sqlite3.connect('loan_platform.db')
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT l.loan_amount, l.interest_rate, l.payment_schedule, p.amount_due, p.amount_paid, p.payment_status
@@ -776,30 +953,60 @@ def get_user_loans(user_id):
 @app.route('/api/loans/<int:loan_id>/pay', methods=['POST'])
 def pay_loan(loan_id):
     data = request.json
-    amount = data.get('amount')
+    try:
+        amount = float(data.get('amount'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'amount must be a number'}), 400
+    if amount <= 0:
+        return jsonify({'success': False, 'error': 'amount must be positive'}), 400
     borrow_id = data.get('borrower_id')
-    if borrow_id:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE Users
-            SET successful_payments = successful_payments + 1
-            WHERE user_id = ?
-        ''', (borrow_id,))
-        conn.commit()
-        conn.close()
 
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE Payments
-        SET amount_paid = amount_paid + ?, payment_status = 'paid'
-        WHERE loan_id = ? AND payment_status = 'due'
-    ''', (amount, loan_id))
-    conn.commit()
-    conn.close()
+    # The payment settles the loan's unpaid installments oldest first, late
+    # ones included (the sweeper moves overdue 'due' rows to 'late'); an
+    # installment only turns 'paid' once it is covered in full, to within
+    # EPSILON so summed REAL amounts don't leave a sliver owed
+    def settle(conn):
+        if borrow_id:
+            conn.execute('''
+                UPDATE Users
+                SET successful_payments = successful_payments + 1
+                WHERE user_id = ?
+            ''', (borrow_id,))
+        remaining = amount
+        settled = []
+        installments = conn.execute('''
+            SELECT payment_id, amount_due - COALESCE(amount_paid, 0) FROM Payments
+            WHERE transaction_id = ? AND payment_status IN ('due', 'late')
+            ORDER BY due_date, payment_id
+        ''', (loan_id,)).fetchall()
+        for payment_id, owed in installments:
+            if remaining <= EPSILON:
+                break
+            applied = min(remaining, max(owed, 0))
+            paid_off = remaining >= owed - EPSILON
+            conn.execute('''
+                UPDATE Payments
+                SET amount_paid = CASE WHEN :paid_off THEN amount_due ELSE COALESCE(amount_paid, 0) + :applied END,
+                    payment_status = CASE WHEN :paid_off THEN 'paid' ELSE payment_status END
+                WHERE payment_id = :payment_id
+            ''', {'applied': applied, 'paid_off': paid_off, 'payment_id': payment_id})
+            remaining -= applied
+            settled.append({'payment_id': payment_id, 'applied': applied, 'paid': paid_off})
+        return settled, remaining if remaining > EPSILON else 0.0
+
+    try:
+        settled, unapplied = run_write_transaction(settle)
+    except sqlite3.OperationalError as e:
+        if is_busy_error(e):
+            return jsonify({'success': False, 'error': 'Database busy, try again.'}), 503
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-    return jsonify({'success': True, 'message': 'Payment successful, successful_payments updated.'})
+    return jsonify({
+        'success': True,
+        'message': 'Payment successful, successful_payments updated.',
+        'payments': settled,
+        'unapplied': unapplied
+    })
 
 @app.route('/api/transactions', methods=['POST'])
 def post_transaction_request():
@@ -811,26 +1018,48 @@ def post_transaction_request():
         interest_rate = data['interest_rate']
         payment_schedule_id = data['payment_schedule_id']
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insert new post
-        cursor.execute('''
-            INSERT INTO Posts (user_id, post_type, loan_amount, interest_rate, payment_schedule_id, status)
-            VALUES (?, 'lend', ?, ?, ?, 'open')
-        ''', (lender_id, loan_amount, interest_rate, payment_schedule_id))
-
-        conn.commit()
-        post_id = cursor.lastrowid
-        conn.close()
+        # New lend posts go through the order book and fund compatible
+        # borrow posts straight away; whatever is left stays open
+        result = get_order_book().submit(lender_id, 'lend', loan_amount, interest_rate, payment_schedule_id)
 
         return jsonify({
             'success': True,
-            'post_id': post_id
+            'post_id': result['post_id'],
+            'fills': result['fills'],
+            'remaining': result['remaining']
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Borrow or lend post matched against the order book
+@app.route('/api/orders', methods=['POST'])
+def submit_order():
+    try:
+        data = request.json
+        try:
+            result = get_order_book().submit(
+                int(data['user_id']),
+                data['post_type'],
+                data['loan_amount'],
+                data['interest_rate'],
+                int(data['payment_schedule_id'])
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        return jsonify({'success': True, **result})
+    except Exception as e:
+        logger.error(f"Error submitting order: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Open amount per interest rate on each side of one payment schedule's book
+@app.route('/api/orders/book', methods=['GET'])
+def get_order_book_depth():
+    payment_schedule_id = request.args.get('payment_schedule_id', type=int)
+    if payment_schedule_id is None:
+        return jsonify({'success': False, 'error': 'payment_schedule_id is required'}), 400
+    levels = min(request.args.get('levels', 10, type=int), 100)
+    return jsonify({'success': True, **get_order_book().depth(payment_schedule_id, levels)})
+
 # API to accept a transaction request
 @app.route('/api/transaction/accept', methods=['POST'])
 def accept_transaction_request():
@@ -839,34 +1068,45 @@ def accept_transaction_request():
         post_id = data['post_id']
         borrower_id = data['borrower_id']
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Get post details
-        cursor.execute('SELECT user_id, loan_amount, interest_rate, payment_schedule_id FROM Posts WHERE post_id = ? AND status = "open"', (post_id,))
-        post = cursor.fetchone()
-
-        if not post:
+        def claim(conn):
+            # Claim the post with one conditional UPDATE: of several borrowers
+            # racing for it only one gets a row back. A post the order book
+            # has partly matched is accepted for what is left.
+            claimed = conn.execute('''
+                UPDATE Posts SET status = 'funded'
+                WHERE post_id = ? AND status = 'open'
+                RETURNING user_id, loan_amount - COALESCE(filled_amount, 0), interest_rate, payment_schedule_id
+            ''', (post_id,)).fetchall()
+            if not claimed:
+                return None
+            lender_id, loan_amount, interest_rate, payment_schedule_id = claimed[0]
+            conn.execute('UPDATE Posts SET filled_amount = loan_amount WHERE post_id = ?', (post_id,))
+
+            cursor = conn.execute('''
+                INSERT INTO Transactions (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule_id, status)
+                VALUES (?, ?, ?, ?, ?, ?, 'active')
+            ''', (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule_id))
+            transaction_id = cursor.lastrowid
+
+            # Create the installment schedule in the same transaction
+            payment_ids = generate_payment_schedules([transaction_id], conn=conn)
+            return transaction_id, payment_ids
+
+        result = run_write_transaction(claim)
+        if result is None:
             return jsonify({'success': False, 'error': 'Post not found or already funded.'}), 404
-
-        lender_id, loan_amount, interest_rate, payment_schedule_id = post
-
-        # Insert transaction
-        cursor.execute('''
-            INSERT INTO Transactions (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule_id, status)
-            VALUES (?, ?, ?, ?, ?, ?, 'active')
-        ''', (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule_id))
-
-        # Update post status
-        cursor.execute('UPDATE Posts SET status = "funded" WHERE post_id = ?', (post_id,))
-
-        conn.commit()
-        conn.close()
+        transaction_id, payment_ids = result
+        get_order_book().remove(post_id)
 
         return jsonify({
             'success': True,
-            'transaction_id': cursor.lastrowid
+            'transaction_id': transaction_id,
+            'payments_created': len(payment_ids)
         })
+    except sqlite3.OperationalError as e:
+        if is_busy_error(e):
+            return jsonify({'success': False, 'error': 'Database busy, try again.'}), 503
+        return jsonify({'success': False, 'error': str(e)}), 500
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -923,10 +1163,6 @@ async def solana_transfer():
         logger.info(f"- Amount: {amount_sol} SOL ({amount_lamports} lamports)")
         logger.info(f"- Recipient: {recipient}")
         
-        # Get recent blockhash
-        recent_blockhash = await client.get_latest_blockhash()
-        logger.info(f"Recent blockhash: {recent_blockhash.value.blockhash}")
-        
         # Create transfer instruction
         transfer_ix = transfer(
             TransferParams(
@@ -936,31 +1172,49 @@ async def solana_transfer():
             )
         )
         
-        # Create transaction
-        tx = Transaction()
-        tx.add(transfer_ix)
-        tx.recent_blockhash = recent_blockhash.value.blockhash
-        tx.fee_payer = sender_keypair.pubkey()
-        
-        # Sign transaction
-        tx.sign(sender_keypair)
+        # Create and sign the transaction against the shared cached blockhash
+        def build_transaction(blockhash):
+            tx = Transaction()
+            tx.add(transfer_ix)
+            tx.recent_blockhash = blockhash
+            tx.fee_payer = sender_keypair.pubkey()
+            tx.sign(sender_keypair)
+            return tx.serialize()
         
-        # Send transaction
         logger.info("Sending transaction...")
-        tx_sig = await client.send_raw_transaction(
-            tx.serialize(),
-            opts=TxOpts(skip_preflight=True)
-        )
-        
-        # Wait for confirmation
-        await client.confirm_transaction(tx_sig.value)
-        logger.info(f"Transfer confirmed: {tx_sig.value}")
+        if data.get('wait'):
+            # Hold the request until confirmed; re-sent with a fresh
+            # blockhash if it expires first
+            tx_sig = await get_blockhash_cache().send_and_confirm(
+                client,
+                build_transaction,
+                opts=TxOpts(skip_preflight=True)
+            )
+            logger.info(f"Transfer confirmed: {tx_sig.value}")
+            status = 'confirmed'
+        else:
+            # Return straight away; the confirmation tracker follows it and
+            # records the outcome (and the linked Transactions row, if any)
+            tx_sig, last_valid_block_height = await get_blockhash_cache().send(
+                client,
+                build_transaction,
+                opts=TxOpts(skip_preflight=True)
+            )
+            get_confirmation_tracker().track(
+                tx_sig.value,
+                'transfer',
+                transaction_id=data.get('transaction_id'),
+                last_valid_block_height=last_valid_block_height
+            )
+            logger.info(f"Transfer sent: {tx_sig.value}")
+            status = 'pending'
         
         return jsonify({
             'success': True,
             'signature': str(tx_sig.value),
             'amount': amount_sol,
-            'recipient': str(recipient)
+            'recipient': str(recipient),
+            'status': status
         })
         
     except Exception as e:
@@ -974,19 +1228,16 @@ async def fetch_solana_balance(wallet_address):
     try:
         client, _, _ = await get_solana_client()
         
-        # Convert address string to Pubkey
-        pubkey = Pubkey.from_string(wallet_address)
-        
-        # Get balance
-        balance = await client.get_balance(pubkey)
-        balance_sol = balance.value / 1e9  # Convert lamports to SOL
+        # Get balance (served from the shared TTL cache when fresh)
+        balance = await get_balance_cache().get_balance(client, wallet_address)
+        balance_sol = balance / 1e9  # Convert lamports to SOL
         
         logger.info(f"Fetched balance for {wallet_address}: {balance_sol} SOL")
         
         return jsonify({
             'success': True,
             'wallet': wallet_address,
-            'balance_lamports': balance.value,
+            'balance_lamports': balance,
             'balance_sol': balance_sol
         })
         
@@ -997,6 +1248,57 @@ async def fetch_solana_balance(wallet_address):
             'error': str(e)
         }), 500
 
+@app.route('/api/solana/balances', methods=['POST'])
+@async_route
+async def fetch_solana_balances():
+    try:
+        data = request.json
+        addresses = data.get('addresses') if data else None
+        if not isinstance(addresses, list) or not addresses:
+            return jsonify({
+                'success': False,
+                'error': 'addresses must be a non-empty list'
+            }), 400
+        if len(addresses) > MAX_BALANCE_ADDRESSES:
+            return jsonify({
+                'success': False,
+                'error': f'At most {MAX_BALANCE_ADDRESSES} addresses per request'
+            }), 400
+
+        invalid = []
+        for address in addresses:
+            try:
+                Pubkey.from_string(address)
+            except Exception:
+                invalid.append(address)
+        if invalid:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid wallet address',
+                'invalid': invalid
+            }), 400
+
+        client, _, _ = await get_solana_client()
+        balances = await get_balance_cache().get_balances(client, addresses)
+
+        return jsonify({
+            'success': True,
+            'balances': {
+                address: {
+                    'balance_lamports': lamports,
+                    'balance_sol': lamports / 1e9
+                }
+                for address, lamports in balances.items()
+            }
+        })
+
+    except Exception as e:
+        logger.error(f"Error fetching balances: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/loans', methods=['POST'])
 def create_post():
     try:
@@ -1058,6 +1360,10 @@ def create_post():
 
 # ✅ Run the Flask App
 if __name__ == '__main__':
+    # The debug reloader re-runs this script in a child that serves requests;
+    # only that child starts services, not the watching parent
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_services()
     app.run(debug=True)
 
 
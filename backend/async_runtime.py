@@ -0,0 +1,99 @@
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import os
+import threading
+
+
+class BackgroundLoop:
+    """One long-lived asyncio loop on a daemon thread.
+
+    WSGI request threads hand coroutines to it with run(); because the loop
+    outlives any single request, async resources (the Solana AsyncClient and
+    its keep-alive connections, background refresh tasks) are shared across
+    requests, and in-flight RPC calls from concurrent requests overlap on it.
+    """
+
+    def __init__(self, name='async-runtime'):
+        self.name = name
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        with self._lock:
+            # A forked child inherits the object but not the thread
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return self.loop
+            ready = threading.Event()
+
+            def _run():
+                self.loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self.loop)
+                ready.set()
+                self.loop.run_forever()
+                self.loop.close()
+
+            self._thread = threading.Thread(target=_run, name=self.name, daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._pid = os.getpid()
+            return self.loop
+
+    def submit(self, coro):
+        """Schedule coro on the loop and return a concurrent.futures.Future.
+
+        The caller's contextvars (Flask's request and app context) are carried
+        over so views can keep using `request` and `jsonify`.
+        """
+        loop = self.start()
+        ctx = contextvars.copy_context()
+
+        async def _run_in_context():
+            return await ctx.run(asyncio.get_running_loop().create_task, coro)
+
+        return asyncio.run_coroutine_threadsafe(_run_in_context(), loop)
+
+    def run(self, coro, timeout=None):
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, shutdown=None):
+        """Run the optional shutdown coroutine function, then stop the loop."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                return
+            if shutdown is not None:
+                try:
+                    asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(5)
+                except Exception:
+                    pass
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(5)
+            self._thread = None
+
+
+_background_loop = BackgroundLoop()
+_shutdown_hooks = []
+
+def get_background_loop():
+    return _background_loop
+
+def add_shutdown_hook(coro_fn):
+    """Register an async callable to run on the loop before it stops at exit."""
+    _shutdown_hooks.append(coro_fn)
+
+async def _run_shutdown_hooks():
+    for hook in reversed(_shutdown_hooks):
+        try:
+            await hook()
+        except Exception:
+            pass
+
+atexit.register(lambda: _background_loop.stop(_run_shutdown_hooks))
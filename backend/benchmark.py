@@ -0,0 +1,452 @@
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import db
+from rpc_standin import StandinRPC
+
+logger = logging.getLogger(__name__)
+
+# Named database sizes (total rows across the seeded tables)
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+
+# Share of the total row count each table gets
+TABLE_SHARES = {'Users': 0.05, 'Posts': 0.35, 'Transactions': 0.15, 'Payments': 0.45}
+
+DEFAULT_ITERATIONS = 200
+BULK_ITERATIONS = 20
+WARMUP = 5
+DEFAULT_THRESHOLD = 0.10
+
+# Routes not timed: /api/loans/<int:loan_id> and /api/user/<id>/loans query a
+# Loans table that does not exist, POST /api/loans writes columns Posts does
+# not have, /api/account and /api/generate-wallet call the external Tatum API,
+# and /api/deploy needs a program binary.
+
+
+# Seeding
+
+SEED_SQL = {
+    'Users': '''
+        INSERT INTO Users (password_hash, email, score, solana_address, created_at)
+        SELECT 'hash_' || i, 'bench_' || i || '@test.com', abs(random()) % 851,
+               'address_' || i, datetime('2023-01-01', '+' || i || ' minutes')
+        FROM seq
+    ''',
+    'Posts': '''
+        INSERT INTO Posts (user_id, post_type, loan_amount, interest_rate, payment_schedule_id, status, created_at)
+        SELECT 1 + abs(random()) % :users,
+               CASE i % 2 WHEN 0 THEN 'lend' ELSE 'borrow' END,
+               0.1 + (abs(random()) % 10000) / 1000.0,
+               1 + (abs(random()) % 1500) / 100.0,
+               1 + i % 3,
+               CASE WHEN i % 10 < 6 THEN 'open' WHEN i % 10 < 9 THEN 'funded' ELSE 'closed' END,
+               datetime('2023-01-01', '+' || (i * 37) || ' seconds')
+        FROM seq
+    ''',
+    'Transactions': '''
+        INSERT INTO Transactions (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule_id, status, created_at)
+        SELECT 1 + abs(random()) % :users, 1 + abs(random()) % :users, 1 + abs(random()) % :posts,
+               0.1 + (abs(random()) % 10000) / 1000.0,
+               1 + (abs(random()) % 1500) / 100.0,
+               1 + i % 3,
+               CASE WHEN i % 4 = 0 THEN 'completed' ELSE 'active' END,
+               datetime('2023-01-01', '+' || (i * 61) || ' seconds')
+        FROM seq
+    ''',
+    'Payments': '''
+        INSERT INTO Payments (transaction_id, due_date, amount_due, amount_paid, payment_status, principal_due, interest_due)
+        SELECT 1 + (i - 1) % :transactions,
+               date('2023-02-01', '+' || ((i - 1) / :transactions) || ' months'),
+               0.05 + (abs(random()) % 1000) / 1000.0, 0,
+               CASE WHEN i % 5 < 3 THEN 'paid' WHEN i % 5 = 3 THEN 'due' ELSE 'late' END,
+               0.05, 0.01
+        FROM seq
+    ''',
+}
+
+def table_counts(total_rows):
+    return {table: max(10, int(total_rows * share)) for table, share in TABLE_SHARES.items()}
+
+def seed_database(path, total_rows):
+    """Create a benchmark database at path with roughly total_rows rows.
+
+    Rows are generated inside SQLite with a recursive CTE, so even the 10M
+    size seeds without round-tripping rows through Python.
+    """
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    counts = table_counts(total_rows)
+    db.configure_pool(path=path)
+    db.setup_database()
+
+    started = time.perf_counter()
+    with db.get_db_connection() as conn:
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT INTO PaymentSchedules (frequency, duration_in_months) VALUES (?, ?)",
+            [('monthly', 12), ('bi-weekly', 6), ('weekly', 3)],
+        )
+        params = {'users': counts['Users'], 'posts': counts['Posts'], 'transactions': counts['Transactions']}
+        for table, sql in SEED_SQL.items():
+            logger.info(f"Seeding {counts[table]} {table} rows")
+            conn.execute(
+                "WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < :n) " + sql,
+                dict(params, n=counts[table]),
+            )
+    with db.get_db_connection() as conn:
+        conn.execute("ANALYZE")
+    db.checkpoint_wal('TRUNCATE')
+    db.close_pool()
+    logger.info(f"Seeded {path} in {time.perf_counter() - started:.1f}s")
+    return counts
+
+def prepare_database(data_dir, size, reseed=False):
+    """Return (working copy path, row counts) for size, seeding it on first use.
+
+    Benchmarks write to a fresh copy of the seeded file so every run (and
+    every commit being compared) starts from identical data.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    seed_path = os.path.join(data_dir, f'bench_{size}.db')
+    meta_path = seed_path + '.json'
+    total_rows = SIZES[size]
+    if reseed or not os.path.exists(seed_path) or not os.path.exists(meta_path):
+        counts = seed_database(seed_path, total_rows)
+        with open(meta_path, 'w') as f:
+            json.dump(counts, f)
+    else:
+        with open(meta_path) as f:
+            counts = json.load(f)
+
+    work_path = os.path.join(data_dir, f'bench_{size}.work.db')
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(work_path + suffix):
+            os.remove(work_path + suffix)
+    shutil.copyfile(seed_path, work_path)
+    return work_path, counts
+
+
+# Stubbed Solana RPC
+
+def start_rpc_standin(rng, n_addresses=100):
+    """Start a local stand-in RPC node and point the backend at it.
+
+    Returns (rpc, fixtures) where fixtures holds the funded addresses, the
+    sender keypair and a LoanAccount PDA the route benchmarks use.
+    """
+    from anchorpy.coder.accounts import AccountToSerialize
+    from anchorpy.coder.coder import Coder
+    from anchorpy_core.idl import Idl
+    from solders.keypair import Keypair
+    from solders.pubkey import Pubkey
+
+    from idl import idl
+
+    rpc = StandinRPC().start()
+    wallet = Keypair()
+    program_id = Pubkey.from_string(idl['metadata']['address'])
+    os.environ['SOLANA_RPC_URL'] = rpc.url
+    os.environ['WALLET_PRIVATE_KEY'] = json.dumps(list(bytes(wallet)))
+    os.environ['PROGRAM_ID'] = str(program_id)
+
+    sender = Keypair()
+    borrower = Keypair()
+    lender = Keypair()
+    rpc.set_account(wallet.pubkey(), lamports=50 * 10**9)
+    rpc.set_account(sender.pubkey(), lamports=50 * 10**9)
+    rpc.set_account(program_id, lamports=10**9, data=b'\0' * 36, executable=True,
+                    owner='BPFLoaderUpgradeab1e11111111111111111111111')
+    addresses = []
+    for _ in range(n_addresses):
+        address = Keypair().pubkey()
+        rpc.set_account(address, lamports=rng.randrange(10**10))
+        addresses.append(str(address))
+
+    coder = Coder(Idl.from_json(json.dumps(idl)))
+    loan_pda = Keypair().pubkey()
+    rpc.set_account(loan_pda, lamports=10**7, owner=program_id, data=coder.accounts.build(AccountToSerialize(
+        name='LoanAccount',
+        data=dict(lender=lender.pubkey(), borrower=borrower.pubkey(), amount=10**9, apy=500,
+                  paid_amount=0, start_time=int(time.time()), duration=86400 * 365, is_active=True),
+    )))
+
+    return rpc, {
+        'addresses': addresses,
+        'program_id': str(program_id),
+        'sender': sender,
+        'borrower': borrower,
+        'lender': str(lender.pubkey()),
+        'loan_pda': str(loan_pda),
+    }
+
+
+# Benchmarks
+#
+# Each benchmark is (name, iterations, fn); fn takes the iteration index.
+# Route benchmarks return the HTTP status, and a status >= 400 counts as an
+# error; what db.py calls return is ignored.
+
+def db_benchmarks(counts, rng, iterations):
+    users, posts, transactions, payments = (counts[t] for t in ('Users', 'Posts', 'Transactions', 'Payments'))
+    tag = rng.randrange(10**9)
+    with db.get_db_connection() as conn:
+        mid_created_at = conn.execute("SELECT created_at FROM Posts WHERE post_id = ?", (posts // 2,)).fetchone()[0]
+    deep_cursor = db.encode_cursor(mid_created_at, posts // 2)
+    columns = 'p.post_id, p.user_id, p.post_type, p.loan_amount, p.interest_rate, p.status'
+
+    def rid(n):
+        return rng.randint(1, n)
+
+    return [
+        ('db.get_user', iterations, lambda i: db.get_user(rid(users))),
+        ('db.get_post', iterations, lambda i: db.get_post(rid(posts))),
+        ('db.get_payment_schedule', iterations, lambda i: db.get_payment_schedule(rng.randint(1, 3))),
+        ('db.get_transaction', iterations, lambda i: db.get_transaction(rid(transactions))),
+        ('db.get_payment', iterations, lambda i: db.get_payment(rid(payments))),
+        ('db.get_posts_page', iterations, lambda i: db.get_posts_page(columns, status='open')),
+        ('db.get_posts_page.deep', iterations,
+         lambda i: db.get_posts_page(columns, status='open', cursor=deep_cursor)),
+        ('db.get_posts_page.user', iterations, lambda i: db.get_posts_page(columns, user_id=rid(users))),
+        ('db.add_user', iterations,
+         lambda i: db.add_user('hash', f'bench_{tag}_{i}@test.com', 0, f'bench_{tag}_{i}')),
+        ('db.update_user_score', iterations, lambda i: db.update_user_score(rid(users), rng.randint(0, 850))),
+        ('db.add_post', iterations, lambda i: db.add_post(rid(users), 'lend', 1.5, 5.0, 1)),
+        ('db.update_post_status', iterations, lambda i: db.update_post_status(rid(posts), 'funded')),
+        ('db.add_payment_schedule', iterations, lambda i: db.add_payment_schedule('monthly', 12)),
+        ('db.add_transaction', iterations,
+         lambda i: db.add_transaction(rid(users), rid(users), rid(posts), 1.5, 5.0, 1)),
+        ('db.update_transaction_status', iterations,
+         lambda i: db.update_transaction_status(rid(transactions), 'completed')),
+        ('db.add_payment', iterations, lambda i: db.add_payment(rid(transactions), '2025-01-01', 0.5)),
+        ('db.update_payment_status', iterations, lambda i: db.update_payment_status(rid(payments), 'paid')),
+        ('db.add_posts_bulk[1000]', BULK_ITERATIONS,
+         lambda i: db.add_posts_bulk([(rid(users), 'borrow', 2.0, 6.0, 2)] * 1000)),
+        ('db.update_payment_status_bulk[1000]', BULK_ITERATIONS,
+         lambda i: db.update_payment_status_bulk([rid(payments) for _ in range(1000)], 'late')),
+        ('db.update_user_score_bulk[1000]', BULK_ITERATIONS,
+         lambda i: db.update_user_score_bulk([(rid(users), rng.randint(0, 850)) for _ in range(1000)])),
+    ]
+
+def route_benchmarks(client, counts, rng, iterations, fixtures):
+    from amortization import generate_payment_schedules
+
+    users, posts, transactions = counts['Users'], counts['Posts'], counts['Transactions']
+    # accept needs a fresh open post per call
+    open_posts = db.add_posts_bulk([(rng.randint(1, users), 'lend', 1.0, 5.0, 1)] * (iterations + WARMUP))
+    _, deep_cursor = db.get_posts_page('p.post_id', status='open', limit=db.PAGE_SIZE_MAX)
+    balances_payload = {'addresses': fixtures['addresses']}
+    generate_payment_schedules(list(range(1, min(transactions, 1000) + 1)))
+
+    def status(response):
+        response.get_data()
+        return response.status_code
+
+    def rid(n):
+        return rng.randint(1, n)
+
+    return [
+        ('GET /api/loans', iterations, lambda i: status(client.get('/api/loans'))),
+        ('GET /api/loans?cursor', iterations, lambda i: status(client.get(f'/api/loans?cursor={deep_cursor}'))),
+        ('GET /api/loans?stream=1', BULK_ITERATIONS,
+         lambda i: status(client.get(f'/api/loans?stream=1&limit={db.PAGE_SIZE_MAX}'))),
+        ('GET /api/activity', iterations, lambda i: status(client.get('/api/activity'))),
+        ('POST /api/login', iterations, lambda i: status(client.post('/api/login', json={
+            'email': f'bench_{(j := rid(users))}@test.com', 'password': f'hash_{j}'}))),
+        ('POST /api/transactions', iterations, lambda i: status(client.post('/api/transactions', json={
+            'lender_id': rid(users), 'borrower_id': rid(users), 'loan_amount': 1.0,
+            'interest_rate': 5.0, 'payment_schedule_id': 1}))),
+        ('POST /api/transaction/accept', iterations, lambda i: status(client.post('/api/transaction/accept', json={
+            'post_id': open_posts[i], 'borrower_id': rid(users)}))),
+        ('POST /api/loans/<id>/pay', iterations, lambda i: status(client.post(
+            f'/api/loans/{rid(min(transactions, 1000))}/pay', json={'amount': 0.1, 'borrower_id': rid(users)}))),
+        ('POST /api/transaction/transfer', iterations, lambda i: status(client.post('/api/transaction/transfer', json={
+            'transaction_id': rid(transactions), 'blockchain_tx_id': f'sig_{i}'}))),
+        ('GET /api/wallet/balance', iterations, lambda i: status(client.get('/api/wallet/balance'))),
+        ('GET /api/wallet/address', iterations, lambda i: status(client.get('/api/wallet/address'))),
+        ('GET /api/solana/balance/<address>', iterations, lambda i: status(client.get(
+            f"/api/solana/balance/{rng.choice(fixtures['addresses'])}"))),
+        ('POST /api/solana/balances[100]', iterations,
+         lambda i: status(client.post('/api/solana/balances', json=balances_payload))),
+        ('GET /api/program/<program_id>', iterations,
+         lambda i: status(client.get(f"/api/program/{fixtures['program_id']}"))),
+        ('GET /api/loans/<loan_pda>', iterations, lambda i: status(client.get(f"/api/loans/{fixtures['loan_pda']}"))),
+        # The stand-in doesn't run the program, so the loan stays active and unpaid
+        ('POST /api/loans/<loan_pda>/payments', iterations, lambda i: status(client.post(
+            f"/api/loans/{fixtures['loan_pda']}/payments", json={
+                'borrowerPrivateKey': str(fixtures['borrower']), 'borrowerPublicKey': str(fixtures['borrower'].pubkey()),
+                'lenderPublicKey': fixtures['lender'], 'paymentAmount': 1000}))),
+        ('POST /api/wallet/transfer', iterations, lambda i: status(client.post('/api/wallet/transfer', json={
+            'destination': rng.choice(fixtures['addresses']), 'amount': 0.001}))),
+        ('POST /api/solana/transfer', iterations, lambda i: status(client.post('/api/solana/transfer', json={
+            'private_key': list(bytes(fixtures['sender'])), 'wallet_to': rng.choice(fixtures['addresses']),
+            'transfer_amount': 0.001}))),
+    ]
+
+def time_benchmark(fn, iterations, warmup=WARMUP, check_status=False):
+    for i in range(warmup):
+        fn(i)
+    samples, errors = [], 0
+    for i in range(warmup, warmup + iterations):
+        started = time.perf_counter()
+        result = fn(i)
+        samples.append(time.perf_counter() - started)
+        if check_status and result >= 400:
+            errors += 1
+    return samples, errors
+
+def summarize(samples, errors):
+    ordered = sorted(samples)
+    ms = [s * 1000 for s in ordered]
+    return {
+        'iterations': len(ms),
+        'errors': errors,
+        'mean_ms': round(statistics.fmean(ms), 4),
+        'median_ms': round(statistics.median(ms), 4),
+        'p95_ms': round(ms[max(0, int(round(0.95 * len(ms))) - 1)], 4),
+        'min_ms': round(ms[0], 4),
+        'max_ms': round(ms[-1], 4),
+        'stdev_ms': round(statistics.stdev(ms), 4) if len(ms) > 1 else 0.0,
+    }
+
+
+# Running and comparing
+
+def _git_revision():
+    try:
+        root = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit or None, dirty
+    except OSError:
+        return None, None
+
+def run_benchmarks(size='10k', iterations=DEFAULT_ITERATIONS, data_dir='bench_data', output=None,
+                   reseed=False, pattern=None, seed=0):
+    """Seed (or reuse) a database of the given size, time every benchmark and
+    return the results dict. pattern is a glob on benchmark names."""
+    rng = random.Random(seed)
+    work_path, counts = prepare_database(data_dir, size, reseed)
+    db.configure_pool(path=work_path)
+    rpc, fixtures = start_rpc_standin(rng)
+
+    # Services start after the environment points at the stand-in RPC, since
+    # they build the Solana registry
+    from app import app, start_services
+    start_services()
+    logging.getLogger().setLevel(logging.WARNING)
+    client = app.test_client()
+
+    benchmarks = [(b, False) for b in db_benchmarks(counts, rng, iterations)]
+    benchmarks += [(b, True) for b in route_benchmarks(client, counts, rng, iterations, fixtures)]
+    results = {}
+    for (name, n, fn), is_route in benchmarks:
+        if pattern and not fnmatch.fnmatch(name, pattern):
+            continue
+        samples, errors = time_benchmark(fn, n, check_status=is_route)
+        results[name] = summarize(samples, errors)
+        stats = results[name]
+        print(f"{name:40s} median={stats['median_ms']:>9.3f}ms p95={stats['p95_ms']:>9.3f}ms "
+              f"errors={errors}", file=sys.stderr)
+    rpc.stop()
+
+    commit, dirty = _git_revision()
+    report = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'size': size,
+            'rows': counts,
+            'iterations': iterations,
+            'seed': seed,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+        },
+        'benchmarks': results,
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+def compare_reports(base, head, threshold=DEFAULT_THRESHOLD, metric='median_ms'):
+    """Return rows of (name, base, head, relative change, verdict) for the
+    benchmarks present in both reports."""
+    rows = []
+    for name in sorted(set(base['benchmarks']) | set(head['benchmarks'])):
+        old = base['benchmarks'].get(name)
+        new = head['benchmarks'].get(name)
+        if old is None or new is None:
+            rows.append((name, old and old[metric], new and new[metric], None, 'missing'))
+            continue
+        change = (new[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+        if change > threshold:
+            verdict = 'slower'
+        elif change < -threshold:
+            verdict = 'faster'
+        else:
+            verdict = ''
+        rows.append((name, old[metric], new[metric], change, verdict))
+    return rows
+
+def _print_comparison(base, head, rows, metric):
+    if base['meta']['size'] != head['meta']['size']:
+        print(f"warning: comparing different sizes ({base['meta']['size']} vs {head['meta']['size']})")
+    print(f"base {base['meta']['commit']}  head {head['meta']['commit']}  ({metric})")
+    for name, old, new, change, verdict in rows:
+        if change is None:
+            print(f"{name:40s} {'-' if old is None else old:>10} {'-' if new is None else new:>10}  {verdict}")
+        else:
+            print(f"{name:40s} {old:>10.3f} {new:>10.3f} {change:>+8.1%}  {verdict}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Offline benchmarks for db.py and the Flask routes")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="Seed a database and time every benchmark")
+    run.add_argument('--size', choices=SIZES, default='10k')
+    run.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS)
+    run.add_argument('--data-dir', default='bench_data', help="Where seeded databases are kept between runs")
+    run.add_argument('--reseed', action='store_true', help="Rebuild the seeded database")
+    run.add_argument('--filter', help="Only run benchmarks whose name matches this glob")
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--output', default='benchmark_results.json')
+
+    compare = commands.add_parser('compare', help="Compare two result files")
+    compare.add_argument('base')
+    compare.add_argument('head')
+    compare.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                         help="Relative change reported as slower/faster (default 0.10)")
+    compare.add_argument('--metric', default='median_ms', choices=['mean_ms', 'median_ms', 'p95_ms', 'min_ms'])
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run_benchmarks(args.size, args.iterations, args.data_dir, args.output, args.reseed, args.filter, args.seed)
+        print(f"Results written to {args.output}")
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.head) as f:
+            head = json.load(f)
+        rows = compare_reports(base, head, args.threshold, args.metric)
+        _print_comparison(base, head, rows, args.metric)
+        # Non-zero exit so CI can fail on a regression
+        sys.exit(1 if any(verdict == 'slower' for *_, verdict in rows) else 0)
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+import threading
+
+from solders.signature import Signature
+from solders.transaction_status import TransactionConfirmationStatus
+
+from async_runtime import get_background_loop
+from db import get_db_connection
+from solana_client import get_registry
+
+logger = logging.getLogger(__name__)
+
+MAX_STATUSES_PER_REQUEST = 256  # getSignatureStatuses limit
+POLL_BATCH = 1024  # pending signatures looked at per poll
+
+# Confirmation level a signature must reach to count as confirmed
+TARGET_LEVELS = {
+    'processed': (TransactionConfirmationStatus.Processed, TransactionConfirmationStatus.Confirmed,
+                  TransactionConfirmationStatus.Finalized),
+    'confirmed': (TransactionConfirmationStatus.Confirmed, TransactionConfirmationStatus.Finalized),
+    'finalized': (TransactionConfirmationStatus.Finalized,),
+}
+# (solders' enum isn't hashable, so this is a list of pairs, not a dict)
+LEVEL_NAMES = [
+    (TransactionConfirmationStatus.Processed, 'processed'),
+    (TransactionConfirmationStatus.Confirmed, 'confirmed'),
+    (TransactionConfirmationStatus.Finalized, 'finalized'),
+]
+
+def level_name(confirmation_status):
+    for level, name in LEVEL_NAMES:
+        if confirmation_status == level:
+            return name
+    return None
+
+
+class ConfirmationTracker:
+    """Follows sent transactions to confirmation off the request path.
+
+    Endpoints call track() right after sending and return the signature. A
+    task on the shared background loop polls every pending signature in
+    SignatureStatuses with batched getSignatureStatuses calls and records
+    the outcome: 'confirmed' once it reaches the target commitment, 'failed'
+    if it landed with an error, 'expired' once its blockhash is past its last
+    valid block height (or, when that is unknown, after expire_after
+    seconds). A confirmed signature with a transaction_id is also written to
+    Transactions.blockchain_tx_id. Pending rows survive restarts and are
+    picked up by the next process; on_resolved callbacks (for in-memory
+    follow-up such as cache invalidation) do not.
+    """
+
+    def __init__(self, poll_interval=1.0, commitment='confirmed', expire_after=150.0):
+        self.poll_interval = poll_interval
+        self.commitment = commitment
+        self.expire_after = expire_after
+        self._future = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._callbacks = {}  # signature -> on_resolved(status)
+
+    def track(self, signature, kind, transaction_id=None, last_valid_block_height=None, on_resolved=None):
+        if on_resolved is not None:
+            self._callbacks[str(signature)] = on_resolved
+        with get_db_connection() as conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO SignatureStatuses (signature, kind, transaction_id, last_valid_block_height)
+                VALUES (?, ?, ?, ?)
+            ''', (str(signature), kind, transaction_id, last_valid_block_height))
+        self.ensure_running()
+
+    def get_status(self, signature):
+        with get_db_connection() as conn:
+            row = conn.execute('''
+                SELECT signature, kind, transaction_id, status, confirmation_status, slot, error, created_at, updated_at
+                FROM SignatureStatuses WHERE signature = ?
+            ''', (signature,)).fetchone()
+        if row is None:
+            return None
+        keys = ('signature', 'kind', 'transaction_id', 'status', 'confirmation_status', 'slot', 'error',
+                'created_at', 'updated_at')
+        return dict(zip(keys, row))
+
+    def ensure_running(self):
+        """Start the poll task on the background loop if this process has none."""
+        with self._lock:
+            if self._future is not None and not self._future.done() and self._pid == os.getpid():
+                return
+            self._future = get_background_loop().submit(self._run())
+            self._pid = os.getpid()
+
+    async def close(self):
+        """Cancel the poll task (run on the background loop at shutdown)."""
+        with self._lock:
+            future, self._future = self._future, None
+        if future is not None:
+            future.cancel()
+            await asyncio.sleep(0)
+
+    async def _run(self):
+        while True:
+            try:
+                client, _, _ = get_registry().get()
+                await self.poll_once(client)
+            except Exception as e:
+                logger.warning(f"Confirmation poll failed: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll_once(self, client):
+        """Check one batch of pending signatures; return how many were resolved."""
+        with get_db_connection() as conn:
+            pending = conn.execute('''
+                SELECT signature, last_valid_block_height,
+                       (julianday('now') - julianday(created_at)) * 86400
+                FROM SignatureStatuses WHERE status = 'pending'
+                ORDER BY created_at LIMIT ?
+            ''', (POLL_BATCH,)).fetchall()
+        if not pending:
+            return 0
+
+        signatures = [Signature.from_string(row[0]) for row in pending]
+        responses = await asyncio.gather(*(
+            client.get_signature_statuses(signatures[i:i + MAX_STATUSES_PER_REQUEST])
+            for i in range(0, len(signatures), MAX_STATUSES_PER_REQUEST)
+        ))
+        statuses = [status for resp in responses for status in resp.value]
+
+        target = TARGET_LEVELS[self.commitment]
+        height = None
+        resolved, seen = [], []
+        for (signature, last_valid, age), status in zip(pending, statuses):
+            if status is None:
+                if last_valid is not None:
+                    if height is None:
+                        height = (await client.get_block_height()).value
+                    expired = height > last_valid
+                else:
+                    expired = age > self.expire_after
+                if expired:
+                    resolved.append(('expired', None, None, None, signature))
+            elif status.err is not None:
+                resolved.append(('failed', level_name(status.confirmation_status), status.slot,
+                                 str(status.err), signature))
+            elif status.confirmation_status in target:
+                resolved.append(('confirmed', level_name(status.confirmation_status), status.slot, None, signature))
+            else:
+                seen.append((level_name(status.confirmation_status), status.slot, signature))
+
+        if resolved or seen:
+            with get_db_connection() as conn:
+                conn.executemany('''
+                    UPDATE SignatureStatuses
+                    SET status = ?, confirmation_status = ?, slot = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE signature = ?
+                ''', resolved)
+                conn.executemany('''
+                    UPDATE SignatureStatuses
+                    SET confirmation_status = ?, slot = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE signature = ?
+                ''', seen)
+                # Same effect as /api/transaction/transfer, now backed by a confirmation
+                conn.executemany('''
+                    UPDATE Transactions SET blockchain_tx_id = ?, status = 'completed'
+                    WHERE transaction_id = (SELECT transaction_id FROM SignatureStatuses WHERE signature = ?)
+                ''', [(row[-1], row[-1]) for row in resolved if row[0] == 'confirmed'])
+        for row in resolved:
+            if row[0] != 'confirmed':
+                logger.warning(f"Transaction {row[-1]} {row[0]}{': ' + row[3] if row[3] else ''}")
+            callback = self._callbacks.pop(row[-1], None)
+            if callback is not None:
+                try:
+                    callback(row[0])
+                except Exception as e:
+                    logger.warning(f"Callback for {row[-1]} failed: {str(e)}")
+        return len(resolved)
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+def get_confirmation_tracker():
+    global _tracker
+    if _tracker is None:
+        with _tracker_lock:
+            if _tracker is None:
+                _tracker = ConfirmationTracker(
+                    poll_interval=float(os.getenv('CONFIRMATION_POLL_INTERVAL', '1')),
+                    commitment=os.getenv('CONFIRMATION_COMMITMENT', 'confirmed'),
+                    expire_after=float(os.getenv('CONFIRMATION_EXPIRE_AFTER', '150')),
+                )
+    return _tracker
@@ -0,0 +1,154 @@
+import argparse
+import json
+import logging
+import time
+from functools import partial
+
+import numpy as np
+
+from db import (BULK_CHUNK_SIZE, fetch_array, get_db_connection, group_totals, match_ids,
+                run_write_transaction, update_user_score_bulk)
+
+logger = logging.getLogger(__name__)
+
+SCORE_MIN, SCORE_MAX = 300.0, 850.0
+# Share of the score each component carries (sums to 1)
+SCORE_WEIGHTS = {
+    'on_time': 0.5,    # installments paid vs. missed (late, or due and past due)
+    'lateness': 0.2,   # how far behind the missed, still unpaid ones are
+    'exposure': 0.2,   # installments still owed relative to the amount borrowed
+    'history': 0.1,    # number of loans taken
+}
+# Beta prior on the on-time ratio, so one early miss or payment doesn't pin it to 0 or 1
+PRIOR_ON_TIME, PRIOR_MISSED = 1.0, 1.0
+LATENESS_CAP_DAYS = 90.0  # average days late at which the lateness component bottoms out
+LOAN_COUNT_SATURATION = 10  # loans at which the history component maxes out
+SCORE_TOLERANCE = 0.05  # scores that moved less than this are not rewritten
+
+# Per-installment outcome codes, computed in SQL so only numbers cross into Python
+UPCOMING, PAID, MISSED = 0, 1, 2
+
+LOANS_QUERY = '''
+    SELECT transaction_id, borrower_id, loan_amount FROM Transactions {where}
+    ORDER BY transaction_id
+'''
+# One row per installment, in table order. MISSED is 'late', or 'due' and past
+# its due date; days late only count while something is still owed.
+INSTALLMENTS_QUERY = '''
+    SELECT transaction_id,
+           CASE WHEN payment_status = 'paid' THEN 1
+                WHEN payment_status = 'late' OR due_date < :today_date THEN 2 ELSE 0 END,
+           CASE WHEN payment_status != 'paid' AND (payment_status = 'late' OR due_date < :today_date)
+                     AND amount_due > COALESCE(amount_paid, 0)
+                THEN MIN(MAX(:today - julianday(due_date), 0), :cap) ELSE 0 END,
+           CASE WHEN payment_status != 'paid' THEN MAX(amount_due - COALESCE(amount_paid, 0), 0) ELSE 0 END
+    FROM Payments {where}
+'''
+
+
+def aggregate_history(loans, installments, size=0):
+    """Per-borrower totals from the LOANS_QUERY and INSTALLMENTS_QUERY rows.
+
+    User ids are small dense integers, so the group-by is np.bincount: each
+    total is an array indexed by user_id, at least size long.
+    """
+    loan_ids, borrowers, amounts = loans.T
+    borrowers = borrowers.astype(np.int64)
+    transaction, outcome, days_late, unpaid = installments.T
+    size = max(size, int(borrowers.max()) + 1 if len(borrowers) else 0)
+    # Loan ids come sorted, so each installment finds its borrower by bisection
+    position, known = match_ids(loan_ids, transaction)
+    owner = borrowers[position[known]]
+    total = partial(group_totals, size=size)
+
+    return {
+        'loans': total(borrowers),
+        'borrowed': total(borrowers, amounts),
+        'on_time': total(owner, (outcome[known] == PAID).astype(np.float64)),
+        'missed': total(owner, (outcome[known] == MISSED).astype(np.float64)),
+        'days_late': total(owner, days_late[known]),
+        'outstanding': total(owner, unpaid[known]),
+    }
+
+def score_users(totals, user_ids):
+    """Scores for user_ids from aggregate_history() totals; users without loans get the prior."""
+    on_time, missed, borrowed = (totals[name][user_ids] for name in ('on_time', 'missed', 'borrowed'))
+    components = {
+        'on_time': (on_time + PRIOR_ON_TIME) / (on_time + missed + PRIOR_ON_TIME + PRIOR_MISSED),
+        'lateness': 1.0 - totals['days_late'][user_ids] / np.maximum(missed, 1.0) / LATENESS_CAP_DAYS,
+        'exposure': 1.0 - np.divide(totals['outstanding'][user_ids], borrowed,
+                                    out=np.zeros_like(borrowed), where=borrowed > 0),
+        'history': np.log1p(totals['loans'][user_ids]) / np.log1p(LOAN_COUNT_SATURATION),
+    }
+    composite = sum(weight * np.clip(components[name], 0.0, 1.0) for name, weight in SCORE_WEIGHTS.items())
+    return np.round(SCORE_MIN + (SCORE_MAX - SCORE_MIN) * composite, 1)
+
+def recompute_scores(incremental=False):
+    """Recompute Users.score from payment history in one pass.
+
+    The full run scores every user; the incremental one only the users
+    ScoreQueue's triggers flagged since the last run. Loans and installments
+    are streamed into NumPy arrays from one read snapshot (a Transactions scan
+    and a Payments scan in table order, with each installment's outcome worked
+    out in SQL), totalled per borrower with NumPy, and only scores that
+    moved are written back, in BULK_CHUNK_SIZE-row write transactions so API
+    writers are never held off for long. Returns the run's counts and timings.
+    """
+    started = time.perf_counter()
+    with get_db_connection() as conn:
+        conn.execute("BEGIN")  # one snapshot for the queue, the users and their history
+        today, today_date = conn.execute("SELECT julianday('now'), date('now')").fetchone()
+        max_seq = conn.execute("SELECT MAX(seq) FROM ScoreQueue").fetchone()[0] or 0
+        params = {'today': today, 'today_date': today_date, 'cap': LATENESS_CAP_DAYS, 'seq': max_seq}
+        if incremental:
+            users = fetch_array(conn, '''
+                SELECT u.user_id, COALESCE(u.score, 0) FROM ScoreQueue q JOIN Users u ON u.user_id = q.user_id
+                WHERE q.seq <= :seq
+            ''', params, columns=2)
+            queued = "borrower_id IN (SELECT user_id FROM ScoreQueue WHERE seq <= :seq)"
+            loans = fetch_array(conn, LOANS_QUERY.format(where=f"WHERE {queued}"), params, columns=3)
+            installments = fetch_array(conn, INSTALLMENTS_QUERY.format(
+                where=f"WHERE transaction_id IN (SELECT transaction_id FROM Transactions WHERE {queued})"
+            ), params, columns=4)
+        else:
+            users = fetch_array(conn, "SELECT user_id, COALESCE(score, 0) FROM Users", columns=2)
+            loans = fetch_array(conn, LOANS_QUERY.format(where=''), columns=3)
+            installments = fetch_array(conn, INSTALLMENTS_QUERY.format(where=''), params, columns=4)
+    read_done = time.perf_counter()
+
+    user_ids = users[:, 0].astype(np.int64)
+    size = int(user_ids.max()) + 1 if len(user_ids) else 0
+    scores = score_users(aggregate_history(loans, installments, size), user_ids)
+    changed = np.abs(scores - users[:, 1]) >= SCORE_TOLERANCE
+    updates = list(zip(user_ids[changed].tolist(), scores[changed].tolist()))
+    score_done = time.perf_counter()
+
+    for i in range(0, len(updates), BULK_CHUNK_SIZE):
+        chunk = updates[i:i + BULK_CHUNK_SIZE]
+        run_write_transaction(lambda conn: update_user_score_bulk(chunk, conn=conn))
+    # Users touched after the snapshot carry a higher seq and stay queued
+    run_write_transaction(lambda conn: conn.execute("DELETE FROM ScoreQueue WHERE seq <= ?", (max_seq,)))
+    finished = time.perf_counter()
+
+    result = {
+        'mode': 'incremental' if incremental else 'full',
+        'users': len(user_ids),
+        'changed': len(updates),
+        'loans': len(loans),
+        'installments': len(installments),
+        'read_s': round(read_done - started, 3),
+        'score_s': round(score_done - read_done, 3),
+        'write_s': round(finished - score_done, 3),
+        'elapsed_s': round(finished - started, 3),
+    }
+    logger.info(f"Credit scores recomputed: {result}")
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Recompute Users.score from payment history")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only rescore users whose loans or payments changed since the last run")
+    args = parser.parse_args()
+    print(json.dumps(recompute_scores(incremental=args.incremental), indent=2))
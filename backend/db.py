@@ -1,12 +1,501 @@
 import sqlite3
 import sys
 import json
+import base64
 from datetime import datetime
 import os
+import queue
+import random
+import threading
+import time
+from itertools import chain
+
+import numpy as np
+
+DB_PATH = os.getenv('LOAN_DB_PATH', 'loan_platform.db')
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '256'))
+BULK_CHUNK_SIZE = int(os.getenv('DB_BULK_CHUNK_SIZE', '5000'))
+# Rows fetch_array() pulls from the cursor per batch
+FETCH_SIZE = int(os.getenv('DB_FETCH_SIZE', '100000'))
+PRAGMA_PROFILE = os.getenv('DB_PRAGMA_PROFILE', 'production')
+# Retries of a write transaction that still finds the database busy once
+# busy_timeout has run out, with jittered exponential backoff between them
+WRITE_RETRY_ATTEMPTS = int(os.getenv('DB_WRITE_RETRY_ATTEMPTS', '5'))
+WRITE_RETRY_BACKOFF = float(os.getenv('DB_WRITE_RETRY_BACKOFF', '0.01'))
+WRITE_RETRY_BACKOFF_MAX = float(os.getenv('DB_WRITE_RETRY_BACKOFF_MAX', '0.5'))
+
+# PRAGMA profiles applied to every pooled connection. 'production' runs the
+# database in WAL mode so dashboard reads don't block API writes; the WAL is
+# checkpointed every wal_autocheckpoint pages and truncated back to
+# journal_size_limit bytes afterwards so it can't grow unbounded.
+PRAGMA_PROFILES = {
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -65536,  # negative = KiB, i.e. 64 MiB
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY',
+        'foreign_keys': 'ON',
+        'wal_autocheckpoint': 1000,
+        'journal_size_limit': 67108864,
+    },
+    # SQLite's own defaults (rollback journal), for debugging or network filesystems
+    'default': {},
+}
+
+def get_pragmas(profile=None):
+    profile = profile or PRAGMA_PROFILE
+    if profile not in PRAGMA_PROFILES:
+        raise ValueError(f"Unknown PRAGMA profile: {profile}")
+    return PRAGMA_PROFILES[profile]
+
+def apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+# Connection pool shared by every helper below and by app.py
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared across Flask request threads.
+
+    Connections are opened lazily up to ``size`` and handed back out LIFO, so a
+    warm connection (and its prepared statement cache) is reused by the next
+    request instead of being torn down.
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=POOL_TIMEOUT, pragmas=None):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = get_pragmas() if pragmas is None else pragmas
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        apply_pragmas(conn, self.pragmas)
+        return conn
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("Timed out waiting for a pooled database connection")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+        except sqlite3.Error:
+            # Broken connection, drop it so the slot gets a fresh one
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class PooledConnection:
+    """Checked-out pool connection.
+
+    Behaves like a ``sqlite3.Connection``; ``close()`` returns it to the pool.
+    Used as a context manager it commits (or rolls back on error) and then
+    releases the connection.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+        self._conn = pool.acquire()
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self._conn is not None:
+                if exc_type is None:
+                    self._conn.commit()
+                else:
+                    self._conn.rollback()
+        finally:
+            self.close()
+        return False
+
+    def __del__(self):
+        self.close()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool, _pool_pid
+    # Connections must not cross a fork, so each process builds its own pool
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(DB_PATH, POOL_SIZE, POOL_TIMEOUT, get_pragmas())
+                _pool_pid = os.getpid()
+    return _pool
+
+def configure_pool(path=None, size=None, timeout=None, pragma_profile=None):
+    """Replace the process pool, e.g. to point it at another database file."""
+    global _pool, _pool_pid, DB_PATH, POOL_SIZE, POOL_TIMEOUT, PRAGMA_PROFILE
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close_all()
+        if path is not None:
+            DB_PATH = path
+        if size is not None:
+            POOL_SIZE = size
+        if timeout is not None:
+            POOL_TIMEOUT = timeout
+        if pragma_profile is not None:
+            get_pragmas(pragma_profile)
+            PRAGMA_PROFILE = pragma_profile
+        _pool = ConnectionPool(DB_PATH, POOL_SIZE, POOL_TIMEOUT, get_pragmas())
+        _pool_pid = os.getpid()
+    return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close_all()
+        _pool = None
+
+def checkpoint_wal(mode='PASSIVE'):
+    """Checkpoint the WAL into the main database file.
+
+    PASSIVE never blocks writers and is safe to call from a request or a timer;
+    TRUNCATE waits for readers and resets the WAL file to zero bytes, which is
+    what the nightly job / `python db.py checkpoint` uses. Returns
+    (busy, wal_pages, checkpointed_pages).
+    """
+    if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+        raise ValueError(f"Unknown checkpoint mode: {mode}")
+    with get_db_connection() as conn:
+        return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+def get_db_connection():
+    return PooledConnection(get_pool())
+
+SQLITE_BUSY, SQLITE_LOCKED = 5, 6
+
+def is_busy_error(e):
+    """True for SQLITE_BUSY/SQLITE_LOCKED (any extended code), i.e. worth retrying."""
+    if not isinstance(e, sqlite3.OperationalError):
+        return False
+    code = getattr(e, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (SQLITE_BUSY, SQLITE_LOCKED)
+    return 'locked' in str(e) or 'busy' in str(e)
+
+def run_write_transaction(work, attempts=None, backoff=None):
+    """Run work(conn) in a BEGIN IMMEDIATE transaction and commit it.
+
+    Taking the write lock up front means reads inside work see the state the
+    transaction commits against; a deferred transaction that reads first and
+    upgrades later fails with SQLITE_BUSY instead of waiting. If the lock (or
+    the commit) is still busy after busy_timeout, the whole transaction is
+    retried up to attempts times with jittered exponential backoff, so work
+    must be safe to run again. Returns whatever work returns.
+    """
+    attempts = max(1, WRITE_RETRY_ATTEMPTS if attempts is None else attempts)
+    backoff = WRITE_RETRY_BACKOFF if backoff is None else backoff
+    for attempt in range(attempts):
+        try:
+            with get_db_connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                return work(conn)
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or attempt == attempts - 1:
+                raise
+            time.sleep(min(WRITE_RETRY_BACKOFF_MAX, backoff * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+# Managed index set for the hot query paths. Bump INDEX_SET_VERSION whenever
+# INDEXES changes; give a changed definition a new name, since ensure_indexes()
+# only creates missing idx_* indexes and drops the ones no longer listed.
+INDEX_SET_VERSION = 4
+INDEXES = {
+    # get_loans / fulfill_loan_posting: open posts newest first
+    'idx_posts_open_created': "CREATE INDEX IF NOT EXISTS idx_posts_open_created ON Posts(created_at, post_id) WHERE status = 'open'",
+    # Status filters other than 'open' (dashboard, funded/closed lookups)
+    'idx_posts_status_created': "CREATE INDEX IF NOT EXISTS idx_posts_status_created ON Posts(status, created_at)",
+    # Activity feed ORDER BY created_at
+    'idx_posts_created': "CREATE INDEX IF NOT EXISTS idx_posts_created ON Posts(created_at, post_id)",
+    'idx_posts_user': "CREATE INDEX IF NOT EXISTS idx_posts_user ON Posts(user_id)",
+    'idx_transactions_lender': "CREATE INDEX IF NOT EXISTS idx_transactions_lender ON Transactions(lender_id)",
+    'idx_transactions_borrower': "CREATE INDEX IF NOT EXISTS idx_transactions_borrower ON Transactions(borrower_id)",
+    'idx_transactions_post': "CREATE INDEX IF NOT EXISTS idx_transactions_post ON Transactions(post_id)",
+    # A loan's installments in one status (re-amortization, scoring)
+    'idx_payments_transaction_status': "CREATE INDEX IF NOT EXISTS idx_payments_transaction_status ON Payments(transaction_id, payment_status)",
+    # pay_loan settles a loan's unpaid installments oldest first
+    'idx_payments_transaction_due': "CREATE INDEX IF NOT EXISTS idx_payments_transaction_due ON Payments(transaction_id, due_date)",
+    # Overdue 'due' installments (late-payment sweeper) and long-late ones (defaults)
+    'idx_payments_status_due': "CREATE INDEX IF NOT EXISTS idx_payments_status_due ON Payments(payment_status, due_date)",
+    # Confirmation tracker's poll of outstanding signatures
+    'idx_signatures_pending': "CREATE INDEX IF NOT EXISTS idx_signatures_pending ON SignatureStatuses(created_at) WHERE status = 'pending'",
+}
+
+# Queries the index set has to cover, checked by validate_indexes(). Users.solana_address
+# is served by its UNIQUE constraint's automatic index.
+HOT_QUERIES = {
+    'open_posts': ("SELECT post_id, loan_amount, interest_rate, status FROM Posts WHERE status = 'open' ORDER BY created_at DESC, post_id DESC LIMIT 50", ()),
+    'open_posts_next_page': ("SELECT post_id FROM Posts p WHERE p.status = 'open' AND (p.created_at, p.post_id) < (?, ?) ORDER BY p.created_at DESC, p.post_id DESC LIMIT 51", ('', 0)),
+    'first_open_post': ("SELECT post_id FROM Posts WHERE status = 'open' LIMIT 1", ()),
+    'funded_posts': ("SELECT post_id FROM Posts WHERE status = 'funded' ORDER BY created_at DESC LIMIT 50", ()),
+    'activity_feed': ("SELECT p.post_type, p.loan_amount, p.status FROM Posts p JOIN Users u ON p.user_id = u.user_id ORDER BY p.created_at DESC LIMIT 50", ()),
+    'user_by_solana_address': ("SELECT solana_private_key FROM Users WHERE solana_address = ?", ('',)),
+    'pay_due_payments': ("SELECT payment_id, amount_due - COALESCE(amount_paid, 0) FROM Payments WHERE transaction_id = ? AND payment_status IN ('due', 'late') ORDER BY due_date, payment_id", (0,)),
+    'lender_transactions': ("SELECT * FROM Transactions WHERE lender_id = ?", (0,)),
+    'borrower_transactions': ("SELECT * FROM Transactions WHERE borrower_id = ?", (0,)),
+    'due_payments_by_date': ("SELECT payment_id FROM Payments WHERE payment_status = 'due' AND due_date < ?", ('',)),
+    'sweep_late_payments': ("UPDATE Payments SET payment_status = 'late' WHERE payment_id IN (SELECT payment_id FROM Payments WHERE payment_status = 'due' AND due_date < ? LIMIT 500)", ('',)),
+    'next_late_due_date': ("SELECT MIN(due_date) FROM Payments WHERE payment_status = 'late' AND due_date > ? AND due_date < ?", ('', '')),
+    'late_payments_past_grace': ("SELECT p.payment_id, p.transaction_id FROM Payments p JOIN Transactions t ON t.transaction_id = p.transaction_id WHERE p.payment_status = 'late' AND p.due_date = ? AND p.payment_id > ? AND p.amount_paid < p.amount_due AND t.status = 'active' ORDER BY p.payment_id LIMIT 500", ('', 0)),
+    'lender_portfolio_loans': ("SELECT transaction_id, loan_amount, status FROM Transactions WHERE lender_id = ? ORDER BY transaction_id", (0,)),
+    'lender_portfolio_installments': ("SELECT transaction_id, due_date, amount_due, payment_status FROM Payments WHERE transaction_id IN (SELECT transaction_id FROM Transactions WHERE lender_id = ?)", (0,)),
+    'pending_signatures': ("SELECT signature FROM SignatureStatuses WHERE status = 'pending' ORDER BY created_at LIMIT 1024", ()),
+}
+
+def ensure_indexes(conn):
+    """Bring the idx_* indexes in line with INDEXES and record INDEX_SET_VERSION."""
+    existing = {row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx\\_%' ESCAPE '\\'"
+    )}
+    for name in existing - INDEXES.keys():
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    for sql in INDEXES.values():
+        conn.execute(sql)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != INDEX_SET_VERSION:
+        # Refresh planner statistics for the new indexes
+        conn.execute("PRAGMA optimize")
+        conn.execute(f"PRAGMA user_version = {INDEX_SET_VERSION}")
+    conn.commit()
+
+def explain_query_plan(sql, params=()):
+    with get_db_connection() as conn:
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def validate_indexes():
+    """Return {query_name: plan} for every hot query that still full-scans or sorts."""
+    problems = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = explain_query_plan(sql, params)
+        for detail in plan:
+            if (detail.startswith('SCAN') and 'INDEX' not in detail) or 'TEMP B-TREE' in detail:
+                problems[name] = plan
+                break
+    return problems
+
+# Running totals kept by triggers, so the dashboard's headline numbers are
+# a few PlatformStats rows instead of SUM/COUNT scans over whole tables.
+# table -> (status column, amount column, paid column); None means not tracked
+STATS_TABLES = {
+    'Users': (None, None, None),
+    'Posts': ('status', 'loan_amount', None),
+    'Transactions': ('status', 'loan_amount', None),
+    'Payments': ('payment_status', 'amount_due', 'amount_paid'),
+}
+
+def stats_trigger_sql(table):
+    """CREATE TRIGGER statements that keep table's PlatformStats rows current."""
+    status_col, amount_col, paid_col = STATS_TABLES[table]
+
+    def values(row):
+        status = f"COALESCE({row}.{status_col}, '')" if status_col else "''"
+        amount = f"COALESCE({row}.{amount_col}, 0)" if amount_col else "0"
+        paid = f"COALESCE({row}.{paid_col}, 0)" if paid_col else "0"
+        return status, amount, paid
+
+    def add(row):
+        status, amount, paid = values(row)
+        return (f"\n    INSERT INTO PlatformStats (scope, status, row_count, amount_sum, paid_sum)"
+                f"\n    VALUES ('{table}', {status}, 1, {amount}, {paid})"
+                f"\n    ON CONFLICT(scope, status) DO UPDATE SET row_count = row_count + 1,"
+                f"\n        amount_sum = amount_sum + excluded.amount_sum, paid_sum = paid_sum + excluded.paid_sum;")
+
+    def remove(row):
+        status, amount, paid = values(row)
+        return (f"\n    UPDATE PlatformStats"
+                f"\n    SET row_count = row_count - 1, amount_sum = amount_sum - {amount}, paid_sum = paid_sum - {paid}"
+                f"\n    WHERE scope = '{table}' AND status = {status};")
+
+    name = f"stats_{table.lower()}"
+    statements = [
+        f"CREATE TRIGGER IF NOT EXISTS {name}_insert AFTER INSERT ON {table} BEGIN{add('NEW')}\nEND",
+        f"CREATE TRIGGER IF NOT EXISTS {name}_delete AFTER DELETE ON {table} BEGIN{remove('OLD')}\nEND",
+    ]
+    columns = [column for column in (status_col, amount_col, paid_col) if column]
+    if columns:
+        statements.append(
+            f"CREATE TRIGGER IF NOT EXISTS {name}_update AFTER UPDATE OF {', '.join(columns)} ON {table} "
+            f"BEGIN{remove('OLD')}{add('NEW')}\nEND"
+        )
+    return statements
+
+def rebuild_platform_stats(conn):
+    """Recompute PlatformStats from the tables (first setup, or to repair drift)."""
+    conn.execute("DELETE FROM PlatformStats")
+    for table, (status_col, amount_col, paid_col) in STATS_TABLES.items():
+        conn.execute(f"""
+            INSERT INTO PlatformStats (scope, status, row_count, amount_sum, paid_sum)
+            SELECT '{table}', {f"COALESCE({status_col}, '')" if status_col else "''"}, COUNT(*),
+                   {f"COALESCE(SUM({amount_col}), 0)" if amount_col else "0"},
+                   {f"COALESCE(SUM({paid_col}), 0)" if paid_col else "0"}
+            FROM {table} GROUP BY 2
+        """)
+
+def ensure_platform_stats(conn):
+    """Create PlatformStats and its triggers, backfilling it on first run.
+
+    Runs in one write transaction so no row written meanwhile is counted
+    twice or missed.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'PlatformStats'"
+        ).fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS PlatformStats (
+                scope TEXT NOT NULL,
+                status TEXT NOT NULL,
+                row_count INTEGER NOT NULL DEFAULT 0,
+                amount_sum REAL NOT NULL DEFAULT 0,
+                paid_sum REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (scope, status)
+            ) WITHOUT ROWID
+        """)
+        for table in STATS_TABLES:
+            for sql in stats_trigger_sql(table):
+                conn.execute(sql)
+        if not exists:
+            rebuild_platform_stats(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+# Users whose payment history changed since the last credit-scoring run
+# (credit_scoring.py --incremental). Triggers stamp each touched borrower with
+# a sequence number higher than any queued one; a run rescores the users up
+# to the highest seq it saw and deletes only those, so a user touched while
+# it runs stays queued for the next one.
+SCORE_QUEUE_TRIGGERS = {
+    'score_queue_users_insert': ("AFTER INSERT ON Users", ["SELECT NEW.user_id AS user_id"]),
+    'score_queue_transactions_insert': ("AFTER INSERT ON Transactions", ["SELECT NEW.borrower_id AS user_id"]),
+    'score_queue_transactions_update': ("AFTER UPDATE OF status, loan_amount, borrower_id ON Transactions",
+                                        ["SELECT OLD.borrower_id AS user_id UNION SELECT NEW.borrower_id"]),
+    # New installments arrive with their Transactions row (or, when a loan is
+    # re-amortized, after the old ones are deleted), so Payments inserts need no trigger
+    'score_queue_payments_update': ("AFTER UPDATE OF payment_status, amount_due, amount_paid ON Payments",
+                                    ["SELECT borrower_id AS user_id FROM Transactions WHERE transaction_id = NEW.transaction_id"]),
+    'score_queue_payments_delete': ("AFTER DELETE ON Payments",
+                                    ["SELECT borrower_id AS user_id FROM Transactions WHERE transaction_id = OLD.transaction_id"]),
+}
+
+def score_queue_trigger_sql():
+    statements = []
+    for name, (event, sources) in SCORE_QUEUE_TRIGGERS.items():
+        body = ''.join(
+            f"\n    INSERT INTO ScoreQueue (user_id, seq)"
+            f"\n    SELECT user_id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM ScoreQueue) FROM ({source})"
+            f"\n    WHERE user_id IS NOT NULL"
+            f"\n    ON CONFLICT(user_id) DO UPDATE SET seq = excluded.seq;"
+            for source in sources
+        )
+        statements.append(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN{body}\nEND")
+    return statements
+
+def ensure_score_queue(conn):
+    """Create ScoreQueue and its triggers; on first run every user is queued."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ScoreQueue'"
+        ).fetchone()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ScoreQueue (
+                user_id INTEGER PRIMARY KEY,
+                seq INTEGER NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS score_queue_seq ON ScoreQueue(seq)")
+        for sql in score_queue_trigger_sql():
+            conn.execute(sql)
+        if not exists:
+            conn.execute("INSERT INTO ScoreQueue (user_id, seq) SELECT user_id, 1 FROM Users")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+# Columns added after the first release; ensure_columns() ALTERs them into
+# databases created before they existed
+ADDED_COLUMNS = {
+    'Users': {
+        'successful_payments': 'INTEGER DEFAULT 0',
+    },
+    'Posts': {
+        'filled_amount': 'REAL DEFAULT 0',
+    },
+    'Transactions': {
+        'borrow_post_id': 'INTEGER REFERENCES Posts(post_id)',
+    },
+    'Payments': {
+        'principal_due': 'REAL DEFAULT 0',
+        'interest_due': 'REAL DEFAULT 0',
+    },
+}
+
+def ensure_columns(conn):
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, definition in columns.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+    conn.commit()
 
 def setup_database():
-    # Connect to SQLite database
-    conn = sqlite3.connect('loan_platform.db')
+    # The pooled connection already carries the PRAGMA profile. journal_mode=WAL
+    # is persistent, so the file stays in WAL mode for every later connection
+    # (including the dashboard's plain sqlite3.connect)
+    conn = get_db_connection()
     cursor = conn.cursor()
 
     # Create tables
@@ -21,7 +510,8 @@ def setup_database():
         solana_address TEXT UNIQUE,
         solana_private_key TEXT,
         wallet_amt INTEGER DEFAULT 0,
-        borrow_count INTEGER DEFAULT 0
+        borrow_count INTEGER DEFAULT 0,
+        successful_payments INTEGER DEFAULT 0
     );
 
     -- Posts Table
@@ -34,6 +524,7 @@ def setup_database():
         payment_schedule_id INTEGER,
         status TEXT CHECK(status IN ('open', 'funded', 'closed')) DEFAULT 'open',
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        filled_amount REAL DEFAULT 0,
         FOREIGN KEY (user_id) REFERENCES Users(user_id),
         FOREIGN KEY (payment_schedule_id) REFERENCES PaymentSchedules(schedule_id)
     );
@@ -57,9 +548,11 @@ def setup_database():
         blockchain_tx_id TEXT,
         status TEXT CHECK(status IN ('pending', 'active', 'completed', 'defaulted')) DEFAULT 'pending',
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        borrow_post_id INTEGER,
         FOREIGN KEY (lender_id) REFERENCES Users(user_id),
         FOREIGN KEY (borrower_id) REFERENCES Users(user_id),
         FOREIGN KEY (post_id) REFERENCES Posts(post_id),
+        FOREIGN KEY (borrow_post_id) REFERENCES Posts(post_id),
         FOREIGN KEY (payment_schedule_id) REFERENCES PaymentSchedules(schedule_id)
     );
 
@@ -72,9 +565,43 @@ def setup_database():
         amount_paid REAL DEFAULT 0,
         payment_status TEXT CHECK(payment_status IN ('due', 'paid', 'late')) DEFAULT 'due',
         blockchain_payment_id TEXT,
+        principal_due REAL DEFAULT 0,
+        interest_due REAL DEFAULT 0,
+        FOREIGN KEY (transaction_id) REFERENCES Transactions(transaction_id)
+    );
+
+    -- Signatures the confirmation tracker follows until they land or expire
+    CREATE TABLE IF NOT EXISTS SignatureStatuses (
+        signature TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        transaction_id INTEGER,
+        status TEXT CHECK(status IN ('pending', 'confirmed', 'failed', 'expired')) DEFAULT 'pending',
+        confirmation_status TEXT,
+        slot INTEGER,
+        error TEXT,
+        last_valid_block_height INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (transaction_id) REFERENCES Transactions(transaction_id)
     );
+
+    -- One row per late-payment sweep (payment_sweeper.py)
+    CREATE TABLE IF NOT EXISTS SweepRuns (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        as_of DATE NOT NULL,
+        grace_days INTEGER,
+        payments_marked_late INTEGER NOT NULL DEFAULT 0,
+        transactions_defaulted INTEGER NOT NULL DEFAULT 0,
+        chunks INTEGER NOT NULL DEFAULT 0,
+        max_chunk_ms REAL,
+        duration_s REAL
+    );
     ''')
+    ensure_columns(conn)
+    ensure_indexes(conn)
+    ensure_platform_stats(conn)
+    ensure_score_queue(conn)
 
     # Commit changes and close the connection
     conn.commit()
@@ -85,39 +612,33 @@ def setup_database():
 # Basic functions for adding and changing each field
 
 def add_user(password_hash, email, score=0, solana_address=None, solana_private_key=None):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO Users (password_hash, email, score, solana_address, solana_private_key)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (password_hash, email, score, solana_address, solana_private_key))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Users (password_hash, email, score, solana_address, solana_private_key)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (password_hash, email, score, solana_address, solana_private_key))
 
 def update_user_score(user_id, new_score):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE Users
-        SET score = ?
-        WHERE user_id = ?
-    ''', (new_score, user_id))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE Users
+            SET score = ?
+            WHERE user_id = ?
+        ''', (new_score, user_id))
 
 def update_user_solana_address(user_id, solana_address):
     try:
-        conn = sqlite3.connect('loan_platform.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE Users 
-            SET solana_address = ? 
-            WHERE user_id = ?
-        """, (solana_address, user_id))
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                UPDATE Users 
+                SET solana_address = ? 
+                WHERE user_id = ?
+            """, (solana_address, user_id))
         
-        conn.commit()
-        conn.close()
         return True
     except Exception as e:
         print(f"Error updating Solana address: {e}")
@@ -125,186 +646,393 @@ def update_user_solana_address(user_id, solana_address):
 
 def update_user_solana_private_key(user_id, solana_private_key):
     try:
-        conn = sqlite3.connect('loan_platform.db')
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            UPDATE Users 
-            SET solana_private_key = ? 
-            WHERE user_id = ?
-        """, (solana_private_key, user_id))
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                UPDATE Users 
+                SET solana_private_key = ? 
+                WHERE user_id = ?
+            """, (solana_private_key, user_id))
         
-        conn.commit()
-        conn.close()
         return True
     except Exception as e:
         print(f"Error updating Solana private key: {e}")
         return False
 
 def add_post(user_id, post_type, loan_amount, interest_rate, payment_schedule_id=None):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO Posts (user_id, post_type, loan_amount, interest_rate, payment_schedule_id)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, post_type, loan_amount, interest_rate, payment_schedule_id))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Posts (user_id, post_type, loan_amount, interest_rate, payment_schedule_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, post_type, loan_amount, interest_rate, payment_schedule_id))
 
 def update_post_status(post_id, new_status):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE Posts
-        SET status = ?
-        WHERE post_id = ?
-    ''', (new_status, post_id))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE Posts
+            SET status = ?
+            WHERE post_id = ?
+        ''', (new_status, post_id))
 
 def add_payment_schedule(frequency, duration_in_months):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO PaymentSchedules (frequency, duration_in_months)
-        VALUES (?, ?)
-    ''', (frequency, duration_in_months))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO PaymentSchedules (frequency, duration_in_months)
+            VALUES (?, ?)
+        ''', (frequency, duration_in_months))
 
 def add_transaction(lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule_id, blockchain_tx_id=None):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Transactions (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule_id, blockchain_tx_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule_id, blockchain_tx_id))
+
+def update_transaction_status(transaction_id, new_status):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE Transactions
+            SET status = ?
+            WHERE transaction_id = ?
+        ''', (new_status, transaction_id))
+
+def add_payment(transaction_id, due_date, amount_due, amount_paid=0, payment_status='due', blockchain_payment_id=None):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Payments (transaction_id, due_date, amount_due, amount_paid, payment_status, blockchain_payment_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (transaction_id, due_date, amount_due, amount_paid, payment_status, blockchain_payment_id))
+
+def update_payment_status(payment_id, new_status):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE Payments
+            SET payment_status = ?
+            WHERE payment_id = ?
+        ''', (new_status, payment_id))
+
+# Bulk writers: one transaction per call, executemany in BULK_CHUNK_SIZE chunks.
+# Rows are tuples in the same order as the single-row function's arguments
+# (trailing defaulted ones may be omitted) or dicts keyed by argument name.
+
+def _normalize_rows(rows, columns, defaults):
+    for row in rows:
+        if isinstance(row, dict):
+            yield tuple(row[c] if c in row else defaults[c] for c in columns)
+        else:
+            row = tuple(row)
+            yield row + tuple(defaults[c] for c in columns[len(row):])
+
+def _chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _insert_bulk(sql, rows, chunk_size=None, conn=None):
+    """executemany an INSERT and return the new row ids in input order.
+
+    BEGIN IMMEDIATE makes this connection the only writer for the duration,
+    so each chunk's AUTOINCREMENT ids are contiguous and end at last_insert_rowid().
+    Pass conn to run inside a transaction the caller already holds (and commits).
+    """
+    if conn is None:
+        with get_db_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            return _insert_bulk(sql, rows, chunk_size, conn)
+    ids = []
+    for chunk in _chunked(rows, chunk_size or BULK_CHUNK_SIZE):
+        conn.executemany(sql, chunk)
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        ids.extend(range(last_id - len(chunk) + 1, last_id + 1))
+    return ids
+
+def _update_bulk(sql, rows, chunk_size=None, conn=None):
+    """executemany an UPDATE and return the number of rows changed."""
+    if conn is None:
+        with get_db_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            return _update_bulk(sql, rows, chunk_size, conn)
+    changed = 0
+    for chunk in _chunked(rows, chunk_size or BULK_CHUNK_SIZE):
+        changed += conn.executemany(sql, chunk).rowcount
+    return changed
+
+def add_users_bulk(users, chunk_size=None, conn=None):
+    columns = ('password_hash', 'email', 'score', 'solana_address', 'solana_private_key')
+    defaults = {'score': 0, 'solana_address': None, 'solana_private_key': None}
+    return _insert_bulk('''
+        INSERT INTO Users (password_hash, email, score, solana_address, solana_private_key)
+        VALUES (?, ?, ?, ?, ?)
+    ''', _normalize_rows(users, columns, defaults), chunk_size, conn)
+
+def add_posts_bulk(posts, chunk_size=None, conn=None):
+    columns = ('user_id', 'post_type', 'loan_amount', 'interest_rate', 'payment_schedule_id')
+    defaults = {'payment_schedule_id': None}
+    return _insert_bulk('''
+        INSERT INTO Posts (user_id, post_type, loan_amount, interest_rate, payment_schedule_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', _normalize_rows(posts, columns, defaults), chunk_size, conn)
+
+def add_transactions_bulk(transactions, chunk_size=None, conn=None):
+    columns = ('lender_id', 'borrower_id', 'post_id', 'loan_amount', 'interest_rate', 'payment_schedule_id', 'blockchain_tx_id')
+    defaults = {'blockchain_tx_id': None}
+    return _insert_bulk('''
         INSERT INTO Transactions (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule_id, blockchain_tx_id)
         VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule_id, blockchain_tx_id))
-    conn.commit()
-    conn.close()
+    ''', _normalize_rows(transactions, columns, defaults), chunk_size, conn)
 
-def update_transaction_status(transaction_id, new_status):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
+def add_payments_bulk(payments, chunk_size=None, conn=None):
+    columns = ('transaction_id', 'due_date', 'amount_due', 'amount_paid', 'payment_status', 'blockchain_payment_id', 'principal_due', 'interest_due')
+    defaults = {'amount_paid': 0, 'payment_status': 'due', 'blockchain_payment_id': None, 'principal_due': 0, 'interest_due': 0}
+    return _insert_bulk('''
+        INSERT INTO Payments (transaction_id, due_date, amount_due, amount_paid, payment_status, blockchain_payment_id, principal_due, interest_due)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', _normalize_rows(payments, columns, defaults), chunk_size, conn)
+
+def update_post_status_bulk(post_ids, new_status, chunk_size=None, conn=None):
+    return _update_bulk('''
+        UPDATE Posts
+        SET status = ?
+        WHERE post_id = ?
+    ''', ((new_status, post_id) for post_id in post_ids), chunk_size, conn)
+
+def update_transaction_status_bulk(transaction_ids, new_status, chunk_size=None, conn=None):
+    return _update_bulk('''
         UPDATE Transactions
         SET status = ?
         WHERE transaction_id = ?
-    ''', (new_status, transaction_id))
-    conn.commit()
-    conn.close()
-
-def add_payment(transaction_id, due_date, amount_due, amount_paid=0, payment_status='due', blockchain_payment_id=None):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO Payments (transaction_id, due_date, amount_due, amount_paid, payment_status, blockchain_payment_id)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (transaction_id, due_date, amount_due, amount_paid, payment_status, blockchain_payment_id))
-    conn.commit()
-    conn.close()
+    ''', ((new_status, transaction_id) for transaction_id in transaction_ids), chunk_size, conn)
 
-def update_payment_status(payment_id, new_status):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
+def update_payment_status_bulk(payment_ids, new_status, chunk_size=None, conn=None):
+    return _update_bulk('''
         UPDATE Payments
         SET payment_status = ?
         WHERE payment_id = ?
-    ''', (new_status, payment_id))
-    conn.commit()
-    conn.close()
+    ''', ((new_status, payment_id) for payment_id in payment_ids), chunk_size, conn)
+
+def update_user_score_bulk(scores, chunk_size=None, conn=None):
+    """scores: iterable of (user_id, new_score)."""
+    return _update_bulk('''
+        UPDATE Users
+        SET score = ?
+        WHERE user_id = ?
+    ''', ((new_score, user_id) for user_id, new_score in scores), chunk_size, conn)
+
+# Keyset pagination over Posts, newest first. The cursor carries the
+# (created_at, post_id) of the last row a client has seen, so every page is a
+# range scan on the Posts indexes however deep the client pages.
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 500
+POST_STATUSES = ('open', 'funded', 'closed')
+POST_TYPES = ('borrow', 'lend')
+
+def encode_cursor(created_at, post_id):
+    return base64.urlsafe_b64encode(json.dumps([created_at, post_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        created_at, post_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created_at), int(post_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def get_posts_page(columns, status=None, post_type=None, user_id=None, cursor=None, limit=PAGE_SIZE_DEFAULT, join_users=False):
+    """Return (rows, next_cursor) for one page of Posts (alias p, Users as u).
+
+    columns is the SELECT list; created_at and post_id are appended so the
+    next cursor can be built and stripped again from the returned rows.
+    next_cursor is None on the last page.
+    """
+    conditions, params = [], []
+    if status is not None:
+        if status not in POST_STATUSES:
+            raise ValueError(f"Invalid status: {status}")
+        # Inlined (it's validated) so the planner can use the partial open-posts index
+        conditions.append(f"p.status = '{status}'")
+    if post_type is not None:
+        if post_type not in POST_TYPES:
+            raise ValueError(f"Invalid post_type: {post_type}")
+        conditions.append("p.post_type = ?")
+        params.append(post_type)
+    if user_id is not None:
+        conditions.append("p.user_id = ?")
+        params.append(user_id)
+    if cursor is not None:
+        created_at, post_id = decode_cursor(cursor)
+        # Row-value form so SQLite turns it into an index range, not a filter
+        conditions.append("(p.created_at, p.post_id) < (?, ?)")
+        params.extend([created_at, post_id])
+
+    limit = max(1, min(int(limit), PAGE_SIZE_MAX))
+    sql = f'''
+        SELECT {columns}, p.created_at, p.post_id
+        FROM Posts p
+        {"JOIN Users u ON u.user_id = p.user_id" if join_users else ""}
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY p.created_at DESC, p.post_id DESC
+        LIMIT ?
+    '''
+    with get_db_connection() as conn:
+        rows = conn.execute(sql, params + [limit + 1]).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][-2], rows[-1][-1])
+    return [row[:-2] for row in rows], next_cursor
+
+def iter_posts(columns, page_size=PAGE_SIZE_MAX, **filters):
+    """Yield every matching Posts row, one keyset page at a time.
+
+    Each page is its own short query, so a long export neither pins a pooled
+    connection nor holds a read snapshot open for its whole duration.
+    """
+    cursor = filters.pop('cursor', None)
+    while True:
+        rows, cursor = get_posts_page(columns, cursor=cursor, limit=page_size, **filters)
+        yield from rows
+        if cursor is None:
+            break
+
+def fetch_array(conn, sql, params=(), columns=None):
+    """Run sql and collect its rows into one float64 array, FETCH_SIZE rows at a time."""
+    cursor = conn.execute(sql, params)
+    columns = columns or len(cursor.description)
+    chunks = []
+    for rows in iter(lambda: cursor.fetchmany(FETCH_SIZE), []):
+        chunks.append(np.fromiter(chain.from_iterable(rows), dtype=np.float64,
+                                  count=len(rows) * columns).reshape(-1, columns))
+    if not chunks:
+        return np.empty((0, columns))
+    return np.concatenate(chunks)
+
+def match_ids(sorted_ids, ids):
+    """Row of each of ids in sorted_ids, found by bisection.
+
+    Joins fetch_array() results on an id column, e.g. installments to the
+    loans of an ORDER BY transaction_id query. Returns (position, known):
+    known is False where an id is not in sorted_ids, and only position[known]
+    is meaningful.
+    """
+    position = np.minimum(np.searchsorted(sorted_ids, ids), max(len(sorted_ids) - 1, 0))
+    known = sorted_ids[position] == ids if len(sorted_ids) else np.zeros(len(ids), dtype=bool)
+    return position, known
+
+def group_totals(keys, weights=None, size=0):
+    """Sum of weights (or count) per small integer key, as a float64 array at least size long."""
+    return np.bincount(keys, weights, minlength=size).astype(np.float64, copy=False)
 
 # Getter functions for each data type
 
 def get_user(user_id):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM Users WHERE user_id = ?
-    ''', (user_id,))
-    user = cursor.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM Users WHERE user_id = ?
+        ''', (user_id,))
+        user = cursor.fetchone()
     return user
 
 def get_post(post_id):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM Posts WHERE post_id = ?
-    ''', (post_id,))
-    post = cursor.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM Posts WHERE post_id = ?
+        ''', (post_id,))
+        post = cursor.fetchone()
     return post
 
 def get_payment_schedule(schedule_id):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM PaymentSchedules WHERE schedule_id = ?
-    ''', (schedule_id,))
-    schedule = cursor.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM PaymentSchedules WHERE schedule_id = ?
+        ''', (schedule_id,))
+        schedule = cursor.fetchone()
     return schedule
 
 def get_transaction(transaction_id):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM Transactions WHERE transaction_id = ?
-    ''', (transaction_id,))
-    transaction = cursor.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM Transactions WHERE transaction_id = ?
+        ''', (transaction_id,))
+        transaction = cursor.fetchone()
     return transaction
 
 def get_payment(payment_id):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM Payments WHERE payment_id = ?
-    ''', (payment_id,))
-    payment = cursor.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM Payments WHERE payment_id = ?
+        ''', (payment_id,))
+        payment = cursor.fetchone()
     return payment
 
+def get_platform_stats():
+    """Headline counts and sums per table, read from PlatformStats.
+
+    Returns {table: {'count', 'amount', 'paid', 'by_status': {status: {...}}}};
+    'amount' is loan_amount for Posts/Transactions and amount_due for Payments.
+    """
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT scope, status, row_count, amount_sum, paid_sum FROM PlatformStats
+        ''').fetchall()
+    stats = {table: {'count': 0, 'amount': 0.0, 'paid': 0.0, 'by_status': {}} for table in STATS_TABLES}
+    for scope, status, count, amount, paid in rows:
+        totals = stats[scope]
+        totals['count'] += count
+        totals['amount'] += amount
+        totals['paid'] += paid
+        if status:
+            totals['by_status'][status] = {'count': count, 'amount': amount, 'paid': paid}
+    return stats
+
 def create_post(account_name, loan_amount, interest_rate, payment_schedule):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO Posts (account_name, loan_amount, interest_rate, payment_schedule)
-        VALUES (?, ?, ?, ?)
-    ''', (account_name, loan_amount, interest_rate, payment_schedule))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Posts (account_name, loan_amount, interest_rate, payment_schedule)
+            VALUES (?, ?, ?, ?)
+        ''', (account_name, loan_amount, interest_rate, payment_schedule))
 
 def create_user(password_hash, email, solana_address=None, solana_private_key=None):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO Users (password_hash, email, solana_address, solana_private_key)
-        VALUES (?, ?, ?, ?)
-    ''', (password_hash, email, solana_address, solana_private_key))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Users (password_hash, email, solana_address, solana_private_key)
+            VALUES (?, ?, ?, ?)
+        ''', (password_hash, email, solana_address, solana_private_key))
 
 def create_transaction(lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO Transactions (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Transactions (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule))
 
 def create_payment(transaction_id, due_date, amount_due):
-    conn = sqlite3.connect('loan_platform.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO Payments (transaction_id, due_date, amount_due)
-        VALUES (?, ?, ?)
-    ''', (transaction_id, due_date, amount_due))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO Payments (transaction_id, due_date, amount_due)
+            VALUES (?, ?, ?)
+        ''', (transaction_id, due_date, amount_due))
 
 if __name__ == "__main__":
     command = sys.argv[1]
@@ -321,7 +1049,23 @@ if __name__ == "__main__":
         solana_private_key = sys.argv[6] if len(sys.argv) > 6 else None
         add_user(password_hash, email, score, solana_address, solana_private_key)
         print(json.dumps({"message": "User added successfully"}))
+    elif command == "indexes":
+        with get_db_connection() as conn:
+            ensure_indexes(conn)
+        print(json.dumps({"version": INDEX_SET_VERSION, "full_scans": validate_indexes()}, indent=2))
+    elif command == "rebuild_stats":
+        with get_db_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rebuild_platform_stats(conn)
+        print(json.dumps(get_platform_stats(), indent=2))
+    elif command == "checkpoint":
+        mode = sys.argv[2].upper() if len(sys.argv) > 2 else 'TRUNCATE'
+        busy, wal_pages, checkpointed = checkpoint_wal(mode)
+        print(json.dumps({"busy": busy, "wal_pages": wal_pages, "checkpointed": checkpointed}))
     else:
         # setup database
-        os.remove('loan_platform.db')
+        close_pool()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(DB_PATH + suffix):
+                os.remove(DB_PATH + suffix)
         setup_database()
@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import os
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+
+from solana.rpc.types import TxOpts
+from solders.hash import Hash
+from solders.instruction import AccountMeta, Instruction
+from solders.keypair import Keypair
+from solders.message import Message
+from solders.pubkey import Pubkey
+from solders.system_program import CreateAccountParams, create_account
+from solders.sysvar import RENT
+from solders.transaction import Transaction
+from solders.transaction_status import TransactionConfirmationStatus
+
+from solana_client import get_blockhash_cache
+
+logger = logging.getLogger(__name__)
+
+BPF_LOADER_ID = Pubkey.from_string("BPFLoader2111111111111111111111111111111111")
+PACKET_DATA_SIZE = 1232  # max serialized transaction size
+MAX_STATUSES_PER_REQUEST = 256  # getSignatureStatuses limit
+
+MAX_IN_FLIGHT = int(os.getenv('DEPLOY_MAX_IN_FLIGHT', '32'))
+MAX_ATTEMPTS = int(os.getenv('DEPLOY_MAX_ATTEMPTS', '5'))
+POLL_INTERVAL = float(os.getenv('DEPLOY_POLL_INTERVAL', '0.5'))
+# Seconds a finished deployment's progress stays readable
+RESULT_TTL = float(os.getenv('DEPLOY_RESULT_TTL', '3600'))
+
+CONFIRMED = (TransactionConfirmationStatus.Confirmed, TransactionConfirmationStatus.Finalized)
+
+
+class DeployError(Exception):
+    pass
+
+
+def write_instruction(program, offset, chunk):
+    # LoaderInstruction::Write { offset: u32, bytes: Vec<u8> } (bincode)
+    data = struct.pack('<IIQ', 0, offset, len(chunk)) + chunk
+    return Instruction(BPF_LOADER_ID, data, [AccountMeta(program, is_signer=True, is_writable=True)])
+
+def finalize_instruction(program):
+    # LoaderInstruction::Finalize
+    return Instruction(BPF_LOADER_ID, struct.pack('<I', 1), [
+        AccountMeta(program, is_signer=True, is_writable=True),
+        AccountMeta(RENT, is_signer=False, is_writable=False),
+    ])
+
+def max_chunk_size(payer, program):
+    """Largest write payload that keeps a signed write transaction in one packet."""
+    message = Message([write_instruction(program.pubkey(), 0, b'')], payer.pubkey())
+    empty = Transaction([payer, program], message, Hash.default())
+    # The instruction data length prefix grows from one byte to two once
+    # the payload is 128 bytes or more
+    return PACKET_DATA_SIZE - len(bytes(empty)) - 1
+
+
+class DeployProgress:
+    """Per-chunk state of one deployment, readable while it runs."""
+
+    def __init__(self, deployment_id, program_id, total_chunks):
+        self.deployment_id = deployment_id
+        self.program_id = program_id
+        self.total_chunks = total_chunks
+        self.status = 'pending'
+        self.error = None
+        self.signatures = {}
+        self.attempts = {}
+        self.confirmed = set()
+        self.failed = set()
+        self.create_tx = None
+        self.finalize_tx = None
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'deploymentId': self.deployment_id,
+            'programId': self.program_id,
+            'status': self.status,
+            'error': self.error,
+            'totalChunks': self.total_chunks,
+            'confirmedChunks': len(self.confirmed),
+            'failedChunks': sorted(self.failed),
+            'retries': sum(max(0, n - 1) for n in self.attempts.values()),
+            'createTx': self.create_tx,
+            'finalizeTx': self.finalize_tx,
+            'writeTxs': [self.signatures.get(i) for i in range(self.total_chunks)],
+            'elapsed': round((self.finished_at or time.time()) - self.started_at, 3),
+        }
+
+
+class ProgramDeployer:
+    """Deploys a program binary through the BPF loader.
+
+    Write transactions are sent concurrently, up to max_in_flight unconfirmed
+    at a time, all signed with the shared cached blockhash.
+    Confirmation is polled with one getSignatureStatuses call per 256
+    in-flight signatures; chunks whose transaction failed or whose blockhash
+    expired unconfirmed are re-sent, and only those.
+    """
+
+    def __init__(self, client, payer, program_data, max_in_flight=None, max_attempts=None,
+                 poll_interval=None, program_keypair=None, deployment_id=None):
+        self.client = client
+        self.payer = payer
+        self.program_data = program_data
+        self.max_in_flight = max_in_flight or MAX_IN_FLIGHT
+        self.max_attempts = max_attempts or MAX_ATTEMPTS
+        self.poll_interval = POLL_INTERVAL if poll_interval is None else poll_interval
+        self.program = program_keypair or Keypair()
+        self.chunk_size = max_chunk_size(payer, self.program)
+        self.chunks = [program_data[i:i + self.chunk_size] for i in range(0, len(program_data), self.chunk_size)]
+        self.progress = DeployProgress(deployment_id or uuid.uuid4().hex, str(self.program.pubkey()), len(self.chunks))
+
+    async def _latest_blockhash(self):
+        """Return (blockhash, last_valid_block_height) from the shared cache."""
+        return await get_blockhash_cache().get(self.client)
+
+    def _expire_blockhash(self):
+        get_blockhash_cache().invalidate()
+
+    async def _send(self, instructions, signers, blockhash):
+        tx = Transaction(signers, Message(instructions, self.payer.pubkey()), blockhash)
+        resp = await self.client.send_raw_transaction(bytes(tx), opts=TxOpts(skip_preflight=True))
+        return resp.value
+
+    async def _confirm_one(self, instructions, signers):
+        """Send one transaction and wait for it, re-sending on a send error or expiry."""
+        last_error = None
+        for _ in range(self.max_attempts):
+            blockhash, last_valid = await self._latest_blockhash()
+            try:
+                signature = await self._send(instructions, signers, blockhash)
+            except Exception as e:
+                last_error = e
+                self._expire_blockhash()
+                continue
+            while True:
+                await asyncio.sleep(self.poll_interval)
+                status = (await self.client.get_signature_statuses([signature])).value[0]
+                if status is not None and status.err is not None:
+                    raise DeployError(f"Transaction {signature} failed: {status.err}")
+                if status is not None and status.confirmation_status in CONFIRMED:
+                    return str(signature)
+                if (await self.client.get_block_height()).value > last_valid:
+                    self._expire_blockhash()
+                    break
+        raise DeployError(f"Transaction not confirmed after {self.max_attempts} attempts"
+                          + (f": {last_error}" if last_error else ""))
+
+    async def _send_chunk(self, index, blockhash):
+        self.progress.attempts[index] = self.progress.attempts.get(index, 0) + 1
+        ix = write_instruction(self.program.pubkey(), index * self.chunk_size, self.chunks[index])
+        return await self._send([ix], [self.payer, self.program], blockhash)
+
+    def _retry(self, index, pending, reason):
+        if self.progress.attempts[index] >= self.max_attempts:
+            self.progress.failed.add(index)
+            logger.error(f"Chunk {index + 1}/{len(self.chunks)} failed after {self.progress.attempts[index]} attempts: {reason}")
+        else:
+            logger.warning(f"Chunk {index + 1}/{len(self.chunks)} will be re-sent: {reason}")
+            pending.append(index)
+
+    async def write_chunks(self):
+        pending = deque(range(len(self.chunks)))
+        in_flight = {}  # signature -> (chunk index, last valid block height)
+
+        while pending or in_flight:
+            # Top the window up; the sends themselves go out concurrently
+            batch = [pending.popleft() for _ in range(min(len(pending), self.max_in_flight - len(in_flight)))]
+            if batch:
+                blockhash, last_valid = await self._latest_blockhash()
+                results = await asyncio.gather(*(self._send_chunk(i, blockhash) for i in batch), return_exceptions=True)
+                for index, result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        self._expire_blockhash()  # most send failures are a stale blockhash
+                        self._retry(index, pending, str(result))
+                    else:
+                        self.progress.signatures[index] = str(result)
+                        in_flight[result] = (index, last_valid)
+
+            if not in_flight:
+                continue
+            await asyncio.sleep(self.poll_interval)
+
+            signatures = list(in_flight)
+            statuses = []
+            for i in range(0, len(signatures), MAX_STATUSES_PER_REQUEST):
+                resp = await self.client.get_signature_statuses(signatures[i:i + MAX_STATUSES_PER_REQUEST])
+                statuses.extend(resp.value)
+            height = None
+            for signature, status in zip(signatures, statuses):
+                index, last_valid = in_flight[signature]
+                if status is not None and status.err is not None:
+                    del in_flight[signature]
+                    self._retry(index, pending, f"transaction error {status.err}")
+                elif status is not None and status.confirmation_status in CONFIRMED:
+                    del in_flight[signature]
+                    self.progress.confirmed.add(index)
+                    logger.info(f"Chunk {index + 1}/{len(self.chunks)} confirmed "
+                                f"({len(self.progress.confirmed)}/{len(self.chunks)})")
+                else:
+                    if height is None:
+                        height = (await self.client.get_block_height()).value
+                    if height > last_valid:
+                        del in_flight[signature]
+                        self._expire_blockhash()
+                        self._retry(index, pending, "blockhash expired before confirmation")
+
+        if self.progress.failed:
+            raise DeployError(f"{len(self.progress.failed)} chunk(s) could not be written: {sorted(self.progress.failed)}")
+
+    async def run(self):
+        progress = self.progress
+        try:
+            progress.status = 'creating'
+            logger.info(f"Deploying {len(self.program_data)} bytes to {progress.program_id} "
+                        f"in {len(self.chunks)} chunks of up to {self.chunk_size} bytes")
+            rent = (await self.client.get_minimum_balance_for_rent_exemption(len(self.program_data))).value
+            create_ix = create_account(CreateAccountParams(
+                from_pubkey=self.payer.pubkey(),
+                to_pubkey=self.program.pubkey(),
+                lamports=rent,
+                space=len(self.program_data),
+                owner=BPF_LOADER_ID,
+            ))
+            progress.create_tx = await self._confirm_one([create_ix], [self.payer, self.program])
+
+            progress.status = 'writing'
+            await self.write_chunks()
+
+            progress.status = 'finalizing'
+            progress.finalize_tx = await self._confirm_one(
+                [finalize_instruction(self.program.pubkey())], [self.payer, self.program])
+            progress.status = 'deployed'
+            logger.info(f"Program {progress.program_id} deployed")
+        except Exception as e:
+            progress.status = 'failed'
+            progress.error = str(e)
+            logger.error(f"Deployment {progress.deployment_id} failed: {str(e)}")
+            raise
+        finally:
+            progress.finished_at = time.time()
+        return progress
+
+
+# Deployments started through the API, by id. Each runs as a task on the
+# shared background loop; its progress stays readable for RESULT_TTL seconds
+# after it finishes, then is dropped on the next start or lookup.
+_deployments = {}
+_deployments_lock = threading.Lock()
+
+def _evict_finished(now):
+    """Drop deployments that finished more than RESULT_TTL seconds ago. Caller holds the lock."""
+    expired = [deployment_id for deployment_id, (progress, _) in _deployments.items()
+               if progress.finished_at is not None and now - progress.finished_at > RESULT_TTL]
+    for deployment_id in expired:
+        del _deployments[deployment_id]
+
+def start_deployment(client, payer, program_data, **kwargs):
+    """Start a ProgramDeployer as a task on the running loop and return its progress."""
+    deployer = ProgramDeployer(client, payer, program_data, **kwargs)
+    task = asyncio.get_running_loop().create_task(deployer.run())
+    # The error is recorded on the progress object; don't log it twice
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    with _deployments_lock:
+        _evict_finished(time.time())
+        _deployments[deployer.progress.deployment_id] = (deployer.progress, task)
+    return deployer.progress
+
+def get_deployment(deployment_id):
+    with _deployments_lock:
+        _evict_finished(time.time())
+        entry = _deployments.get(deployment_id)
+    return entry[0] if entry else None
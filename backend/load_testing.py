@@ -1,120 +1,472 @@
-import random
-import sqlite3
-from datetime import datetime, timedelta
+import argparse
+import json
 import logging
-from db import get_db_connection
+import math
+import multiprocessing
+import random
+import threading
+import time
+from collections import defaultdict
+
+from db import add_posts_bulk, add_users_bulk, get_db_connection, setup_database
+from matching_engine import EPSILON, OrderBook
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Relative weights of the API operations a virtual user picks from
+DEFAULT_MIX = {
+    'create_post': 3,
+    'accept': 2,
+    'pay': 2,
+    'list': 5,
+    'balance': 1,
+}
+
 def generate_solana_address():
     # Simulated Solana address generation (44 characters)
     chars = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
     return ''.join(random.choice(chars) for _ in range(44))
 
-def insert_user():
-    email = f'user_{random.randint(1000, 9999)}@test.com'
-    password_hash = f'hash_{random.randint(1000, 9999)}'
-    solana_address = generate_solana_address()
-    solana_private_key = f'private_key_{random.randint(1000, 9999)}'
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO Users (email, password_hash, solana_address, solana_private_key)
-        VALUES (?, ?, ?, ?)''', (email, password_hash, solana_address, solana_private_key))
-    user_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return user_id, solana_address
-
-def create_loan_posting():
-    # Create a user first to get both ID and wallet
-    user_id, wallet_address = insert_user()
-    
-    loan_amount = round(random.uniform(0.1, 10.0), 2)
-    interest_rate = round(random.uniform(1, 15), 2)
-    
-    # Randomly decide if this is a lender or borrower post
-    is_lender = random.choice([True, False])
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO Posts (
-            lender_wallet,
-            borrower_wallet,
-            loan_amount,
-            interest_rate,
-            status
-        ) VALUES (?, ?, ?, ?, 'open')''', 
-        (wallet_address if is_lender else None,
-         None if is_lender else wallet_address,
-         loan_amount,
-         interest_rate))
-    
-    post_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    logger.info(f"Created {'lender' if is_lender else 'borrower'} post {post_id} with amount {loan_amount} SOL")
-    return post_id
-
-def fulfill_loan_posting():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Select an open post
-    cursor.execute('''
-        SELECT post_id, lender_wallet, borrower_wallet, loan_amount, interest_rate 
-        FROM Posts 
-        WHERE status = 'open' 
-        AND (lender_wallet IS NOT NULL OR borrower_wallet IS NOT NULL)
-        LIMIT 1''')
-    
-    post = cursor.fetchone()
-    
-    if post:
-        post_id, lender_wallet, borrower_wallet, loan_amount, interest_rate = post
-        
-        # If post has lender, create borrower. If post has borrower, create lender
-        _, new_wallet = insert_user()
-        
-        if lender_wallet:
-            borrower_wallet = new_wallet
+def seed_load_test_data(num_users=200):
+    """Create the users and payment schedule the generated traffic refers to."""
+    setup_database()
+    run_tag = random.randint(0, 10**9)
+    user_ids = add_users_bulk(
+        (f'hash_{i}', f'load_{run_tag}_{i}@test.com', 0, generate_solana_address(), f'private_key_{i}')
+        for i in range(num_users)
+    )
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO PaymentSchedules (frequency, duration_in_months) VALUES ('monthly', 12)")
+        schedule_id = cursor.lastrowid
+    return user_ids, schedule_id
+
+
+# Transports: the same operations run over real HTTP or Flask's test client
+
+class HttpTransport:
+    def __init__(self, base_url, timeout=30):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, method, path, payload=None):
+        response = self.session.request(method, self.base_url + path, json=payload, timeout=self.timeout)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body
+
+
+_local_app = None
+_local_app_lock = threading.Lock()
+
+def get_local_app():
+    """The Flask app for in-process runs, with its services started once."""
+    global _local_app
+    if _local_app is None:
+        with _local_app_lock:
+            if _local_app is None:
+                from app import app, start_services
+                start_services()
+                _local_app = app
+    return _local_app
+
+class TestClientTransport:
+    def __init__(self):
+        self.client = get_local_app().test_client()
+
+    def request(self, method, path, payload=None):
+        response = self.client.open(path, method=method, json=payload)
+        return response.status_code, response.get_json(silent=True)
+
+
+class VirtualUser:
+    """Runs a weighted mix of operations, remembering the posts it created
+    and the loans it accepted so later accept/pay calls have valid ids."""
+
+    def __init__(self, transport, user_ids, schedule_id, mix, rng):
+        self.transport = transport
+        self.user_ids = user_ids
+        self.schedule_id = schedule_id
+        self.ops = list(mix)
+        self.weights = [mix[op] for op in self.ops]
+        self.rng = rng
+        self.open_posts = []
+        self.transactions = []
+
+    def create_post(self):
+        lender_id, borrower_id = self.rng.sample(self.user_ids, 2)
+        status, body = self.transport.request('POST', '/api/transactions', {
+            'lender_id': lender_id,
+            'borrower_id': borrower_id,
+            'loan_amount': round(self.rng.uniform(0.1, 10.0), 2),
+            'interest_rate': round(self.rng.uniform(1, 15), 2),
+            'payment_schedule_id': self.schedule_id,
+        })
+        if status == 200 and body and body.get('success'):
+            self.open_posts.append(body['post_id'])
+        return status, body
+
+    def accept(self):
+        post_id = self.open_posts.pop(self.rng.randrange(len(self.open_posts)))
+        borrower_id = self.rng.choice(self.user_ids)
+        status, body = self.transport.request('POST', '/api/transaction/accept', {
+            'post_id': post_id,
+            'borrower_id': borrower_id,
+        })
+        if status == 200 and body and body.get('success'):
+            self.transactions.append((body['transaction_id'], borrower_id))
+        return status, body
+
+    def pay(self):
+        transaction_id, borrower_id = self.rng.choice(self.transactions)
+        return self.transport.request('POST', f'/api/loans/{transaction_id}/pay', {
+            'amount': round(self.rng.uniform(0.01, 1.0), 2),
+            'borrower_id': borrower_id,
+        })
+
+    def list(self):
+        return self.transport.request('GET', '/api/loans?limit=50')
+
+    def balance(self):
+        return self.transport.request('GET', '/api/wallet/balance')
+
+    def next_operation(self):
+        op = self.rng.choices(self.ops, self.weights)[0]
+        # Fall back to creating data when the chosen op has nothing to act on
+        if op == 'accept' and not self.open_posts:
+            op = 'create_post'
+        if op == 'pay' and not self.transactions:
+            op = 'accept' if self.open_posts else 'create_post'
+        return op
+
+    def execute(self, op):
+        """Run op and return an error key, or None on success."""
+        try:
+            status, body = getattr(self, op)()
+        except Exception as e:
+            return type(e).__name__
+        if status >= 400 or (isinstance(body, dict) and body.get('success') is False):
+            return str(status)
+        return None
+
+
+def _run_worker(config, user_ids, schedule_id, worker_index, samples):
+    rng = random.Random(config['seed'] * 100003 + worker_index)
+    if config['base_url']:
+        transport = HttpTransport(config['base_url'])
+    else:
+        transport = TestClientTransport()
+    user = VirtualUser(transport, user_ids, schedule_id, config['mix'], rng)
+
+    total_workers = config['threads'] * config['processes']
+    interval = total_workers / config['rate'] if config['rate'] else None
+    start = time.perf_counter()
+    deadline = start + config['duration']
+    # Stagger open-loop workers so their sends interleave
+    scheduled = start + (interval * worker_index / total_workers if interval else 0)
+    count = 0
+
+    while True:
+        if config['requests'] and count >= config['requests']:
+            break
+        if interval:
+            now = time.perf_counter()
+            if scheduled > now:
+                time.sleep(scheduled - now)
+            began = scheduled
+            scheduled += interval
         else:
-            lender_wallet = new_wallet
-            
-        # Update post with the new wallet and mark as funded
-        cursor.execute('''
-            UPDATE Posts 
-            SET lender_wallet = ?, 
-                borrower_wallet = ?,
-                status = 'funded' 
-            WHERE post_id = ?''', 
-            (lender_wallet, borrower_wallet, post_id))
-        
-        logger.info(f"Fulfilled post {post_id} between {lender_wallet} and {borrower_wallet}")
-        
-        conn.commit()
+            began = time.perf_counter()
+        if began >= deadline:
+            break
+        op = user.next_operation()
+        error = user.execute(op)
+        # Open-loop latency is measured from the scheduled send time, so a
+        # backed-up server shows up as latency rather than a lower send rate
+        samples.append((op, time.perf_counter() - began, error))
+        count += 1
+
+def _run_process(config, user_ids, schedule_id, process_index):
+    samples = []
+    threads = [
+        threading.Thread(
+            target=_run_worker,
+            args=(config, user_ids, schedule_id, process_index * config['threads'] + i, samples),
+        )
+        for i in range(config['threads'])
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    rank = max(0, min(len(sorted_values), math.ceil(pct / 100.0 * len(sorted_values))) - 1)
+    return sorted_values[rank]
+
+def build_report(samples, elapsed, config):
+    by_op = defaultdict(list)
+    errors_by_op = defaultdict(int)
+    errors = defaultdict(int)
+    for op, latency, error in samples:
+        by_op[op].append(latency)
+        if error is not None:
+            errors_by_op[op] += 1
+            errors[f'{op}: {error}'] += 1
+
+    operations = {}
+    for op, latencies in sorted(by_op.items()):
+        latencies.sort()
+        operations[op] = {
+            'count': len(latencies),
+            'errors': errors_by_op[op],
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(_percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(_percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(_percentile(latencies, 99) * 1000, 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+        }
+
+    return {
+        'config': dict(config),
+        'elapsed_s': round(elapsed, 3),
+        'total': {
+            'requests': len(samples),
+            'errors': sum(errors.values()),
+            'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0,
+        },
+        'operations': operations,
+        'errors': dict(sorted(errors.items())),
+    }
+
+def run_load_test(base_url=None, threads=4, processes=1, duration=10.0, requests=None,
+                  rate=None, mix=None, num_users=200, seed=0, output=None):
+    """Drive the API with concurrent virtual users and report latency per operation.
+
+    base_url targets a running server over HTTP; without it requests go through
+    Flask's test client in-process. rate (requests/s across all workers) turns
+    on open-loop pacing; without it every worker sends its next request as
+    soon as the previous one returns (closed loop). requests caps the number
+    of requests per worker; duration caps wall-clock time.
+    """
+    config = {
+        'base_url': base_url,
+        'threads': threads,
+        'processes': processes,
+        'duration': duration,
+        'requests': requests,
+        'rate': rate,
+        'mix': dict(mix or DEFAULT_MIX),
+        'num_users': num_users,
+        'seed': seed,
+    }
+    user_ids, schedule_id = seed_load_test_data(num_users)
+    logger.info(f"Starting load test: {threads} thread(s) x {processes} process(es), "
+                f"{'%s req/s' % rate if rate else 'closed loop'}, {duration}s")
+
+    started = time.perf_counter()
+    if processes > 1:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(_run_process, [(config, user_ids, schedule_id, i) for i in range(processes)])
+        samples = [sample for result in results for sample in result]
     else:
-        logger.info("No open posts found to fulfill")
-    
-    conn.close()
-
-def run_load_test(num_posts=10, num_fulfillments=5):
-    logger.info(f"Starting load test with {num_posts} posts and {num_fulfillments} fulfillments")
-    
-    # Create posts
-    for _ in range(num_posts):
-        create_loan_posting()
-    
-    # Fulfill some posts
-    for _ in range(num_fulfillments):
-        fulfill_loan_posting()
-    
-    logger.info("Load test completed")
+        samples = _run_process(config, user_ids, schedule_id, 0)
+    elapsed = time.perf_counter() - started
+
+    report = build_report(samples, elapsed, config)
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    logger.info(f"Load test completed: {report['total']['requests']} requests, "
+                f"{report['total']['errors']} errors, {report['total']['throughput_rps']} req/s")
+    for op, stats in report['operations'].items():
+        logger.info(f"  {op:12s} n={stats['count']:<6d} err={stats['errors']:<5d} "
+                    f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+    return report
+
+def check_shared_order_books(user_ids, rounds=50, seed=0):
+    """Match through two OrderBooks sharing one database, as two API processes do.
+
+    Each round (on its own payment schedule) book A rests a lend post, book B
+    partly fills it with a borrow post, and book A, whose copy of the lend
+    post is now stale, takes a larger borrow post that crosses it. Returns
+    how many of those borrows recorded the rest of the lend post, and how
+    many open lend/borrow pairs were left crossed (should be 0).
+    """
+    rng = random.Random(seed)
+    book_a, book_b = OrderBook(), OrderBook()
+    lender_id, borrower_b, borrower_a = user_ids[:3]
+    schedule_ids, stale_fills = [], 0
+    for _ in range(rounds):
+        with get_db_connection() as conn:
+            schedule_id = conn.execute(
+                "INSERT INTO PaymentSchedules (frequency, duration_in_months) VALUES ('monthly', 12)").lastrowid
+        schedule_ids.append(schedule_id)
+        amount, rate = round(rng.uniform(1.0, 10.0), 2), round(rng.uniform(1, 15), 2)
+        lend = book_a.submit(lender_id, 'lend', amount, rate, schedule_id)
+        book_b.submit(borrower_b, 'borrow', round(amount * rng.uniform(0.1, 0.9), 2), rate, schedule_id)
+        result = book_a.submit(borrower_a, 'borrow', amount, rate + 1, schedule_id)
+        stale_fills += any(fill['post_id'] == lend['post_id'] for fill in result['fills'])
+
+    with get_db_connection() as conn:
+        crossed = conn.execute(f'''
+            SELECT COUNT(*) FROM Posts l JOIN Posts b
+              ON b.payment_schedule_id = l.payment_schedule_id AND b.post_type = 'borrow'
+             AND b.status = 'open' AND b.interest_rate >= l.interest_rate AND b.user_id != l.user_id
+            WHERE l.payment_schedule_id IN ({','.join('?' * len(schedule_ids))})
+              AND l.post_type = 'lend' AND l.status = 'open'
+        ''', schedule_ids).fetchone()[0]
+    return {'rounds': rounds, 'stale_fills': stale_fills, 'crossed': crossed}
+
+def run_accept_stress(base_url=None, threads=16, hot_posts=4, rounds=50, num_users=50, seed=0, output=None):
+    """Hammer the same few open posts with concurrent accepts.
+
+    Each round creates hot_posts fresh lend posts and releases every thread at
+    once to accept all of them in its own random order, so each post sees
+    `threads` competing claims. Latency is reported per outcome ('won', or
+    'lost' for a 404 on a post someone else funded first; anything else is an
+    error), and the report's 'claims' section checks that every post ended up
+    with exactly one transaction. 'shared_books' is check_shared_order_books()
+    over the same number of rounds.
+    """
+    config = {
+        'base_url': base_url,
+        'threads': threads,
+        'hot_posts': hot_posts,
+        'rounds': rounds,
+        'num_users': num_users,
+        'seed': seed,
+    }
+    user_ids, schedule_id = seed_load_test_data(num_users)
+    lender_id, borrowers = user_ids[0], user_ids[1:]
+    rng = random.Random(seed)
+    barrier = threading.Barrier(threads + 1)
+    round_posts = []
+    samples = []
+
+    def worker(index):
+        transport = HttpTransport(base_url) if base_url else TestClientTransport()
+        worker_rng = random.Random(seed * 100003 + index)
+        borrower_id = borrowers[index % len(borrowers)]
+        for _ in range(rounds):
+            barrier.wait()
+            posts = list(round_posts)
+            worker_rng.shuffle(posts)
+            for post_id in posts:
+                began = time.perf_counter()
+                try:
+                    status, _ = transport.request('POST', '/api/transaction/accept', {
+                        'post_id': post_id,
+                        'borrower_id': borrower_id,
+                    })
+                    outcome, error = {200: ('won', None), 404: ('lost', None)}.get(status, ('accept', str(status)))
+                except Exception as e:
+                    outcome, error = 'accept', type(e).__name__
+                samples.append((outcome, time.perf_counter() - began, error))
+            barrier.wait()
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    logger.info(f"Starting accept stress test: {threads} thread(s) x {hot_posts} hot post(s) x {rounds} round(s)")
+
+    all_posts = []
+    elapsed = 0.0
+    for _ in range(rounds):
+        round_posts[:] = add_posts_bulk(
+            (lender_id, 'lend', round(rng.uniform(0.1, 10.0), 2), round(rng.uniform(1, 15), 2), schedule_id)
+            for _ in range(hot_posts)
+        )
+        all_posts.extend(round_posts)
+        started = time.perf_counter()
+        barrier.wait()  # release the workers
+        barrier.wait()  # every accept of this round has returned
+        elapsed += time.perf_counter() - started
+    for t in workers:
+        t.join()
+
+    with get_db_connection() as conn:
+        funded = dict(conn.execute(f'''
+            SELECT post_id, COUNT(*) FROM Transactions
+            WHERE post_id IN ({','.join('?' * len(all_posts))}) GROUP BY post_id
+        ''', all_posts).fetchall())
+    report = build_report(samples, elapsed, config)
+    report['shared_books'] = check_shared_order_books(user_ids, rounds, seed)
+    report['claims'] = {
+        'posts': len(all_posts),
+        'funded_once': sum(1 for post_id in all_posts if funded.get(post_id) == 1),
+        'funded_twice_or_more': sum(1 for post_id in all_posts if funded.get(post_id, 0) > 1),
+        'unfunded': sum(1 for post_id in all_posts if post_id not in funded),
+    }
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    logger.info(f"Accept stress test completed: {report['total']['requests']} accepts, "
+                f"{report['total']['errors']} errors, {report['total']['throughput_rps']} req/s; claims {report['claims']}; "
+                f"shared books {report['shared_books']}")
+    for op, stats in report['operations'].items():
+        logger.info(f"  {op:12s} n={stats['count']:<6d} err={stats['errors']:<5d} "
+                    f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+    return report
+
+def _parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        op, _, weight = part.partition('=')
+        if op not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown operation: {op}")
+        mix[op] = float(weight or 1)
+    return mix
 
 if __name__ == "__main__":
-    run_load_test()
+    parser = argparse.ArgumentParser(description="Load generator for the loan platform API")
+    parser.add_argument('--base-url', help="Server to target, e.g. http://127.0.0.1:5000 (default: in-process test client)")
+    parser.add_argument('--threads', type=int, default=4, help="Worker threads per process")
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run")
+    parser.add_argument('--requests', type=int, help="Stop each worker after this many requests")
+    parser.add_argument('--rate', type=float, help="Target total requests/s (open loop); omit for closed loop")
+    parser.add_argument('--mix', type=_parse_mix, help="Operation weights, e.g. create_post=3,accept=2,pay=2,list=5,balance=0")
+    parser.add_argument('--users', type=int, default=200, help="Users to seed")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--stress-accept', action='store_true',
+                        help="Instead of the mix, have every thread accept the same few hot posts")
+    parser.add_argument('--hot-posts', type=int, default=4, help="Posts contended per round (--stress-accept)")
+    parser.add_argument('--rounds', type=int, default=50, help="Rounds of fresh hot posts (--stress-accept)")
+    args = parser.parse_args()
+
+    if args.stress_accept:
+        run_accept_stress(
+            base_url=args.base_url,
+            threads=args.threads,
+            hot_posts=args.hot_posts,
+            rounds=args.rounds,
+            num_users=args.users,
+            seed=args.seed,
+            output=args.output,
+        )
+    else:
+        run_load_test(
+            base_url=args.base_url,
+            threads=args.threads,
+            processes=args.processes,
+            duration=args.duration,
+            requests=args.requests,
+            rate=args.rate,
+            mix=args.mix,
+            num_users=args.users,
+            seed=args.seed,
+            output=args.output,
+        )
@@ -0,0 +1,279 @@
+import heapq
+import logging
+import os
+import threading
+
+from amortization import generate_payment_schedules
+from db import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Amounts are REAL; anything below this is treated as fully filled
+EPSILON = 1e-9
+
+
+class StaleOrder(Exception):
+    """A resting post changed in the database behind the book's back."""
+
+    def __init__(self, post_id):
+        super().__init__(f"Post {post_id} is no longer open")
+        self.post_id = post_id
+
+
+class Order:
+    __slots__ = ('post_id', 'user_id', 'side', 'rate', 'remaining', 'schedule_id')
+
+    def __init__(self, post_id, user_id, side, rate, remaining, schedule_id):
+        self.post_id = post_id
+        self.user_id = user_id
+        self.side = side
+        self.rate = rate
+        self.remaining = remaining
+        self.schedule_id = schedule_id
+
+    def heap_entry(self):
+        # Best rate first (lowest for lenders, highest for borrowers), then
+        # oldest post: price-time priority
+        key = self.rate if self.side == 'lend' else -self.rate
+        return (key, self.post_id)
+
+
+class OrderBook:
+    """Open borrow and lend Posts, matched by price-time priority.
+
+    Orders rest in two heaps per payment schedule, lend posts by lowest
+    interest rate and borrow posts by highest, oldest first within a rate.
+    A new post crosses the opposite side while the rates overlap (lend rate
+    <= borrow rate) and fills at the resting post's rate, partially if the
+    amounts differ. The new post, every fill's Transactions row and payment
+    schedule and the resting posts' fills are written in one SQLite
+    transaction. A resting post that another writer filled or closed behind
+    the book's back is re-read, put back with its real remaining amount (or
+    dropped if it is no longer open), and the match is retried.
+
+    The book is rebuilt from the open posts on first use in each process
+    and picks up posts inserted by other writers (by post_id) before every
+    match. Filled amounts live in Posts.filled_amount; a post becomes
+    'funded' once nothing is left.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._orders = {}  # post_id -> Order
+        self._books = {}  # schedule_id -> {'lend': heap, 'borrow': heap}
+        self._last_post_id = 0
+        self._loaded = False
+
+    # Book maintenance
+
+    def _heap(self, schedule_id, side):
+        book = self._books.get(schedule_id)
+        if book is None:
+            book = self._books[schedule_id] = {'lend': [], 'borrow': []}
+        return book[side]
+
+    def _rest(self, order):
+        self._orders[order.post_id] = order
+        heapq.heappush(self._heap(order.schedule_id, order.side), order.heap_entry())
+
+    def _load(self, conn, after_post_id=None):
+        columns = "post_id, user_id, post_type, interest_rate, loan_amount - COALESCE(filled_amount, 0), payment_schedule_id"
+        if after_post_id is None:
+            # Full load, served by the partial open-posts index
+            rows = conn.execute(f"SELECT {columns} FROM Posts WHERE status = 'open'").fetchall()
+        else:
+            # Posts inserted since, a rowid range
+            rows = conn.execute(f"SELECT {columns} FROM Posts WHERE post_id > ? AND status = 'open'",
+                                (after_post_id,)).fetchall()
+        for post_id, user_id, side, rate, remaining, schedule_id in rows:
+            if remaining > EPSILON and post_id not in self._orders:
+                self._rest(Order(post_id, user_id, side, rate, remaining, schedule_id))
+        last = conn.execute("SELECT MAX(post_id) FROM Posts").fetchone()[0]
+        self._last_post_id = max(self._last_post_id, last or 0)
+
+    def rebuild(self):
+        """Reload the book from the open posts."""
+        with self._lock:
+            self._orders.clear()
+            self._books.clear()
+            self._last_post_id = 0
+            with get_db_connection() as conn:
+                self._load(conn)
+            self._loaded = True
+            logger.info(f"Order book rebuilt with {len(self._orders)} open posts")
+
+    def _sync(self, conn):
+        if not self._loaded:
+            self._load(conn)
+            self._loaded = True
+        else:
+            self._load(conn, self._last_post_id)
+
+    def remove(self, post_id):
+        """Drop a post that was taken or closed outside the engine."""
+        with self._lock:
+            self._orders.pop(post_id, None)
+
+    # Matching
+
+    def _take_matches(self, side, rate, amount, schedule_id, user_id):
+        """Pop the resting orders a new order would fill against.
+
+        Returns (fills, skipped): fills is [(order, amount)] in priority
+        order, skipped holds the popped entries that must go back untouched.
+        """
+        opposite = self._heap(schedule_id, 'borrow' if side == 'lend' else 'lend')
+        fills, skipped = [], []
+        while amount > EPSILON and opposite:
+            _, post_id = opposite[0]
+            order = self._orders.get(post_id)
+            if order is None:
+                heapq.heappop(opposite)  # removed since it was pushed
+                continue
+            crosses = order.rate <= rate if side == 'borrow' else order.rate >= rate
+            if not crosses:
+                break
+            heapq.heappop(opposite)
+            if order.user_id == user_id:
+                skipped.append(order)  # no lending to yourself
+                continue
+            fill = min(amount, order.remaining)
+            fills.append((order, fill))
+            amount -= fill
+        return fills, skipped
+
+    def _persist(self, conn, user_id, side, rate, amount, schedule_id, fills):
+        """Write the new post and its fills; return (post_id, transaction ids)."""
+        filled = sum(fill for _, fill in fills)
+        cursor = conn.execute('''
+            INSERT INTO Posts (user_id, post_type, loan_amount, interest_rate, payment_schedule_id, filled_amount, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, side, amount, rate, schedule_id, filled,
+              'funded' if amount - filled <= EPSILON else 'open'))
+        post_id = cursor.lastrowid
+
+        transactions = []
+        for order, fill in fills:
+            cursor = conn.execute('''
+                UPDATE Posts
+                SET filled_amount = COALESCE(filled_amount, 0) + :fill,
+                    status = CASE WHEN loan_amount - COALESCE(filled_amount, 0) - :fill <= :eps THEN 'funded' ELSE status END
+                WHERE post_id = :post_id AND status = 'open'
+                  AND loan_amount - COALESCE(filled_amount, 0) >= :fill - :eps
+            ''', {'fill': fill, 'eps': EPSILON, 'post_id': order.post_id})
+            if cursor.rowcount == 0:
+                raise StaleOrder(order.post_id)
+            lend_post, borrow_post = (post_id, order.post_id) if side == 'lend' else (order.post_id, post_id)
+            lender_id, borrower_id = (user_id, order.user_id) if side == 'lend' else (order.user_id, user_id)
+            cursor = conn.execute('''
+                INSERT INTO Transactions (lender_id, borrower_id, post_id, borrow_post_id, loan_amount, interest_rate, payment_schedule_id, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 'active')
+            ''', (lender_id, borrower_id, lend_post, borrow_post, fill, order.rate, schedule_id))
+            transactions.append(cursor.lastrowid)
+        if transactions:
+            generate_payment_schedules(transactions, conn=conn)
+        return post_id, transactions
+
+    def submit(self, user_id, side, loan_amount, interest_rate, payment_schedule_id):
+        """Create a post and match it against the book.
+
+        Returns {'post_id', 'fills': [{'transaction_id', 'post_id', 'amount',
+        'interest_rate'}], 'remaining'}; the post rests in the book if
+        anything is left.
+        """
+        if side not in ('borrow', 'lend'):
+            raise ValueError(f"Invalid post_type: {side}")
+        amount, rate = float(loan_amount), float(interest_rate)
+        if amount <= 0:
+            raise ValueError("loan_amount must be positive")
+
+        with self._lock:
+            while True:
+                with get_db_connection() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    self._sync(conn)
+                    fills, skipped = self._take_matches(side, rate, amount, payment_schedule_id, user_id)
+                    try:
+                        post_id, transactions = self._persist(
+                            conn, user_id, side, rate, amount, payment_schedule_id, fills)
+                    except StaleOrder as e:
+                        # Read what is really left before the rollback ends the transaction
+                        row = conn.execute('''
+                            SELECT loan_amount - COALESCE(filled_amount, 0) FROM Posts
+                            WHERE post_id = ? AND status = 'open'
+                        ''', (e.post_id,)).fetchone()
+                        conn.rollback()
+                        for order, _ in fills:
+                            if order.post_id != e.post_id:
+                                self._rest(order)
+                            elif row is not None and row[0] > EPSILON:
+                                order.remaining = row[0]
+                                self._rest(order)
+                            else:
+                                self._orders.pop(e.post_id, None)
+                        for order in skipped:
+                            self._rest(order)
+                        logger.info(f"Post {e.post_id} changed behind the order book "
+                                    f"({'%s left' % row[0] if row else 'no longer open'}), re-matching")
+                        continue
+                    except Exception:
+                        for order, _ in fills:
+                            self._rest(order)
+                        for order in skipped:
+                            self._rest(order)
+                        raise
+                break
+
+            self._last_post_id = max(self._last_post_id, post_id)
+            for order in skipped:
+                self._rest(order)
+            for order, fill in fills:
+                order.remaining -= fill
+                if order.remaining > EPSILON:
+                    self._rest(order)
+                else:
+                    self._orders.pop(order.post_id, None)
+            remaining = amount - sum(fill for _, fill in fills)
+            if remaining > EPSILON:
+                self._rest(Order(post_id, user_id, side, rate, remaining, payment_schedule_id))
+
+        return {
+            'post_id': post_id,
+            'fills': [
+                {'transaction_id': tx_id, 'post_id': order.post_id, 'amount': fill, 'interest_rate': order.rate}
+                for tx_id, (order, fill) in zip(transactions, fills)
+            ],
+            'remaining': max(remaining, 0.0),
+        }
+
+    def depth(self, payment_schedule_id, levels=10):
+        """Aggregated open amount per rate, best levels first, for each side."""
+        with self._lock:
+            if not self._loaded:
+                with get_db_connection() as conn:
+                    self._sync(conn)
+                    self._loaded = True
+            result = {}
+            for side in ('lend', 'borrow'):
+                totals = {}
+                for order in self._orders.values():
+                    if order.schedule_id == payment_schedule_id and order.side == side:
+                        totals[order.rate] = totals.get(order.rate, 0.0) + order.remaining
+                best = sorted(totals, reverse=(side == 'borrow'))[:levels]
+                result[side] = [{'interest_rate': rate, 'amount': totals[rate]} for rate in best]
+            return result
+
+
+_order_book = None
+_order_book_pid = None
+_order_book_lock = threading.Lock()
+
+def get_order_book():
+    global _order_book, _order_book_pid
+    # The book mirrors this process's view of Posts; a forked worker builds its own
+    if _order_book is None or _order_book_pid != os.getpid():
+        with _order_book_lock:
+            if _order_book is None or _order_book_pid != os.getpid():
+                _order_book = OrderBook()
+                _order_book_pid = os.getpid()
+    return _order_book
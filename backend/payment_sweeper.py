@@ -0,0 +1,132 @@
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from db import get_db_connection, run_write_transaction
+
+logger = logging.getLogger(__name__)
+
+SWEEP_CHUNK_SIZE = int(os.getenv('SWEEP_CHUNK_SIZE', '500'))
+# Pause between chunks so API writers queued on the write lock get their turn
+SWEEP_PAUSE = float(os.getenv('SWEEP_PAUSE', '0.005'))
+# Days an installment may stay late and unpaid before its loan is defaulted
+DEFAULT_GRACE_DAYS = int(os.getenv('DEFAULT_GRACE_DAYS', '90'))
+
+# Every query here walks idx_payments_status_due. Marked rows leave the
+# ('due', < as_of) range, so each chunk starts at the front of what is left.
+MARK_LATE_SQL = '''
+    UPDATE Payments SET payment_status = 'late'
+    WHERE payment_id IN (
+        SELECT payment_id FROM Payments WHERE payment_status = 'due' AND due_date < ? LIMIT ?
+    )
+'''
+# Loans still active with an installment late since before the cutoff, read
+# outside the write lock one due date at a time, in payment_id keyset order
+# (the index's implicit rowid suffix, so each page picks up where the last
+# one stopped even when thousands of installments share a due date)
+NEXT_LATE_DATE_SQL = '''
+    SELECT MIN(due_date) FROM Payments WHERE payment_status = 'late' AND due_date > ? AND due_date < ?
+'''
+PAST_GRACE_SQL = '''
+    SELECT p.payment_id, p.transaction_id
+    FROM Payments p JOIN Transactions t ON t.transaction_id = p.transaction_id
+    WHERE p.payment_status = 'late' AND p.due_date = ? AND p.payment_id > ?
+      AND p.amount_paid < p.amount_due AND t.status = 'active'
+    ORDER BY p.payment_id LIMIT ?
+'''
+
+
+def _write_chunk(stats, sql, params):
+    """Run one UPDATE in its own short write transaction; return its rowcount."""
+    def work(conn):
+        started = time.perf_counter()
+        changed = conn.execute(sql, params).rowcount
+        stats['max_chunk_ms'] = max(stats['max_chunk_ms'], (time.perf_counter() - started) * 1000)
+        return changed
+    stats['chunks'] += 1
+    return run_write_transaction(work)
+
+def mark_late_payments(as_of, stats, chunk_size=SWEEP_CHUNK_SIZE, pause=SWEEP_PAUSE):
+    while True:
+        changed = _write_chunk(stats, MARK_LATE_SQL, (as_of, chunk_size))
+        stats['payments_marked_late'] += changed
+        if changed < chunk_size:
+            break
+        time.sleep(pause)
+
+def default_transactions(cutoff, stats, chunk_size=SWEEP_CHUNK_SIZE, pause=SWEEP_PAUSE):
+    due_date = ''
+    while True:
+        with get_db_connection() as conn:
+            due_date = conn.execute(NEXT_LATE_DATE_SQL, (due_date, cutoff)).fetchone()[0]
+        if due_date is None:
+            break
+        after = 0
+        while True:
+            with get_db_connection() as conn:
+                rows = conn.execute(PAST_GRACE_SQL, (due_date, after, chunk_size)).fetchall()
+            if not rows:
+                break
+            after = rows[-1][0]
+            ids = sorted({row[1] for row in rows})
+            stats['transactions_defaulted'] += _write_chunk(stats, f'''
+                UPDATE Transactions SET status = 'defaulted'
+                WHERE status = 'active' AND transaction_id IN ({','.join('?' * len(ids))})
+            ''', ids)
+            if len(rows) < chunk_size:
+                break
+            time.sleep(pause)
+
+def sweep(as_of=None, grace_days=DEFAULT_GRACE_DAYS, chunk_size=SWEEP_CHUNK_SIZE, pause=SWEEP_PAUSE):
+    """Mark overdue installments late and default loans left late too long.
+
+    Installments still 'due' with a due date before as_of (default: today,
+    UTC) become 'late'. With grace_days set, active loans with an unpaid
+    installment late since more than grace_days before as_of become
+    'defaulted'. Every UPDATE touches at most chunk_size rows in its own
+    write transaction, with a short pause between chunks, so the sweeper can
+    run next to live traffic. The run is recorded in SweepRuns and returned.
+    """
+    started = time.perf_counter()
+    as_of = as_of or datetime.now(timezone.utc).date().isoformat()
+    stats = {'payments_marked_late': 0, 'transactions_defaulted': 0, 'chunks': 0, 'max_chunk_ms': 0.0}
+
+    mark_late_payments(as_of, stats, chunk_size, pause)
+    if grace_days is not None:
+        cutoff = (date.fromisoformat(as_of) - timedelta(days=grace_days)).isoformat()
+        default_transactions(cutoff, stats, chunk_size, pause)
+
+    result = {
+        'as_of': as_of,
+        'grace_days': grace_days,
+        **stats,
+        'max_chunk_ms': round(stats['max_chunk_ms'], 3),
+        'duration_s': round(time.perf_counter() - started, 3),
+    }
+    result['run_id'] = run_write_transaction(lambda conn: conn.execute('''
+        INSERT INTO SweepRuns (as_of, grace_days, payments_marked_late, transactions_defaulted, chunks, max_chunk_ms, duration_s)
+        VALUES (:as_of, :grace_days, :payments_marked_late, :transactions_defaulted, :chunks, :max_chunk_ms, :duration_s)
+    ''', result).lastrowid)
+    logger.info(f"Late-payment sweep: {result}")
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Mark overdue payments late and default long-late loans")
+    parser.add_argument('--as-of', help="Sweep installments due before this date (YYYY-MM-DD, default today UTC)")
+    parser.add_argument('--grace-days', type=int, default=DEFAULT_GRACE_DAYS,
+                        help="Days late before a loan is defaulted")
+    parser.add_argument('--no-defaults', action='store_true', help="Only mark payments late")
+    parser.add_argument('--chunk-size', type=int, default=SWEEP_CHUNK_SIZE, help="Rows per write transaction")
+    parser.add_argument('--pause', type=float, default=SWEEP_PAUSE, help="Seconds between chunks")
+    args = parser.parse_args()
+    print(json.dumps(sweep(
+        as_of=args.as_of,
+        grace_days=None if args.no_defaults else args.grace_days,
+        chunk_size=args.chunk_size,
+        pause=args.pause,
+    ), indent=2))
@@ -1,6 +1,6 @@
 import sqlite3
-from datetime import datetime, timedelta
 import random
+from amortization import generate_payment_schedules
 
 # Connect to the SQLite database
 conn = sqlite3.connect('loan_platform.db')
@@ -75,21 +75,11 @@ for _ in range(30):  # 30 sample transactions
         VALUES (?, ?, ?, ?, ?, ?, ?, 'active')
     """, (lender_id, borrower_id, post_id, loan_amount, interest_rate, payment_schedule_id, blockchain_tx_id))
 
-# Insert sample payments
+# Insert the amortized payment schedule for every transaction
 cursor.execute("SELECT transaction_id FROM Transactions")
 transaction_ids = [row[0] for row in cursor.fetchall()]
 
-today = datetime.now()
-
-for txn_id in transaction_ids:
-    for i in range(6):  # 6 payments per transaction
-        due_date = today + timedelta(days=30 * (i + 1))
-        amount_due = random.randint(500, 2000)
-
-        cursor.execute("""
-            INSERT INTO Payments (transaction_id, due_date, amount_due, amount_paid, payment_status)
-            VALUES (?, ?, ?, ?, 'due')
-        """, (txn_id, due_date.date(), amount_due, 0))
+generate_payment_schedules(transaction_ids, conn=conn)
 
 # Commit changes and close the connection
 conn.commit()
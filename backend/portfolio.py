@@ -0,0 +1,351 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timezone
+from functools import partial
+
+import numpy as np
+
+import db
+from db import PAGE_SIZE_DEFAULT, configure_pool, fetch_array, get_db_connection, group_totals, match_ids
+
+logger = logging.getLogger(__name__)
+
+PORTFOLIO_WORKERS = int(os.getenv('PORTFOLIO_WORKERS', '2'))
+# Lenders with at least this many loans, and the platform-wide views, are
+# computed in the worker pool instead of on the request thread
+PORTFOLIO_POOL_THRESHOLD = int(os.getenv('PORTFOLIO_POOL_THRESHOLD', '20000'))
+PORTFOLIO_TIMEOUT = float(os.getenv('PORTFOLIO_TIMEOUT', '120'))
+# Seconds a pooled result is reused before it is computed again
+PORTFOLIO_CACHE_TTL = float(os.getenv('PORTFOLIO_CACHE_TTL', '60'))
+
+IRR_MIN, IRR_MAX = -0.9999, 100.0  # annual rates searched
+IRR_TOLERANCE = 1e-10
+IRR_NEWTON_STEPS = 50
+IRR_BISECTION_STEPS = 100
+
+# Status codes as LOANS_QUERY and INSTALLMENTS_QUERY return them
+PENDING, ACTIVE, COMPLETED, DEFAULTED = 0, 1, 2, 3
+LOAN_STATUSES = ('pending', 'active', 'completed', 'defaulted')
+DUE, PAID, LATE = 0, 1, 2
+
+UNIX_EPOCH_JD = 2440587.5  # julianday('1970-01-01')
+
+LOANS_QUERY = '''
+    SELECT transaction_id, lender_id, loan_amount, COALESCE(julianday(created_at), julianday('now')),
+           CASE status WHEN 'active' THEN 1 WHEN 'completed' THEN 2 WHEN 'defaulted' THEN 3 ELSE 0 END
+    FROM Transactions {where}
+    ORDER BY transaction_id
+'''
+INSTALLMENTS_QUERY = '''
+    SELECT transaction_id, julianday(due_date), amount_due, COALESCE(amount_paid, 0),
+           COALESCE(principal_due, 0), COALESCE(interest_due, 0),
+           CASE payment_status WHEN 'paid' THEN 1 WHEN 'late' THEN 2 ELSE 0 END
+    FROM Payments {where}
+'''
+
+
+def julian_day(as_of):
+    """julianday() of a YYYY-MM-DD date at midnight UTC."""
+    return date.fromisoformat(as_of).toordinal() + 1721424.5
+
+def load_portfolio(lender_id=None):
+    """Loans and installments of one lender (or all lenders) as float64 column arrays.
+
+    Both come from one read snapshot. A lender's rows are found through
+    idx_transactions_lender and idx_payments_transaction_status, so the cost
+    follows the size of the portfolio rather than of the tables.
+    """
+    with get_db_connection() as conn:
+        conn.execute("BEGIN")
+        if lender_id is None:
+            loans = fetch_array(conn, LOANS_QUERY.format(where=''), columns=5)
+            installments = fetch_array(conn, INSTALLMENTS_QUERY.format(where=''), columns=7)
+        else:
+            loans = fetch_array(conn, LOANS_QUERY.format(where="WHERE lender_id = ?"), (lender_id,), columns=5)
+            installments = fetch_array(conn, INSTALLMENTS_QUERY.format(
+                where="WHERE transaction_id IN (SELECT transaction_id FROM Transactions WHERE lender_id = ?)"
+            ), (lender_id,), columns=7)
+    return loans, installments
+
+def xirr(amounts, days, groups, size):
+    """Annual internal rate of return of each group's dated cash flows.
+
+    Solves sum(amount / (1 + r) ** (years since the group's first flow)) = 0
+    for every group at once: flows on the same day are netted first, then
+    Newton steps run on all groups together (one np.bincount per sum), and
+    groups Newton leaves unconverged fall back to bisection. Groups whose
+    flows never change sign have no rate and get NaN.
+    """
+    rates = np.full(size, np.nan)
+    if not len(amounts):
+        return rates
+    day = np.floor(days).astype(np.int64)
+    span = int(day.max() - day.min()) + 1
+    keys, inverse = np.unique(groups.astype(np.int64) * span + (day - day.min()), return_inverse=True)
+    amounts = np.bincount(inverse, amounts)
+    groups, day = keys // span, keys % span
+    first = np.full(size, span)
+    np.minimum.at(first, groups, day)
+    years = (day - first[groups]) / 365.0
+
+    def npv(rate, years=years, amounts=amounts, groups=groups):
+        return np.bincount(groups, amounts * (1.0 + rate[groups]) ** -years, minlength=size)
+
+    solvable = ((np.bincount(groups, amounts > 0, minlength=size) > 0)
+                & (np.bincount(groups, amounts < 0, minlength=size) > 0))
+    scale = np.bincount(groups, np.abs(amounts), minlength=size)
+    rate = np.full(size, 0.1)
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        for _ in range(IRR_NEWTON_STEPS):
+            discounted = amounts * (1.0 + rate[groups]) ** -years
+            value = np.bincount(groups, discounted, minlength=size)
+            slope = np.bincount(groups, -years * discounted / (1.0 + rate[groups]), minlength=size)
+            step = np.divide(value, slope, out=np.zeros(size), where=slope != 0)
+            rate = np.clip(rate - step, IRR_MIN, IRR_MAX)
+            if not np.any(np.abs(step[solvable]) > IRR_TOLERANCE):
+                break
+        converged = solvable & (np.abs(npv(rate)) <= 1e-9 * scale)
+        rates[converged] = rate[converged]
+
+        retry = solvable & ~converged
+        if retry.any():
+            flows = retry[groups]
+            lo, hi = np.full(size, IRR_MIN), np.full(size, IRR_MAX)
+            low_value = npv(lo, years[flows], amounts[flows], groups[flows])
+            for _ in range(IRR_BISECTION_STEPS):
+                mid = (lo + hi) / 2
+                same_side = np.sign(npv(mid, years[flows], amounts[flows], groups[flows])) == np.sign(low_value)
+                lo, hi = np.where(same_side, mid, lo), np.where(same_side, hi, mid)
+            bracketed = retry & (np.sign(npv(hi, years[flows], amounts[flows], groups[flows])) != np.sign(low_value))
+            rates[bracketed] = ((lo + hi) / 2)[bracketed]
+    return rates
+
+def analyze(loans, installments, as_of, loan_groups, size):
+    """Per-group portfolio totals, yields and upcoming cash flows.
+
+    loan_groups assigns each loan (row of loans) to one of size groups, e.g.
+    its lender. Every total is an array indexed by group. as_of is a julian
+    day: installments due before it and unpaid are overdue, later ones are
+    upcoming. The expected yield is the IRR of the loans' contractual
+    schedules; the realized yield is the IRR of what was actually received
+    plus the remaining schedule of loans still performing, with overdue
+    amounts and defaulted loans counted as lost.
+    """
+    loan_ids, _, amount, start, status = loans.T
+    transaction, due, amount_due, paid, principal, interest, state = installments.T
+    position, known = match_ids(loan_ids, transaction)
+    loan = position[known]
+    due, amount_due, paid, principal, interest, state = (
+        column[known] for column in (due, amount_due, paid, principal, interest, state))
+    group, loan_status = loan_groups[loan], status[loan]
+    total = partial(group_totals, size=size)
+
+    unpaid = state != PAID
+    owed = np.where(unpaid, np.maximum(amount_due - paid, 0.0), 0.0)
+    overdue = unpaid & (due < as_of)
+    performing = (loan_status == PENDING) | (loan_status == ACTIVE)
+    upcoming = unpaid & ~overdue & performing
+
+    repaid = np.bincount(loan, np.where(unpaid, 0.0, principal), minlength=len(loans))
+    outstanding = np.where(status == COMPLETED, 0.0, np.maximum(amount - repaid, 0.0))
+    late_loans = np.bincount(loan, overdue | (state == LATE), minlength=len(loans)) > 0
+    at_risk = (status == DEFAULTED) | late_loans
+
+    # Interest earns from the previous due date (the loan's start for the
+    # first installment), so the next one carries a pro-rata share
+    order = np.lexsort((due, loan))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = loan[order][1:] != loan[order][:-1]
+    previous = np.empty_like(due)
+    previous[order[1:]] = due[order][:-1]
+    previous[order[first]] = start[loan[order[first]]]
+    period = due - previous
+    earned = np.clip(np.divide(as_of - previous, period, out=np.ones_like(period), where=period > 0), 0.0, 1.0)
+    accrued = np.where(unpaid & (loan_status != DEFAULTED), interest * earned, 0.0)
+
+    # Only loans with a schedule have a yield
+    scheduled = np.bincount(loan, minlength=len(loans)) > 0
+    expected_yield = xirr(np.r_[-amount[scheduled], amount_due],
+                          np.r_[start[scheduled], due],
+                          np.r_[loan_groups[scheduled], group], size)
+    received = paid + np.where(upcoming, owed, 0.0)
+    realized_yield = xirr(np.r_[-amount[scheduled], received],
+                          np.r_[start[scheduled], due],
+                          np.r_[loan_groups[scheduled], group], size)
+
+    return {
+        'loans': total(loan_groups),
+        'loans_by_status': {name: total(loan_groups, status == code) for code, name in enumerate(LOAN_STATUSES)},
+        'principal_lent': total(loan_groups, amount),
+        'principal_repaid': total(loan_groups, np.minimum(repaid, amount)),
+        'principal_outstanding': total(loan_groups, outstanding),
+        'principal_at_risk': total(loan_groups, np.where(at_risk, outstanding, 0.0)),
+        'interest_scheduled': total(group, interest),
+        'interest_received': total(group, np.where(unpaid, 0.0, interest)),
+        'interest_accrued': total(group, accrued),
+        'amount_received': total(group, paid),
+        'amount_overdue': total(group, np.where(overdue, owed, 0.0)),
+        'amount_upcoming': total(group, np.where(upcoming, owed, 0.0)),
+        'expected_yield': expected_yield,
+        'realized_yield': realized_yield,
+        'upcoming': (group[upcoming], due[upcoming], owed[upcoming]),
+    }
+
+def _number(value, digits=9):
+    return None if np.isnan(value) else round(float(value), digits)
+
+def _row(totals, i):
+    row = {
+        name: int(values[i]) if name == 'loans' else _number(values[i], 6 if name.endswith('yield') else 9)
+        for name, values in totals.items() if name not in ('loans_by_status', 'upcoming')
+    }
+    row['loans_by_status'] = {name: int(values[i]) for name, values in totals['loans_by_status'].items()}
+    return row
+
+def _monthly(due, owed):
+    """Upcoming amounts per calendar month of their due date."""
+    months = (np.floor(due - UNIX_EPOCH_JD).astype('datetime64[D]')).astype('datetime64[M]')
+    months, inverse = np.unique(months, return_inverse=True)
+    amounts = np.bincount(inverse, owed, minlength=len(months))
+    return [{'month': str(month), 'amount': round(float(value), 9)} for month, value in zip(months, amounts)]
+
+def _today():
+    return datetime.now(timezone.utc).date().isoformat()
+
+def portfolio_summary(lender_id=None, as_of=None):
+    """Totals, yields and monthly upcoming cash flows of one lender, or the platform.
+
+    as_of (YYYY-MM-DD, default today UTC) splits overdue from upcoming
+    installments. Computed on the calling thread; see run_portfolio_summary().
+    """
+    started = time.perf_counter()
+    as_of = as_of or _today()
+    loans, installments = load_portfolio(lender_id)
+    read_done = time.perf_counter()
+    totals = analyze(loans, installments, julian_day(as_of), np.zeros(len(loans), dtype=np.int64), 1)
+    _, due, owed = totals['upcoming']
+    return {
+        'lender_id': lender_id,
+        'as_of': as_of,
+        **_row(totals, 0),
+        'expected_cash_flows': _monthly(due, owed),
+        'read_s': round(read_done - started, 3),
+        'elapsed_s': round(time.perf_counter() - started, 3),
+    }
+
+def lender_summaries(as_of=None, limit=PAGE_SIZE_DEFAULT, offset=0):
+    """Per-lender totals and yields, largest outstanding principal first.
+
+    One pass over all loans and installments: lenders become dense group
+    numbers and every total, including both IRRs, is solved for all lenders
+    together.
+    """
+    started = time.perf_counter()
+    as_of = as_of or _today()
+    loans, installments = load_portfolio()
+    lenders, loan_groups = np.unique(loans[:, 1].astype(np.int64), return_inverse=True)
+    totals = analyze(loans, installments, julian_day(as_of), loan_groups, len(lenders))
+    ranked = np.argsort(-totals['principal_outstanding'], kind='stable')[offset:offset + limit]
+    return {
+        'as_of': as_of,
+        'lenders': int(len(lenders)),
+        'offset': offset,
+        'limit': limit,
+        'items': [{'lender_id': int(lenders[i]), **_row(totals, i)} for i in ranked],
+        'elapsed_s': round(time.perf_counter() - started, 3),
+    }
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_results = {}
+_results_lock = threading.Lock()
+
+def _init_worker(db_path, pragma_profile):
+    """Open a pool worker's connections on the parent's database."""
+    configure_pool(path=db_path, pragma_profile=pragma_profile)
+
+def get_executor():
+    """Process pool for large portfolios, built on first use.
+
+    Workers are spawned, not forked: the API process runs threads (the
+    asyncio loop, the confirmation tracker) whose locks a fork could copy
+    while held. A worker only imports this module, db and NumPy, and
+    _init_worker points it at the parent's database.
+    """
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ProcessPoolExecutor(
+                    max_workers=PORTFOLIO_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(db.DB_PATH, db.PRAGMA_PROFILE),
+                )
+                _executor_pid = os.getpid()
+    return _executor
+
+def _submit(fn, *args):
+    global _executor
+    try:
+        return get_executor().submit(fn, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool once
+        with _executor_lock:
+            _executor = None
+        return get_executor().submit(fn, *args)
+
+def _pooled(fn, *args):
+    """Result of fn(*args) from the worker pool, shared for PORTFOLIO_CACHE_TTL seconds.
+
+    Concurrent requests for the same result wait on one computation.
+    """
+    key = (fn.__name__, *args)
+    now = time.monotonic()
+    with _results_lock:
+        expires, future = _results.get(key, (0, None))
+        if future is None or expires < now or (future.done() and future.exception()):
+            for stale in [k for k, (at, _) in _results.items() if at < now]:
+                del _results[stale]
+            future = _submit(fn, *args)
+            _results[key] = (now + PORTFOLIO_CACHE_TTL, future)
+    return future.result(timeout=PORTFOLIO_TIMEOUT)
+
+def run_portfolio_summary(lender_id=None, as_of=None):
+    """portfolio_summary() inline for small lenders, in the worker pool for large ones and the platform."""
+    as_of = as_of or _today()
+    julian_day(as_of)  # reject a bad date before it reaches a worker
+    if lender_id is not None:
+        with get_db_connection() as conn:
+            loans = conn.execute("SELECT COUNT(*) FROM Transactions WHERE lender_id = ?", (lender_id,)).fetchone()[0]
+        if loans < PORTFOLIO_POOL_THRESHOLD:
+            return portfolio_summary(lender_id, as_of)
+    return _pooled(portfolio_summary, lender_id, as_of)
+
+def run_lender_summaries(as_of=None, limit=PAGE_SIZE_DEFAULT, offset=0):
+    """lender_summaries() from the worker pool."""
+    as_of = as_of or _today()
+    julian_day(as_of)
+    return _pooled(lender_summaries, as_of, limit, offset)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Portfolio totals, yields and upcoming cash flows")
+    parser.add_argument('--lender-id', type=int, help="One lender's portfolio (default: the whole platform)")
+    parser.add_argument('--as-of', help="Split overdue from upcoming installments at this date (YYYY-MM-DD)")
+    parser.add_argument('--lenders', action='store_true', help="Per-lender table instead of one summary")
+    parser.add_argument('--limit', type=int, default=PAGE_SIZE_DEFAULT, help="Lenders to list")
+    args = parser.parse_args()
+    if args.lenders:
+        print(json.dumps(lender_summaries(args.as_of, args.limit), indent=2))
+    else:
+        print(json.dumps(portfolio_summary(args.lender_id, args.as_of), indent=2))
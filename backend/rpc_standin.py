@@ -0,0 +1,248 @@
+import argparse
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from solders.hash import Hash
+from solders.transaction import Transaction as SoldersTransaction
+
+SYSTEM_PROGRAM = '11111111111111111111111111111111'
+
+
+class RPCError(Exception):
+    def __init__(self, code, message, data=None):
+        super().__init__(message)
+        self.code = code
+        self.data = data
+
+
+class StandinRPC:
+    """Minimal in-memory Solana JSON-RPC node for benchmarks and local testing.
+
+    Implements the methods the backend calls (balances, account lookups,
+    blockhashes, sending and confirming transactions, program accounts) with
+    deterministic answers. Sent transactions are recorded and reported as
+    confirmed `confirm_after` seconds later; `latency` adds a fixed delay to
+    every call to mimic a remote node. The block height advances one block
+    every `block_time` seconds, and blockhashes stay valid for 150 blocks.
+    Not a validator: nothing is executed.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, confirm_after=0.0, block_time=0.4):
+        self.latency = latency
+        self.confirm_after = confirm_after
+        self.block_time = block_time
+        self.accounts = {}
+        self.sent = {}
+        self.blockhashes = {}
+        self.calls = []
+        self._started = time.monotonic()
+        self._height_offset = 1000
+        self.fail_sends = 0
+        self._lock = threading.Lock()
+        self._blockhash_seq = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def set_account(self, pubkey, lamports=0, data=b'', owner=SYSTEM_PROGRAM, executable=False):
+        with self._lock:
+            self.accounts[str(pubkey)] = {
+                'lamports': lamports,
+                'data': bytes(data),
+                'owner': str(owner),
+                'executable': executable,
+            }
+
+    @property
+    def block_height(self):
+        elapsed = time.monotonic() - self._started
+        return self._height_offset + (int(elapsed / self.block_time) if self.block_time else 0)
+
+    def advance_blocks(self, n=1):
+        with self._lock:
+            self._height_offset += n
+
+    # JSON-RPC methods
+
+    def _account_json(self, account, data_slice=None):
+        if account is None:
+            return None
+        data = account['data']
+        if data_slice:
+            data = data[data_slice['offset']:data_slice['offset'] + data_slice['length']]
+        return {
+            'lamports': account['lamports'],
+            'owner': account['owner'],
+            'data': [base64.b64encode(data).decode(), 'base64'],
+            'executable': account['executable'],
+            'rentEpoch': 0,
+            'space': len(account['data']),
+        }
+
+    def _context(self, value):
+        return {'context': {'slot': self.block_height}, 'value': value}
+
+    def getBalance(self, pubkey, config=None):
+        account = self.accounts.get(pubkey)
+        return self._context(account['lamports'] if account else 0)
+
+    def getAccountInfo(self, pubkey, config=None):
+        config = config or {}
+        return self._context(self._account_json(self.accounts.get(pubkey), config.get('dataSlice')))
+
+    def getMultipleAccounts(self, pubkeys, config=None):
+        config = config or {}
+        return self._context([
+            self._account_json(self.accounts.get(pubkey), config.get('dataSlice')) for pubkey in pubkeys
+        ])
+
+    def getProgramAccounts(self, program_id, config=None):
+        config = config or {}
+        matches = []
+        for pubkey, account in list(self.accounts.items()):
+            if account['owner'] != program_id:
+                continue
+            if all(self._filter_matches(account['data'], f) for f in config.get('filters', [])):
+                matches.append({'pubkey': pubkey, 'account': self._account_json(account, config.get('dataSlice'))})
+        return matches
+
+    @staticmethod
+    def _filter_matches(data, flt):
+        if 'dataSize' in flt:
+            return len(data) == flt['dataSize']
+        memcmp = flt['memcmp']
+        encoding = memcmp.get('encoding', 'base58')
+        if encoding == 'base64':
+            expected = base64.b64decode(memcmp['bytes'])
+        else:
+            from based58 import b58decode
+            expected = b58decode(memcmp['bytes'].encode())
+        offset = memcmp['offset']
+        return data[offset:offset + len(expected)] == expected
+
+    def getLatestBlockhash(self, config=None):
+        with self._lock:
+            self._blockhash_seq += 1
+            blockhash = str(Hash.hash(self._blockhash_seq.to_bytes(8, 'little')))
+            last_valid = self.block_height + 150
+            self.blockhashes[blockhash] = last_valid
+        return self._context({'blockhash': blockhash, 'lastValidBlockHeight': last_valid})
+
+    def getBlockHeight(self, config=None):
+        return self.block_height
+
+    def getMinimumBalanceForRentExemption(self, size, config=None):
+        return 890880 + 6960 * size
+
+    def sendTransaction(self, encoded, config=None):
+        config = config or {}
+        with self._lock:
+            if self.fail_sends > 0:
+                self.fail_sends -= 1
+                raise self._blockhash_not_found()
+        tx = SoldersTransaction.from_bytes(base64.b64decode(encoded))
+        signature = str(tx.signatures[0])
+        last_valid = self.blockhashes.get(str(tx.message.recent_blockhash))
+        expired = last_valid is None or self.block_height > last_valid
+        if expired and not config.get('skipPreflight'):
+            raise self._blockhash_not_found()
+        # With preflight skipped an expired transaction is accepted but
+        # silently dropped, as a real node would
+        if not expired:
+            with self._lock:
+                self.sent[signature] = {'tx': tx, 'time': time.monotonic()}
+        return signature
+
+    @staticmethod
+    def _blockhash_not_found():
+        return RPCError(-32002, 'Transaction simulation failed: Blockhash not found', {
+            'err': 'BlockhashNotFound', 'logs': [], 'accounts': None,
+            'unitsConsumed': 0, 'returnData': None,
+        })
+
+    def getSignatureStatuses(self, signatures, config=None):
+        now = time.monotonic()
+        statuses = []
+        for signature in signatures:
+            sent = self.sent.get(signature)
+            if sent is None or now - sent['time'] < self.confirm_after:
+                statuses.append(None)
+            else:
+                statuses.append({
+                    'slot': self.block_height,
+                    'confirmations': None,
+                    'err': None,
+                    'status': {'Ok': None},
+                    'confirmationStatus': 'finalized',
+                })
+        return self._context(statuses)
+
+    def _dispatch(self, request):
+        method = getattr(self, request.get('method', ''), None)
+        response = {'jsonrpc': '2.0', 'id': request.get('id')}
+        if method is None or request['method'].startswith('_'):
+            response['error'] = {'code': -32601, 'message': 'Method not found'}
+            return response
+        self.calls.append(request['method'])
+        try:
+            response['result'] = method(*request.get('params', []))
+        except RPCError as e:
+            response['error'] = {'code': e.code, 'message': str(e)}
+            if e.data is not None:
+                response['error']['data'] = e.data
+        except Exception as e:
+            response['error'] = {'code': -32603, 'message': str(e)}
+        return response
+
+    def _handler(self):
+        rpc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if rpc.latency:
+                    time.sleep(rpc.latency)
+                if isinstance(body, list):
+                    result = [rpc._dispatch(request) for request in body]
+                else:
+                    result = rpc._dispatch(body)
+                payload = json.dumps(result).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in Solana RPC node")
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every call")
+    parser.add_argument('--confirm-after', type=float, default=0.0, help="Seconds before a sent transaction confirms")
+    args = parser.parse_args()
+
+    rpc = StandinRPC(port=args.port, latency=args.latency, confirm_after=args.confirm_after)
+    print(f"Stand-in RPC listening on {rpc.url}")
+    rpc._server.serve_forever()
@@ -0,0 +1,573 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit, urlunsplit
+
+from anchorpy import Program, Provider, Wallet
+from anchorpy.coder.accounts import ACCOUNT_DISCRIMINATOR_SIZE, _account_discriminator
+from anchorpy.error import AccountDoesNotExistError
+from anchorpy_core.idl import Idl
+from base58 import b58encode
+from solana.rpc.async_api import AsyncClient
+from solana.rpc.commitment import Commitment, Confirmed
+from solana.rpc.types import DataSliceOpts, MemcmpOpts
+from solders.account_decoder import UiAccountEncoding
+from solders.commitment_config import CommitmentLevel
+from solders.keypair import Keypair
+from solders.pubkey import Pubkey
+from solders.rpc.config import RpcAccountInfoConfig
+from solders.rpc.requests import AccountSubscribe, AccountUnsubscribe
+from solders.rpc.responses import AccountNotification, SubscriptionError, SubscriptionResult, parse_websocket_message
+import websockets
+
+from idl import idl
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RPC_URL = 'https://api.devnet.solana.com'
+
+
+def default_ws_url(rpc_url):
+    """Websocket endpoint of an RPC node: ws(s):// on the same host, and the
+    next port up when one is given (solana-test-validator's 8899 -> 8900)."""
+    parts = urlsplit(rpc_url)
+    netloc = parts.netloc
+    if parts.port is not None:
+        netloc = f"{parts.hostname}:{parts.port + 1}"
+    return urlunsplit(('wss' if parts.scheme == 'https' else 'ws', netloc, parts.path, parts.query, ''))
+
+
+class SolanaRegistry:
+    """Process-wide Solana handles shared by every request.
+
+    The admin keypair, wallet and parsed IDL are built once. The AsyncClient
+    (and the Program bound to it) is created once per event loop, because its
+    HTTP connection pool is tied to the loop it was opened on; within a loop
+    every request reuses the same keep-alive connections to the RPC node.
+    """
+
+    def __init__(self, rpc_url, wallet_keypair, program_id, idl_obj, timeout=30, ws_url=None):
+        self.rpc_url = rpc_url
+        self.ws_url = ws_url or default_ws_url(rpc_url)
+        self.timeout = timeout
+        self.wallet = Wallet(wallet_keypair)
+        self.program_id = program_id
+        self.idl = idl_obj
+        self._clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        private_key = json.loads(os.getenv('WALLET_PRIVATE_KEY'))
+        wallet_keypair = Keypair.from_bytes(bytes(private_key))
+        program_id = Pubkey.from_string(os.getenv('PROGRAM_ID'))
+
+        # Update IDL with correct program ID
+        idl_copy = dict(idl)
+        idl_copy['metadata'] = {'address': str(program_id)}
+        idl_obj = Idl.from_json(json.dumps(idl_copy))
+
+        rpc_url = os.getenv('SOLANA_RPC_URL', DEFAULT_RPC_URL)
+        timeout = float(os.getenv('SOLANA_RPC_TIMEOUT', '30'))
+        return cls(rpc_url, wallet_keypair, program_id, idl_obj, timeout, os.getenv('SOLANA_WS_URL'))
+
+    def get(self):
+        """Return (client, program, wallet) for the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._clients.get(loop)
+            if entry is None:
+                client = AsyncClient(self.rpc_url, timeout=self.timeout)
+                program = Program(self.idl, self.program_id, Provider(client, self.wallet))
+                entry = (client, program)
+                self._clients[loop] = entry
+        client, program = entry
+        return client, program, self.wallet
+
+    async def close(self):
+        """Close the client owned by the running loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._clients.pop(loop, None)
+        if entry is not None:
+            await entry[0].close()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = SolanaRegistry.from_env()
+    return _registry
+
+
+# getMultipleAccounts accepts at most 100 keys per call
+MAX_ACCOUNTS_PER_REQUEST = 100
+
+
+class BalanceCache:
+    """TTL cache of lamport balances shared by all balance endpoints.
+
+    Misses are resolved with getMultipleAccounts (data sliced to zero bytes,
+    so only lamports come back), up to 100 addresses per call and all calls
+    for one lookup issued concurrently. A non-existent account has 0 lamports.
+    """
+
+    def __init__(self, ttl=10.0, commitment=Confirmed):
+        self.ttl = ttl
+        self.commitment = commitment
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, addresses, now):
+        hits = {}
+        with self._lock:
+            for address in addresses:
+                entry = self._entries.get(address)
+                if entry is not None and now - entry[1] < self.ttl:
+                    hits[address] = entry[0]
+        return hits
+
+    async def _fetch(self, client, pubkeys):
+        resp = await client.get_multiple_accounts(
+            pubkeys,
+            commitment=self.commitment,
+            data_slice=DataSliceOpts(offset=0, length=0),
+        )
+        return [account.lamports if account is not None else 0 for account in resp.value]
+
+    async def get_balances(self, client, addresses):
+        """Return {address: lamports} for base58 addresses (duplicates allowed)."""
+        addresses = list(dict.fromkeys(addresses))
+        now = time.monotonic()
+        balances = self._cached(addresses, now)
+        misses = [address for address in addresses if address not in balances]
+        if misses:
+            pubkeys = [Pubkey.from_string(address) for address in misses]
+            chunks = [pubkeys[i:i + MAX_ACCOUNTS_PER_REQUEST] for i in range(0, len(pubkeys), MAX_ACCOUNTS_PER_REQUEST)]
+            results = await asyncio.gather(*(self._fetch(client, chunk) for chunk in chunks))
+            fetched = dict(zip(misses, (lamports for chunk in results for lamports in chunk)))
+            with self._lock:
+                for address, lamports in fetched.items():
+                    self._entries[address] = (lamports, now)
+            balances.update(fetched)
+        return balances
+
+    async def get_balance(self, client, address):
+        return (await self.get_balances(client, [address]))[address]
+
+    def invalidate(self, *addresses):
+        with self._lock:
+            if not addresses:
+                self._entries.clear()
+            for address in addresses:
+                self._entries.pop(address, None)
+
+
+_balance_cache = None
+
+def get_balance_cache():
+    global _balance_cache
+    if _balance_cache is None:
+        with _registry_lock:
+            if _balance_cache is None:
+                _balance_cache = BalanceCache(
+                    ttl=float(os.getenv('BALANCE_CACHE_TTL', '10')),
+                    commitment=Commitment(os.getenv('BALANCE_COMMITMENT', 'confirmed')),
+                )
+    return _balance_cache
+
+
+# Errors that mean the transaction's blockhash is unknown to the node or has
+# expired; the send is retried once with a freshly fetched blockhash
+BLOCKHASH_ERRORS = ('BlockhashNotFound', 'Blockhash not found', 'block height exceeded')
+
+def is_blockhash_error(error):
+    message = str(error)
+    return any(marker in message for marker in BLOCKHASH_ERRORS)
+
+
+class BlockhashCache:
+    """Recent blockhash shared by every transaction-building path.
+
+    get() returns (blockhash, last_valid_block_height) without an RPC round
+    trip while the cached value is younger than max_age. The first get() on a
+    loop starts a task that refreshes it every refresh_interval seconds; the
+    task stops after idle_timeout seconds without a get(), and the next get()
+    starts it again.
+    """
+
+    def __init__(self, refresh_interval=5.0, max_age=30.0, idle_timeout=120.0, commitment=Confirmed):
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.idle_timeout = idle_timeout
+        self.commitment = commitment
+        self._value = None
+        self._fetched_at = 0.0
+        self._last_used = 0.0
+        self._inflight = weakref.WeakKeyDictionary()
+        self._refreshers = weakref.WeakKeyDictionary()
+
+    async def refresh(self, client):
+        """Fetch a new blockhash; concurrent callers on one loop share the call."""
+        loop = asyncio.get_running_loop()
+        future = self._inflight.get(loop)
+        if future is None:
+            future = loop.create_task(self._fetch(client))
+            self._inflight[loop] = future
+            future.add_done_callback(lambda _: self._inflight.pop(loop, None))
+        return await asyncio.shield(future)
+
+    async def _fetch(self, client):
+        latest = (await client.get_latest_blockhash(commitment=self.commitment)).value
+        self._value = (latest.blockhash, latest.last_valid_block_height)
+        self._fetched_at = time.monotonic()
+        return self._value
+
+    async def get(self, client):
+        now = time.monotonic()
+        self._last_used = now
+        self._ensure_refresher(client)
+        if self._value is None or now - self._fetched_at > self.max_age:
+            return await self.refresh(client)
+        return self._value
+
+    def invalidate(self):
+        self._value = None
+
+    def _ensure_refresher(self, client):
+        loop = asyncio.get_running_loop()
+        task = self._refreshers.get(loop)
+        if task is None or task.done():
+            self._refreshers[loop] = loop.create_task(self._refresh_loop(client))
+
+    async def _refresh_loop(self, client):
+        while time.monotonic() - self._last_used < self.idle_timeout:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh(client)
+            except Exception as e:
+                logger.warning(f"Blockhash refresh failed: {str(e)}")
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        task = self._refreshers.pop(loop, None)
+        if task is not None:
+            task.cancel()
+
+    async def send(self, client, build_transaction, opts=None):
+        """Send build_transaction(blockhash) (serialized bytes) with the cached
+        blockhash, retrying once with a fresh one on an expiry error.
+
+        Returns (send response, last_valid_block_height).
+        """
+        blockhash, last_valid = await self.get(client)
+        try:
+            return await client.send_raw_transaction(build_transaction(blockhash), opts=opts), last_valid
+        except Exception as e:
+            if not is_blockhash_error(e):
+                raise
+            logger.info("Blockhash expired, refreshing and re-sending")
+        self.invalidate()
+        blockhash, last_valid = await self.refresh(client)
+        return await client.send_raw_transaction(build_transaction(blockhash), opts=opts), last_valid
+
+    async def send_and_confirm(self, client, build_transaction, opts=None, commitment=None):
+        """send(), then wait for confirmation up to the blockhash's last valid
+        block height. A transaction that expired unconfirmed can no longer
+        land, so it is rebuilt with a fresh blockhash and sent once more.
+
+        Returns the send response.
+        """
+        for attempt in range(2):
+            resp, last_valid = await self.send(client, build_transaction, opts)
+            try:
+                await client.confirm_transaction(resp.value, commitment, last_valid_block_height=last_valid)
+                return resp
+            except Exception as e:
+                if attempt or not is_blockhash_error(e):
+                    raise
+                logger.info(f"Transaction {resp.value} expired unconfirmed, re-sending")
+                self.invalidate()
+
+
+_blockhash_cache = None
+
+def get_blockhash_cache():
+    global _blockhash_cache
+    if _blockhash_cache is None:
+        with _registry_lock:
+            if _blockhash_cache is None:
+                _blockhash_cache = BlockhashCache(
+                    refresh_interval=float(os.getenv('BLOCKHASH_REFRESH_INTERVAL', '5')),
+                    max_age=float(os.getenv('BLOCKHASH_MAX_AGE', '30')),
+                )
+    return _blockhash_cache
+
+
+# Read consistency for LoanAccount lookups: 'cached' may be served from
+# memory, 'fresh' always reads the account from the node
+LOAN_CONSISTENCY_LEVELS = ('cached', 'fresh')
+
+LOAN_ACCOUNT_DISCRIMINATOR = _account_discriminator('LoanAccount')
+
+# Byte sizes of the fixed-size IDL types
+IDL_TYPE_SIZES = {'bool': 1, 'u8': 1, 'u16': 2, 'u32': 4, 'u64': 8, 'i64': 8, 'publicKey': 32}
+
+def account_field_offsets(name):
+    """Byte offset of each field of an IDL account (after the discriminator)."""
+    account = next(account for account in idl['accounts'] if account['name'] == name)
+    offsets, offset = {}, ACCOUNT_DISCRIMINATOR_SIZE
+    for field in account['type']['fields']:
+        offsets[field['name']] = offset
+        offset += IDL_TYPE_SIZES[field['type']]
+    return offsets
+
+LOAN_ACCOUNT_OFFSETS = account_field_offsets('LoanAccount')
+
+
+async def find_loan_accounts(program, lender=None, borrower=None, active_only=False, commitment=Confirmed):
+    """Return [(pda, decoded LoanAccount)] for every loan of a lender and/or
+    borrower, in one getProgramAccounts call filtered on the node with
+    memcmp on the account discriminator and the fixed field offsets."""
+    filters = [MemcmpOpts(offset=0, bytes=b58encode(LOAN_ACCOUNT_DISCRIMINATOR).decode())]
+    if lender is not None:
+        filters.append(MemcmpOpts(offset=LOAN_ACCOUNT_OFFSETS['lender'], bytes=str(lender)))
+    if borrower is not None:
+        filters.append(MemcmpOpts(offset=LOAN_ACCOUNT_OFFSETS['borrower'], bytes=str(borrower)))
+    if active_only:
+        filters.append(MemcmpOpts(offset=LOAN_ACCOUNT_OFFSETS['isActive'], bytes=b58encode(b'\x01').decode()))
+    resp = await program.provider.connection.get_program_accounts(
+        program.program_id, commitment=commitment, encoding='base64', filters=filters)
+    return [(str(keyed.pubkey), program.coder.accounts.decode(keyed.account.data)) for keyed in resp.value]
+
+
+class LoanAccountCache:
+    """Decoded LoanAccount state by PDA, shared by the loan endpoints.
+
+    Every cached loan is watched with accountSubscribe over one websocket
+    connection per event loop, opened on the registry's own client by the
+    first read. A notification replaces the entry with the account's new
+    state, so a 'cached' read of a watched loan is answered from memory with
+    no RPC call for as long as the loan keeps being read. Until its
+    subscription is confirmed, and while the socket is down, an entry is only
+    served while it is younger than max_age. A 'fresh' read always fetches
+    (and refreshes the entry). Entries remember the slot they were read at and
+    are never replaced by older state. invalidate() drops an entry after one
+    of our own writes; a fetch that was already in flight when it was
+    invalidated is not cached. Loans not read for idle_timeout seconds are
+    dropped and unsubscribed.
+    """
+
+    def __init__(self, max_age=30.0, idle_timeout=300.0, reconnect_delay=5.0, commitment=Confirmed):
+        self.max_age = max_age
+        self.idle_timeout = idle_timeout
+        self.reconnect_delay = reconnect_delay
+        self.commitment = commitment
+        self._entries = {}  # pda -> [account, slot, fetched_at, last_read]
+        self._generations = {}  # pda -> number of invalidations
+        self._watched = set()  # pdas with a confirmed subscription on a live socket
+        self._lock = threading.Lock()
+        self._watchers = weakref.WeakKeyDictionary()  # loop -> watcher task
+        self._wakeups = weakref.WeakKeyDictionary()  # loop -> asyncio.Event
+
+    def _store(self, program, pda, info, slot, now, read_at=None, generation=None):
+        """Cache one account read at slot (caller holds the lock); return what the entry holds."""
+        if info is None or info.data[:ACCOUNT_DISCRIMINATOR_SIZE] != LOAN_ACCOUNT_DISCRIMINATOR:
+            self._entries.pop(pda, None)
+            return None
+        account = program.coder.accounts.decode(info.data)
+        entry = self._entries.get(pda)
+        if generation is not None and self._generations.get(pda, 0) != generation:
+            return account
+        if entry is not None and entry[1] > slot:
+            return entry[0]
+        last_read = read_at if read_at is not None else (entry[3] if entry else now)
+        self._entries[pda] = [account, slot, now, last_read]
+        return account
+
+    async def _fetch(self, program, pdas, read_at=None):
+        """Read pdas from the node and update their entries; return {pda: account or None}."""
+        with self._lock:
+            generations = {pda: self._generations.get(pda, 0) for pda in pdas}
+        chunks = [pdas[i:i + MAX_ACCOUNTS_PER_REQUEST] for i in range(0, len(pdas), MAX_ACCOUNTS_PER_REQUEST)]
+        responses = await asyncio.gather(*(
+            program.provider.connection.get_multiple_accounts(
+                [Pubkey.from_string(pda) for pda in chunk], commitment=self.commitment)
+            for chunk in chunks
+        ))
+        now = time.monotonic()
+        accounts = {}
+        with self._lock:
+            for chunk, resp in zip(chunks, responses):
+                for pda, info in zip(chunk, resp.value):
+                    accounts[pda] = self._store(program, pda, info, resp.context.slot, now, read_at, generations[pda])
+        return accounts
+
+    async def get_many(self, program, pdas, consistency='cached'):
+        """Return {pda: decoded LoanAccount, or None if there is none} for
+        base58 PDAs; misses are fetched together, 100 per call."""
+        if consistency not in LOAN_CONSISTENCY_LEVELS:
+            raise ValueError(f"Unknown consistency level: {consistency}")
+        pdas = list(dict.fromkeys(map(str, pdas)))
+        now = time.monotonic()
+        accounts = {}
+        if consistency == 'cached':
+            with self._lock:
+                for pda in pdas:
+                    entry = self._entries.get(pda)
+                    if entry is not None and (pda in self._watched or now - entry[2] < self.max_age):
+                        entry[3] = now
+                        accounts[pda] = entry[0]
+        misses = [pda for pda in pdas if pda not in accounts]
+        if misses:
+            accounts.update(await self._fetch(program, misses, read_at=now))
+            self._ensure_watcher()
+        return accounts
+
+    async def get(self, program, pda, consistency='cached'):
+        """Return the decoded LoanAccount at pda (a Pubkey or base58 string)."""
+        account = (await self.get_many(program, [pda], consistency))[str(pda)]
+        if account is None:
+            raise AccountDoesNotExistError(f"Account {pda} does not exist")
+        return account
+
+    def invalidate(self, *pdas):
+        with self._lock:
+            if not pdas:
+                pdas = list(self._entries)
+            for pda in map(str, pdas):
+                self._entries.pop(pda, None)
+                self._generations[pda] = self._generations.get(pda, 0) + 1
+
+    def _ensure_watcher(self):
+        """Start this loop's watcher if needed and have it subscribe new entries."""
+        loop = asyncio.get_running_loop()
+        wakeup = self._wakeups.get(loop)
+        if wakeup is None:
+            wakeup = self._wakeups[loop] = asyncio.Event()
+        wakeup.set()
+        task = self._watchers.get(loop)
+        if task is None or task.done():
+            self._watchers[loop] = loop.create_task(self._watch(wakeup))
+
+    async def _watch(self, wakeup):
+        delay = self.reconnect_delay
+        while True:
+            with self._lock:
+                if not self._entries:
+                    return
+            try:
+                async with websockets.connect(get_registry().ws_url, max_size=None) as ws:
+                    delay = self.reconnect_delay
+                    await self._serve(ws, wakeup)
+                    return
+            except Exception as e:
+                logger.warning(f"Loan account subscriptions dropped: {str(e)}")
+            finally:
+                with self._lock:
+                    self._watched.clear()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+
+    async def _serve(self, ws, wakeup):
+        """Keep one subscription per cached loan on ws until no loans are left."""
+        _, program, _ = get_registry().get()
+        config = RpcAccountInfoConfig(UiAccountEncoding.Base64,
+                                      commitment=CommitmentLevel.from_string(str(self.commitment)))
+        ids = itertools.count(1)
+        requests = {}  # request id -> pda
+        subscriptions = {}  # subscription id -> pda
+        rejected = set()
+        reader = asyncio.ensure_future(ws.recv())
+        try:
+            while True:
+                now = time.monotonic()
+                with self._lock:
+                    for pda in [pda for pda, entry in self._entries.items() if now - entry[3] > self.idle_timeout]:
+                        del self._entries[pda]
+                    wanted = set(self._entries)
+                    self._watched &= wanted
+                if not wanted:
+                    return
+                pending = set(subscriptions.values()) | set(requests.values()) | rejected
+                for pda in wanted - pending:
+                    request = AccountSubscribe(Pubkey.from_string(pda), config, next(ids))
+                    requests[request.id] = pda
+                    await ws.send(request.to_json())
+                for subscription, pda in list(subscriptions.items()):
+                    if pda not in wanted:
+                        del subscriptions[subscription]
+                        await ws.send(AccountUnsubscribe(subscription, next(ids)).to_json())
+
+                wakeup.clear()
+                waiter = asyncio.ensure_future(wakeup.wait())
+                done, _ = await asyncio.wait({reader, waiter}, timeout=self.idle_timeout / 4,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if reader not in done:
+                    continue
+                raw = reader.result()
+                reader = asyncio.ensure_future(ws.recv())
+                try:
+                    messages = parse_websocket_message(raw)
+                except Exception:
+                    continue  # unsubscribe acknowledgements ({"result": true}) have no message type
+                confirmed = []
+                with self._lock:
+                    for message in messages:
+                        if isinstance(message, SubscriptionResult) and message.id in requests:
+                            pda = requests.pop(message.id)
+                            subscriptions[message.result] = pda
+                            confirmed.append(pda)
+                        elif isinstance(message, SubscriptionError) and message.id in requests:
+                            pda = requests.pop(message.id)
+                            rejected.add(pda)
+                            logger.warning(f"accountSubscribe for {pda} rejected: {message.error}")
+                        elif isinstance(message, AccountNotification) and message.subscription in subscriptions:
+                            pda = subscriptions[message.subscription]
+                            if pda in self._entries:
+                                self._store(program, pda, message.result.value, message.result.context.slot, time.monotonic())
+                if confirmed:
+                    # Re-read once so a change between the first read and the
+                    # subscription is not missed, then trust the notifications
+                    try:
+                        await self._fetch(program, confirmed)
+                    except Exception as e:
+                        logger.warning(f"Loan account re-read failed: {str(e)}")
+                        self.invalidate(*confirmed)
+                    with self._lock:
+                        self._watched.update(pda for pda in confirmed if pda in self._entries)
+        finally:
+            reader.cancel()
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        task = self._watchers.pop(loop, None)
+        if task is not None:
+            task.cancel()
+
+
+_loan_account_cache = None
+
+def get_loan_account_cache():
+    global _loan_account_cache
+    if _loan_account_cache is None:
+        with _registry_lock:
+            if _loan_account_cache is None:
+                _loan_account_cache = LoanAccountCache(
+                    max_age=float(os.getenv('LOAN_CACHE_MAX_AGE', '30')),
+                    idle_timeout=float(os.getenv('LOAN_CACHE_IDLE_TIMEOUT', '300')),
+                    reconnect_delay=float(os.getenv('LOAN_CACHE_RECONNECT_DELAY', '5')),
+                    commitment=Commitment(os.getenv('LOAN_CACHE_COMMITMENT', 'confirmed')),
+                )
+    return _loan_account_cache
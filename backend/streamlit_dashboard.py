@@ -8,11 +8,18 @@ import json
 import ast
 import plotly.express as px
 import plotly.graph_objects as go
+import threading
 from datetime import datetime, timedelta
 
 # Load environment variables from .env file
 load_dotenv()
 
+DB_PATH = os.getenv('LOAN_DB_PATH', 'loan_platform.db')
+# Seconds the backend's on-chain answers are reused across reruns
+WALLET_ADDRESS_TTL = float(os.getenv('DASHBOARD_WALLET_ADDRESS_TTL', '3600'))
+WALLET_BALANCE_TTL = float(os.getenv('DASHBOARD_WALLET_BALANCE_TTL', '15'))
+PROGRAM_INFO_TTL = float(os.getenv('DASHBOARD_PROGRAM_INFO_TTL', '300'))
+
 # Function definitions first
 def convert_private_key_to_array(private_key_str):
     """Convert string representation of private key array back to array of integers"""
@@ -24,10 +31,8 @@ def convert_private_key_to_array(private_key_str):
 
 def get_user_stats():
     """Get simplified user statistics from database"""
-    conn = sqlite3.connect('loan_platform.db')
-    
     # Loan amounts by user
-    loan_amounts = pd.read_sql_query("""
+    loan_amounts = fetch_data("""
         SELECT 
             u.email,
             COUNT(p.post_id) as total_loans,
@@ -36,10 +41,10 @@ def get_user_stats():
         FROM Users u
         LEFT JOIN Posts p ON u.user_id = p.user_id
         GROUP BY u.email
-    """, conn)
+    """)
     
     # Activity over time (last 30 days)
-    activity = pd.read_sql_query("""
+    activity = fetch_data("""
         SELECT 
             DATE(created_at) as date,
             COUNT(*) as num_posts
@@ -47,27 +52,211 @@ def get_user_stats():
         GROUP BY DATE(created_at)
         ORDER BY date DESC
         LIMIT 30
-    """, conn)
+    """)
     
     # Post status distribution
-    status_dist = pd.read_sql_query("""
+    status_dist = fetch_data("""
         SELECT 
             status,
             COUNT(*) as count
         FROM Posts
         GROUP BY status
-    """, conn)
+    """)
     
-    conn.close()
     return loan_amounts, activity, status_dist
 
-# Function to fetch data from the database
-def fetch_data(query):
-    conn = sqlite3.connect('loan_platform.db')
-    df = pd.read_sql_query(query, conn)
+class DataVersion:
+    """Counts changes to the database since the dashboard started.
+
+    PRAGMA data_version on a long-lived connection changes whenever another
+    connection (the API) commits, so comparing it on every rerun tells
+    whether cached query results are still current without reading any table.
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._seen = None
+        self.version = 0
+
+    def current(self):
+        with self._lock:
+            data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._seen:
+                self._seen = data_version
+                self.version += 1
+            return self.version
+
+@st.cache_resource
+def get_data_version():
+    return DataVersion(DB_PATH)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _query(query, params, data_version):
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query(query, conn, params=params)
     conn.close()
     return df
 
+# Function to fetch data from the database; results are reused across reruns
+# and sessions until the database changes
+def fetch_data(query, params=()):
+    return _query(query, tuple(params), get_data_version().current())
+
+# Paged table views. Only the visible page and a row count are read, so the
+# tables can grow without the dashboard loading them whole. Pages are keyset
+# ranges on (sort column, key) that continue from the previous page's last
+# row, so a deep page costs the same as the first; sorts are limited to
+# columns an index returns in order. Unfiltered and status-only counts come
+# from PlatformStats; other filters COUNT(*) once per database change.
+TABLE_VIEWS = {
+    'Users': {
+        'columns': ['user_id', 'email', 'score', 'created_at', 'solana_address'],
+        'key': 'user_id',
+        'sorts': ['user_id'],
+        'date': 'created_at',
+        'status': None,
+        'statuses': (),
+        'user_filter': 'user_id = ?',
+    },
+    'Posts': {
+        'columns': ['post_id', 'user_id', 'post_type', 'loan_amount', 'interest_rate', 'status', 'created_at'],
+        'key': 'post_id',
+        'sorts': ['post_id', 'created_at'],
+        'date': 'created_at',
+        'status': 'status',
+        'statuses': ('open', 'funded', 'closed'),
+        'user_filter': 'user_id = ?',
+    },
+    'Transactions': {
+        'columns': ['transaction_id', 'lender_id', 'borrower_id', 'post_id', 'loan_amount', 'interest_rate', 'status', 'created_at'],
+        'key': 'transaction_id',
+        'sorts': ['transaction_id'],
+        'date': 'created_at',
+        'status': 'status',
+        'statuses': ('pending', 'active', 'completed', 'defaulted'),
+        'user_filter': '(lender_id = ? OR borrower_id = ?)',
+    },
+    'Payments': {
+        'columns': ['payment_id', 'transaction_id', 'due_date', 'amount_due', 'amount_paid', 'payment_status'],
+        'key': 'payment_id',
+        'sorts': ['payment_id'],
+        'date': 'due_date',
+        'status': 'payment_status',
+        'statuses': ('due', 'paid', 'late'),
+        'user_filter': 'transaction_id IN (SELECT transaction_id FROM Transactions WHERE lender_id = ? OR borrower_id = ?)',
+    },
+}
+PAGE_SIZES = [25, 50, 100, 250]
+
+def table_page_queries(table, status=None, date_range=None, user_id=None, sort=None,
+                       descending=True, cursor=None, page_size=50):
+    """Return ((page_sql, params), (count_sql, params)) for one page of a table view.
+
+    cursor is the (sort value, key) of the previous page's last row, or None
+    for the first page. The page query reads page_size + 1 rows so the caller
+    can tell whether another page follows.
+    """
+    view = TABLE_VIEWS[table]
+    conditions, params = [], []
+    if status is not None:
+        if status not in view['statuses']:
+            raise ValueError(f"Invalid status: {status}")
+        conditions.append(f"{view['status']} = ?")
+        params.append(status)
+    if date_range:
+        start, end = date_range
+        conditions.append(f"{view['date']} >= ? AND {view['date']} < date(?, '+1 day')")
+        params.extend([start.isoformat(), end.isoformat()])
+    if user_id is not None:
+        conditions.append(view['user_filter'])
+        params.extend([user_id] * view['user_filter'].count('?'))
+    count_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    sort = sort or view['key']
+    if sort not in view['sorts']:
+        raise ValueError(f"Invalid sort column: {sort}")
+    direction, after = ('DESC', '<') if descending else ('ASC', '>')
+    key = view['key']
+    page_conditions, page_params = list(conditions), list(params)
+    if cursor is not None:
+        sort_value, key_value = cursor
+        if sort == key:
+            page_conditions.append(f"{key} {after} ?")
+            page_params.append(key_value)
+        else:
+            # Row-value form so SQLite turns it into an index range, not a filter
+            page_conditions.append(f"({sort}, {key}) {after} (?, ?)")
+            page_params.extend([sort_value, key_value])
+    page_where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+    # The key breaks ties so pages never overlap
+    order = f"{sort} {direction}" if sort == key else f"{sort} {direction}, {key} {direction}"
+    page_sql = f"""
+        SELECT {', '.join(view['columns'])} FROM {table} {page_where}
+        ORDER BY {order} LIMIT ?
+    """
+    page_params.append(page_size + 1)
+
+    if date_range or user_id is not None:
+        count = (f"SELECT COUNT(*) AS row_count FROM {table} {count_where}", params)
+    else:
+        count = ("SELECT COALESCE(SUM(row_count), 0) AS row_count FROM PlatformStats WHERE scope = ?"
+                 + (" AND status = ?" if status is not None else ""),
+                 [table] + ([status] if status is not None else []))
+    return (page_sql, page_params), count
+
+def table_view(table):
+    """Filter, sort and page controls plus the visible page of a table."""
+    view = TABLE_VIEWS[table]
+    filter_cols = st.columns(4)
+    with filter_cols[0]:
+        status = None
+        if view['statuses']:
+            status = st.selectbox("Status", ['All', *view['statuses']], key=f"{table}_status")
+            status = None if status == 'All' else status
+    with filter_cols[1]:
+        dates = st.date_input(f"{view['date']} range", value=(), key=f"{table}_dates")
+        date_range = tuple(dates) if len(dates) == 2 else None
+    with filter_cols[2]:
+        user_id = st.number_input("User ID (0 = all)", min_value=0, value=0, step=1, key=f"{table}_user")
+        user_id = int(user_id) or None
+    with filter_cols[3]:
+        sort = st.selectbox("Sort by", view['sorts'], key=f"{table}_sort")
+        descending = st.checkbox("Descending", value=True, key=f"{table}_desc")
+    page_size = st.selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{table}_page_size")
+
+    _, (count_sql, count_params) = table_page_queries(table, status, date_range, user_id, sort, descending)
+    total = int(fetch_data(count_sql, count_params)['row_count'][0] or 0)
+    pages = max(1, -(-total // page_size))
+
+    # Cursors of the pages visited so far (None for the first); any filter,
+    # sort or page size change starts again from the first page
+    view_state = (status, date_range, user_id, sort, descending, page_size)
+    if st.session_state.get(f"{table}_view_state") != view_state:
+        st.session_state[f"{table}_view_state"] = view_state
+        st.session_state[f"{table}_cursors"] = [None]
+    cursors = st.session_state[f"{table}_cursors"]
+
+    (page_sql, page_params), _ = table_page_queries(
+        table, status, date_range, user_id, sort, descending, cursors[-1], page_size)
+    rows = fetch_data(page_sql, page_params)
+    has_next = len(rows) > page_size
+    rows = rows.iloc[:page_size]
+
+    next_cursor = None
+    if has_next:
+        # pandas hands back numpy scalars, which sqlite3 can't bind
+        next_cursor = tuple(v.item() if hasattr(v, 'item') else v for v in rows[[sort, view['key']]].iloc[-1])
+    page_cols = st.columns(3)
+    with page_cols[0]:
+        st.button("Previous", key=f"{table}_prev", disabled=len(cursors) == 1, on_click=cursors.pop)
+    with page_cols[1]:
+        st.caption(f"Page {len(cursors)} of {pages}")
+    with page_cols[2]:
+        st.button("Next", key=f"{table}_next", disabled=not has_next, on_click=cursors.append, args=(next_cursor,))
+    st.dataframe(rows)
+    st.caption(f"{total} rows")
+
 # Function to transfer SOL
 def transfer_sol(destination, amount):
     url = 'http://127.0.0.1:5000/api/wallet/transfer'
@@ -76,23 +265,40 @@ def transfer_sol(destination, amount):
         'amount': amount
     }
     response = requests.post(url, json=payload)
+    # The admin balance just changed
+    _get_wallet_balance.clear()
     try:
         return response.json()
     except requests.exceptions.JSONDecodeError:
         return {'success': False, 'error': 'Invalid JSON response'}
 
+# On-chain lookups are cached for their own TTLs; a failed answer is
+# dropped so the next rerun asks again
+def uncache_failure(cached_fn, result):
+    if not result.get('success'):
+        cached_fn.clear()
+    return result
+
 # Function to get wallet balance
-def get_wallet_balance():
+@st.cache_data(ttl=WALLET_BALANCE_TTL, show_spinner=False)
+def _get_wallet_balance():
     url = 'http://127.0.0.1:5000/api/wallet/balance'
     response = requests.get(url)
     return response.json()
 
+def get_wallet_balance():
+    return uncache_failure(_get_wallet_balance, _get_wallet_balance())
+
 # Function to get wallet address
-def get_wallet_address():
+@st.cache_data(ttl=WALLET_ADDRESS_TTL, show_spinner=False)
+def _get_wallet_address():
     url = 'http://127.0.0.1:5000/api/wallet/address'
     response = requests.get(url)
     return response.json()
 
+def get_wallet_address():
+    return uncache_failure(_get_wallet_address, _get_wallet_address())
+
 # Function to deploy contract
 def deploy_contract():
     url = 'http://127.0.0.1:5000/api/deploy'
@@ -100,7 +306,8 @@ def deploy_contract():
     return response.json()
 
 # Function to get program info
-def get_program_info(program_id):
+@st.cache_data(ttl=PROGRAM_INFO_TTL, show_spinner=False)
+def _get_program_info(program_id):
     url = f'http://127.0.0.1:5000/api/program/{program_id}'
     response = requests.get(url)
     try:
@@ -113,6 +320,9 @@ def get_program_info(program_id):
     except Exception as err:
         return {'success': False, 'error': f'Other error occurred: {err}'}
 
+def get_program_info(program_id):
+    return uncache_failure(_get_program_info, _get_program_info(program_id))
+
 # Streamlit app
 st.title("Loan Platform Dashboard")
 
@@ -151,56 +361,40 @@ if program_id:
 else:
     st.error("Program ID not found in environment variables")
 
-# Users Data
-st.header("Users Data")
-users_query = "SELECT user_id, email, score, created_at, solana_address FROM Users"
-users_df = fetch_data(users_query)
-st.dataframe(users_df)
-
-# Posts Data
-st.header("Posts Data")
-posts_query = "SELECT post_id, user_id, post_type, loan_amount, interest_rate, status, created_at FROM Posts"
-posts_df = fetch_data(posts_query)
-st.dataframe(posts_df)
-
-# Transactions Data
-st.header("Transactions Data")
-transactions_query = "SELECT transaction_id, lender_id, borrower_id, post_id, loan_amount, interest_rate, status, created_at FROM Transactions"
-transactions_df = fetch_data(transactions_query)
-st.dataframe(transactions_df)
-
-# Payments Data
-st.header("Payments Data")
-payments_query = "SELECT payment_id, transaction_id, due_date, amount_due, amount_paid, payment_status FROM Payments"
-payments_df = fetch_data(payments_query)
-st.dataframe(payments_df)
+# Users, Posts, Transactions and Payments Data
+for table in TABLE_VIEWS:
+    st.header(f"{table} Data")
+    table_view(table)
+
+# Headline numbers come from PlatformStats, which triggers keep current,
+# instead of SUM/AVG/COUNT scans over the whole tables on every rerun
+platform_stats_query = """
+    SELECT scope, SUM(row_count) as row_count, SUM(amount_sum) as amount_sum
+    FROM PlatformStats GROUP BY scope
+"""
+platform_stats = fetch_data(platform_stats_query).set_index('scope')
+
+def platform_stat(scope, column):
+    return platform_stats[column].get(scope, 0) or 0
 
 # Total Volume
 st.header("Total Volume")
-total_volume_query = "SELECT SUM(loan_amount) as total_volume FROM Transactions"
-total_volume_df = fetch_data(total_volume_query)
-total_volume = total_volume_df['total_volume'][0] if total_volume_df['total_volume'][0] is not None else 0
+total_volume = platform_stat('Transactions', 'amount_sum')
 st.write(f"Total Trading Volume: ${total_volume:.2f}")
 
 # Average Loan Amount
 st.header("Average Loan Amount")
-average_loan_query = "SELECT AVG(loan_amount) as average_loan FROM Transactions"
-average_loan_df = fetch_data(average_loan_query)
-average_loan = average_loan_df['average_loan'][0] if average_loan_df['average_loan'][0] is not None else 0
+num_transactions = int(platform_stat('Transactions', 'row_count'))
+average_loan = total_volume / num_transactions if num_transactions else 0
 st.write(f"Average Loan Amount: ${average_loan:.2f}")
 
 # Number of Users
 st.header("Number of Users")
-num_users_query = "SELECT COUNT(user_id) as num_users FROM Users"
-num_users_df = fetch_data(num_users_query)
-num_users = num_users_df['num_users'][0] if num_users_df['num_users'][0] is not None else 0
+num_users = int(platform_stat('Users', 'row_count'))
 st.write(f"Number of Users: {num_users}")
 
 # Number of Transactions
 st.header("Number of Transactions")
-num_transactions_query = "SELECT COUNT(transaction_id) as num_transactions FROM Transactions"
-num_transactions_df = fetch_data(num_transactions_query)
-num_transactions = num_transactions_df['num_transactions'][0] if num_transactions_df['num_transactions'][0] is not None else 0
 st.write(f"Number of Transactions: {num_transactions}")
 
 # Wallet Balance
@@ -356,7 +550,7 @@ elif action == "Transfer SOL":
             st.error("Please fill in all fields")
         else:
             try:
-                conn = sqlite3.connect('loan_platform.db')
+                conn = sqlite3.connect(DB_PATH)
                 cursor = conn.cursor()
                 
                 cursor.execute('''
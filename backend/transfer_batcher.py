@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import threading
+
+from solders.hash import Hash
+from solders.message import Message
+from solders.system_program import TransferParams, transfer
+from solders.transaction import Transaction
+
+from solana_client import get_blockhash_cache
+
+logger = logging.getLogger(__name__)
+
+PACKET_DATA_SIZE = 1232  # max serialized transaction size
+
+
+def build_transfer_transaction(payer, transfers, blockhash):
+    """Signed transaction carrying one System transfer per (destination, lamports)."""
+    instructions = [
+        transfer(TransferParams(from_pubkey=payer.pubkey(), to_pubkey=destination, lamports=lamports))
+        for destination, lamports in transfers
+    ]
+    return Transaction([payer], Message(instructions, payer.pubkey()), blockhash)
+
+def pack_transfers(payer, transfers, max_per_transaction=None):
+    """Split transfers into the fewest consecutive groups whose transaction
+    fits in one packet (and has at most max_per_transaction transfers)."""
+    groups = []
+    start = 0
+    while start < len(transfers):
+        end = start + 1
+        while end < len(transfers) and (max_per_transaction is None or end - start < max_per_transaction):
+            size = len(bytes(build_transfer_transaction(payer, transfers[start:end + 1], Hash.default())))
+            if size > PACKET_DATA_SIZE:
+                break
+            end += 1
+        groups.append((start, end))
+        start = end
+    return groups
+
+
+class TransferBatcher:
+    """Coalesces SOL transfers from the same fee payer into shared transactions.
+
+    submit() queues a transfer and waits. The first transfer queued for a
+    payer opens a window of `window` seconds; when it closes, everything
+    queued for that payer is packed into as few transactions as fit the
+    packet size limit and sent concurrently. Each caller gets
+    (signature, last_valid_block_height) for the transaction that carried its
+    transfer, or that send's exception.
+    """
+
+    def __init__(self, window=0.05, max_per_transaction=None):
+        self.window = window
+        self.max_per_transaction = max_per_transaction
+        self._queues = {}  # (loop, payer pubkey) -> [(destination, lamports, future)]
+
+    async def submit(self, client, payer, destination, lamports, opts=None):
+        loop = asyncio.get_running_loop()
+        key = (loop, payer.pubkey())
+        future = loop.create_future()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = []
+            loop.call_later(self.window, lambda: loop.create_task(self._flush(key, client, payer, opts)))
+        queue.append((destination, lamports, future))
+        return await future
+
+    async def _flush(self, key, client, payer, opts):
+        queue = self._queues.pop(key, [])
+        if not queue:
+            return
+        transfers = [(destination, lamports) for destination, lamports, _ in queue]
+        groups = pack_transfers(payer, transfers, self.max_per_transaction)
+        logger.info(f"Sending {len(queue)} transfer(s) from {payer.pubkey()} in {len(groups)} transaction(s)")
+        await asyncio.gather(*(self._send_group(client, payer, queue[start:end], opts) for start, end in groups))
+
+    async def _send_group(self, client, payer, entries, opts):
+        transfers = [(destination, lamports) for destination, lamports, _ in entries]
+        try:
+            resp, last_valid = await get_blockhash_cache().send(
+                client, lambda blockhash: bytes(build_transfer_transaction(payer, transfers, blockhash)), opts)
+            result, error = (str(resp.value), last_valid), None
+        except Exception as e:
+            result, error = None, e
+        for _, _, future in entries:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_transfer_batcher = None
+_transfer_batcher_lock = threading.Lock()
+
+def get_transfer_batcher():
+    global _transfer_batcher
+    if _transfer_batcher is None:
+        with _transfer_batcher_lock:
+            if _transfer_batcher is None:
+                max_per_transaction = os.getenv('TRANSFER_BATCH_MAX')
+                _transfer_batcher = TransferBatcher(
+                    window=float(os.getenv('TRANSFER_BATCH_WINDOW', '0.05')),
+                    max_per_transaction=int(max_per_transaction) if max_per_transaction else None,
+                )
+    return _transfer_batcher
@@ -18,6 +18,7 @@ CREATE TABLE Posts (
     payment_schedule_id INTEGER,
     status TEXT CHECK(status IN ('open', 'funded', 'closed')) DEFAULT 'open',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    filled_amount REAL DEFAULT 0, -- amount matched so far by the matching engine
     FOREIGN KEY (user_id) REFERENCES Users(user_id),
     FOREIGN KEY (payment_schedule_id) REFERENCES PaymentSchedules(schedule_id)
 );
@@ -41,9 +42,11 @@ CREATE TABLE Transactions (
     blockchain_tx_id TEXT, -- Reference to Solana blockchain transaction ID
     status TEXT CHECK(status IN ('pending', 'active', 'completed', 'defaulted')) DEFAULT 'pending',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    borrow_post_id INTEGER, -- borrow post of a matched pair (post_id is the lend post)
     FOREIGN KEY (lender_id) REFERENCES Users(user_id),
     FOREIGN KEY (borrower_id) REFERENCES Users(user_id),
     FOREIGN KEY (post_id) REFERENCES Posts(post_id),
+    FOREIGN KEY (borrow_post_id) REFERENCES Posts(post_id),
     FOREIGN KEY (payment_schedule_id) REFERENCES PaymentSchedules(schedule_id)
 );
 
@@ -56,5 +59,169 @@ CREATE TABLE Payments (
     amount_paid REAL DEFAULT 0,
     payment_status TEXT CHECK(payment_status IN ('due', 'paid', 'late')) DEFAULT 'due',
     blockchain_payment_id TEXT, -- Solana payment reference
+    principal_due REAL DEFAULT 0, -- principal part of amount_due (amortization.py)
+    interest_due REAL DEFAULT 0,  -- interest part of amount_due
     FOREIGN KEY (transaction_id) REFERENCES Transactions(transaction_id)
 );
+
+-- Signatures the confirmation tracker follows until they land or expire
+CREATE TABLE SignatureStatuses (
+    signature TEXT PRIMARY KEY,
+    kind TEXT NOT NULL, -- 'transfer', 'transfer_batch', 'payment'
+    transaction_id INTEGER, -- Transactions row updated once the signature confirms
+    status TEXT CHECK(status IN ('pending', 'confirmed', 'failed', 'expired')) DEFAULT 'pending',
+    confirmation_status TEXT, -- processed / confirmed / finalized as last reported
+    slot INTEGER,
+    error TEXT,
+    last_valid_block_height INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (transaction_id) REFERENCES Transactions(transaction_id)
+);
+
+-- One row per late-payment sweep (payment_sweeper.py)
+CREATE TABLE SweepRuns (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    as_of DATE NOT NULL, -- installments due before this date were swept
+    grace_days INTEGER, -- days late before a loan defaults; NULL if defaults were skipped
+    payments_marked_late INTEGER NOT NULL DEFAULT 0,
+    transactions_defaulted INTEGER NOT NULL DEFAULT 0,
+    chunks INTEGER NOT NULL DEFAULT 0, -- write transactions the run took
+    max_chunk_ms REAL, -- longest of them
+    duration_s REAL
+);
+
+-- Running counts and sums per table and status, maintained by the triggers
+-- below (generated by db.stats_trigger_sql); scope is the table name
+CREATE TABLE PlatformStats (
+    scope TEXT NOT NULL,
+    status TEXT NOT NULL, -- '' for Users
+    row_count INTEGER NOT NULL DEFAULT 0,
+    amount_sum REAL NOT NULL DEFAULT 0, -- loan_amount, or amount_due for Payments
+    paid_sum REAL NOT NULL DEFAULT 0, -- amount_paid (Payments only)
+    PRIMARY KEY (scope, status)
+) WITHOUT ROWID;
+
+CREATE TRIGGER stats_users_insert AFTER INSERT ON Users BEGIN
+    INSERT INTO PlatformStats (scope, status, row_count, amount_sum, paid_sum)
+    VALUES ('Users', '', 1, 0, 0)
+    ON CONFLICT(scope, status) DO UPDATE SET row_count = row_count + 1,
+        amount_sum = amount_sum + excluded.amount_sum, paid_sum = paid_sum + excluded.paid_sum;
+END;
+CREATE TRIGGER stats_users_delete AFTER DELETE ON Users BEGIN
+    UPDATE PlatformStats
+    SET row_count = row_count - 1, amount_sum = amount_sum - 0, paid_sum = paid_sum - 0
+    WHERE scope = 'Users' AND status = '';
+END;
+CREATE TRIGGER stats_posts_insert AFTER INSERT ON Posts BEGIN
+    INSERT INTO PlatformStats (scope, status, row_count, amount_sum, paid_sum)
+    VALUES ('Posts', COALESCE(NEW.status, ''), 1, COALESCE(NEW.loan_amount, 0), 0)
+    ON CONFLICT(scope, status) DO UPDATE SET row_count = row_count + 1,
+        amount_sum = amount_sum + excluded.amount_sum, paid_sum = paid_sum + excluded.paid_sum;
+END;
+CREATE TRIGGER stats_posts_delete AFTER DELETE ON Posts BEGIN
+    UPDATE PlatformStats
+    SET row_count = row_count - 1, amount_sum = amount_sum - COALESCE(OLD.loan_amount, 0), paid_sum = paid_sum - 0
+    WHERE scope = 'Posts' AND status = COALESCE(OLD.status, '');
+END;
+CREATE TRIGGER stats_posts_update AFTER UPDATE OF status, loan_amount ON Posts BEGIN
+    UPDATE PlatformStats
+    SET row_count = row_count - 1, amount_sum = amount_sum - COALESCE(OLD.loan_amount, 0), paid_sum = paid_sum - 0
+    WHERE scope = 'Posts' AND status = COALESCE(OLD.status, '');
+    INSERT INTO PlatformStats (scope, status, row_count, amount_sum, paid_sum)
+    VALUES ('Posts', COALESCE(NEW.status, ''), 1, COALESCE(NEW.loan_amount, 0), 0)
+    ON CONFLICT(scope, status) DO UPDATE SET row_count = row_count + 1,
+        amount_sum = amount_sum + excluded.amount_sum, paid_sum = paid_sum + excluded.paid_sum;
+END;
+CREATE TRIGGER stats_transactions_insert AFTER INSERT ON Transactions BEGIN
+    INSERT INTO PlatformStats (scope, status, row_count, amount_sum, paid_sum)
+    VALUES ('Transactions', COALESCE(NEW.status, ''), 1, COALESCE(NEW.loan_amount, 0), 0)
+    ON CONFLICT(scope, status) DO UPDATE SET row_count = row_count + 1,
+        amount_sum = amount_sum + excluded.amount_sum, paid_sum = paid_sum + excluded.paid_sum;
+END;
+CREATE TRIGGER stats_transactions_delete AFTER DELETE ON Transactions BEGIN
+    UPDATE PlatformStats
+    SET row_count = row_count - 1, amount_sum = amount_sum - COALESCE(OLD.loan_amount, 0), paid_sum = paid_sum - 0
+    WHERE scope = 'Transactions' AND status = COALESCE(OLD.status, '');
+END;
+CREATE TRIGGER stats_transactions_update AFTER UPDATE OF status, loan_amount ON Transactions BEGIN
+    UPDATE PlatformStats
+    SET row_count = row_count - 1, amount_sum = amount_sum - COALESCE(OLD.loan_amount, 0), paid_sum = paid_sum - 0
+    WHERE scope = 'Transactions' AND status = COALESCE(OLD.status, '');
+    INSERT INTO PlatformStats (scope, status, row_count, amount_sum, paid_sum)
+    VALUES ('Transactions', COALESCE(NEW.status, ''), 1, COALESCE(NEW.loan_amount, 0), 0)
+    ON CONFLICT(scope, status) DO UPDATE SET row_count = row_count + 1,
+        amount_sum = amount_sum + excluded.amount_sum, paid_sum = paid_sum + excluded.paid_sum;
+END;
+CREATE TRIGGER stats_payments_insert AFTER INSERT ON Payments BEGIN
+    INSERT INTO PlatformStats (scope, status, row_count, amount_sum, paid_sum)
+    VALUES ('Payments', COALESCE(NEW.payment_status, ''), 1, COALESCE(NEW.amount_due, 0), COALESCE(NEW.amount_paid, 0))
+    ON CONFLICT(scope, status) DO UPDATE SET row_count = row_count + 1,
+        amount_sum = amount_sum + excluded.amount_sum, paid_sum = paid_sum + excluded.paid_sum;
+END;
+CREATE TRIGGER stats_payments_delete AFTER DELETE ON Payments BEGIN
+    UPDATE PlatformStats
+    SET row_count = row_count - 1, amount_sum = amount_sum - COALESCE(OLD.amount_due, 0), paid_sum = paid_sum - COALESCE(OLD.amount_paid, 0)
+    WHERE scope = 'Payments' AND status = COALESCE(OLD.payment_status, '');
+END;
+CREATE TRIGGER stats_payments_update AFTER UPDATE OF payment_status, amount_due, amount_paid ON Payments BEGIN
+    UPDATE PlatformStats
+    SET row_count = row_count - 1, amount_sum = amount_sum - COALESCE(OLD.amount_due, 0), paid_sum = paid_sum - COALESCE(OLD.amount_paid, 0)
+    WHERE scope = 'Payments' AND status = COALESCE(OLD.payment_status, '');
+    INSERT INTO PlatformStats (scope, status, row_count, amount_sum, paid_sum)
+    VALUES ('Payments', COALESCE(NEW.payment_status, ''), 1, COALESCE(NEW.amount_due, 0), COALESCE(NEW.amount_paid, 0))
+    ON CONFLICT(scope, status) DO UPDATE SET row_count = row_count + 1,
+        amount_sum = amount_sum + excluded.amount_sum, paid_sum = paid_sum + excluded.paid_sum;
+END;
+
+-- Users to rescore on the next incremental credit-scoring run (credit_scoring.py)
+CREATE TABLE ScoreQueue (
+    user_id INTEGER PRIMARY KEY,
+    seq INTEGER NOT NULL -- higher than any queued entry when last touched
+);
+CREATE INDEX score_queue_seq ON ScoreQueue(seq);
+
+CREATE TRIGGER score_queue_users_insert AFTER INSERT ON Users BEGIN
+    INSERT INTO ScoreQueue (user_id, seq)
+    SELECT user_id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM ScoreQueue) FROM (SELECT NEW.user_id AS user_id)
+    WHERE user_id IS NOT NULL
+    ON CONFLICT(user_id) DO UPDATE SET seq = excluded.seq;
+END;
+CREATE TRIGGER score_queue_transactions_insert AFTER INSERT ON Transactions BEGIN
+    INSERT INTO ScoreQueue (user_id, seq)
+    SELECT user_id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM ScoreQueue) FROM (SELECT NEW.borrower_id AS user_id)
+    WHERE user_id IS NOT NULL
+    ON CONFLICT(user_id) DO UPDATE SET seq = excluded.seq;
+END;
+CREATE TRIGGER score_queue_transactions_update AFTER UPDATE OF status, loan_amount, borrower_id ON Transactions BEGIN
+    INSERT INTO ScoreQueue (user_id, seq)
+    SELECT user_id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM ScoreQueue) FROM (SELECT OLD.borrower_id AS user_id UNION SELECT NEW.borrower_id)
+    WHERE user_id IS NOT NULL
+    ON CONFLICT(user_id) DO UPDATE SET seq = excluded.seq;
+END;
+CREATE TRIGGER score_queue_payments_update AFTER UPDATE OF payment_status, amount_due, amount_paid ON Payments BEGIN
+    INSERT INTO ScoreQueue (user_id, seq)
+    SELECT user_id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM ScoreQueue) FROM (SELECT borrower_id AS user_id FROM Transactions WHERE transaction_id = NEW.transaction_id)
+    WHERE user_id IS NOT NULL
+    ON CONFLICT(user_id) DO UPDATE SET seq = excluded.seq;
+END;
+CREATE TRIGGER score_queue_payments_delete AFTER DELETE ON Payments BEGIN
+    INSERT INTO ScoreQueue (user_id, seq)
+    SELECT user_id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM ScoreQueue) FROM (SELECT borrower_id AS user_id FROM Transactions WHERE transaction_id = OLD.transaction_id)
+    WHERE user_id IS NOT NULL
+    ON CONFLICT(user_id) DO UPDATE SET seq = excluded.seq;
+END;
+
+-- Indexes for the hot query paths (kept in sync with db.INDEXES)
+CREATE INDEX idx_posts_open_created ON Posts(created_at, post_id) WHERE status = 'open';
+CREATE INDEX idx_posts_status_created ON Posts(status, created_at);
+CREATE INDEX idx_posts_created ON Posts(created_at, post_id);
+CREATE INDEX idx_posts_user ON Posts(user_id);
+CREATE INDEX idx_transactions_lender ON Transactions(lender_id);
+CREATE INDEX idx_transactions_borrower ON Transactions(borrower_id);
+CREATE INDEX idx_transactions_post ON Transactions(post_id);
+CREATE INDEX idx_payments_transaction_status ON Payments(transaction_id, payment_status);
+CREATE INDEX idx_payments_transaction_due ON Payments(transaction_id, due_date);
+CREATE INDEX idx_payments_status_due ON Payments(payment_status, due_date);
+CREATE INDEX idx_signatures_pending ON SignatureStatuses(created_at) WHERE status = 'pending';